@@ -0,0 +1,290 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict
+
+# Copies of a page image alive while its VLM call runs: the encoded bytes,
+# the base64 data URI and the serialized request body
+IMAGE_COPIES = 3
+# Encoded size assumed for a page before any page has been measured
+INITIAL_PAGE_BYTES = 1024 * 1024
+
+
+class Overloaded(Exception):
+    """Raised when too many documents are pending to admit another one"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many pending documents, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def page_cost(page) -> int:
+    """
+    Bytes a rendered page keeps in memory until its VLM stage is done
+    (pages from the text layer and blank pages cost nothing)
+    """
+    encoded = len(page.image) + sum(len(tile.image) for tile in page.tiles)
+    return encoded * IMAGE_COPIES
+
+
+class MemoryBudget:
+    """
+    Process-wide budget for page images held in memory, shared by every
+    document being processed.
+
+    A page is charged from the moment its rendering starts until its VLM
+    stage finishes. Before a renderer starts on a page, the expected cost
+    of a page (moving average of the pages seen so far) is reserved; no
+    rendering starts while the budget is exhausted, and the reservation is
+    corrected to the actual cost once the page is there.
+    Waiters are served in FIFO order. A page larger than the whole budget
+    is admitted when nothing else is in memory. `max_bytes` = 0 disables
+    the budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.pages = 0
+        self.page_estimate = INITIAL_PAGE_BYTES * IMAGE_COPIES
+        self.counters = {"pages": 0, "waits": 0, "wait_seconds": 0.0, "oversized": 0}
+        self._waiters: deque = deque()  # (future, amount)
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_bytes <= 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, amount: int) -> bool:
+        return self.unlimited or self.used == 0 or self.used + amount <= self.max_bytes
+
+    def try_acquire(self, amount: int) -> bool:
+        """
+        Take `amount` only if it is available right now (no one is waiting)
+        """
+        if self._waiters or not self._fits(amount):
+            return False
+        self.used += amount
+        return True
+
+    async def acquire(self, amount: int):
+        if not self._waiters and self._fits(amount):
+            self.used += amount
+            return
+        self.counters["waits"] += 1
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, amount))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just before the cancellation landed
+                self.release(amount)
+            else:
+                self._waiters = deque(w for w in self._waiters if w[0] is not waiter)
+                # A smaller request behind this one may fit now
+                self._wake()
+            raise
+        finally:
+            self.counters["wait_seconds"] += time.monotonic() - started
+
+    def release(self, amount: int):
+        self.used -= amount
+        self._wake()
+
+    def adjust(self, reserved: int, actual: int):
+        """
+        Replace a reservation by the actual cost, without waiting: the page
+        already exists
+        """
+        self.used += actual - reserved
+        if actual > self.max_bytes and not self.unlimited:
+            self.counters["oversized"] += 1
+        if actual > 0:
+            self.page_estimate = int(0.8 * self.page_estimate + 0.2 * actual)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            waiter, amount = self._waiters[0]
+            if not waiter.done():
+                if not self._fits(amount):
+                    return
+                self.used += amount
+                waiter.set_result(None)
+            self._waiters.popleft()
+
+    def snapshot(self) -> dict:
+        return {
+            "max_bytes": self.max_bytes or None,
+            "used_bytes": self.used,
+            "pages_in_memory": self.pages,
+            "page_estimate_bytes": self.page_estimate,
+            "waiting": self.queued,
+            **self.counters,
+            "wait_seconds": round(self.counters["wait_seconds"], 3),
+        }
+
+
+class PageMemory:
+    """
+    Memory budget accounting for the pages of one document.
+
+    The renderer calls `reserve` before it starts rendering pages (page
+    ranges on the raster pool, prefetched pages on the render thread), so
+    pages waiting in a prefetch window or in a worker pipe are charged too.
+    `watch` turns each reservation into the actual cost of the page once it
+    arrives; `stage` wraps the VLM stage so the page is released as soon as
+    its markdown is there. `close` releases pages that never reached the
+    VLM stage (e.g. cancelled) and reservations of pages never rendered.
+    """
+
+    def __init__(self, budget: MemoryBudget):
+        self.budget = budget
+        self._charges: Dict[int, int] = {}  # id(page) -> bytes
+        self._reserved: deque = deque()  # per page being rendered, in page order
+
+    async def reserve(self, pages: int, wait: bool = True) -> bool:
+        """
+        Reserve the expected cost of the next `pages` pages before rendering
+        them. Without `wait`, only when the budget has room right now: a
+        renderer holding rendered pages must not wait for more room, or the
+        pages that would free it are never handed over.
+        Returns: whether the pages were reserved
+        """
+        estimate = self.budget.page_estimate
+        if wait:
+            await self.budget.acquire(estimate * pages)
+        elif not self.budget.try_acquire(estimate * pages):
+            return False
+        self._reserved.extend([estimate] * pages)
+        return True
+
+    def unreserve(self, pages: int):
+        """
+        Give back the reservations of the last `pages` pages, which will not
+        be rendered (e.g. prefetching past the end of the document)
+        """
+        for _ in range(min(pages, len(self._reserved))):
+            self.budget.release(self._reserved.pop())
+
+    async def watch(self, pages) -> AsyncIterator:
+        try:
+            async for page in pages:
+                # Pages from a renderer that did not reserve are charged as is
+                reserved = self._reserved.popleft() if self._reserved else 0
+                cost = page_cost(page)
+                self.budget.adjust(reserved, cost)
+                self.budget.pages += 1
+                self.budget.counters["pages"] += 1
+                self._charges[id(page)] = cost
+                yield page
+        finally:
+            if hasattr(pages, "aclose"):
+                await pages.aclose()
+
+    def _release(self, page):
+        cost = self._charges.pop(id(page), None)
+        if cost is not None:
+            self.budget.pages -= 1
+            self.budget.release(cost)
+
+    def stage(self, vlm_stage: Callable) -> Callable:
+        async def run(page):
+            try:
+                return await vlm_stage(page)
+            finally:
+                self._release(page)
+
+        return run
+
+    def close(self):
+        for cost in self._charges.values():
+            self.budget.pages -= 1
+            self.budget.release(cost)
+        self._charges.clear()
+        self.unreserve(len(self._reserved))
+
+
+class AdmissionController:
+    """
+    Bounds the documents pending at once (being uploaded, waiting for
+    memory or processed). Beyond `max_documents`, new documents are
+    rejected with Overloaded instead of queueing without limit; 0 = no limit.
+    Work that was already accepted (a queued job picked up by a worker)
+    waits for a slot with `acquire` instead, ahead of new documents.
+    """
+
+    def __init__(self, budget: MemoryBudget, max_documents: int = 16, retry_after: int = 10):
+        self.budget = budget
+        self.max_documents = max_documents
+        self.retry_after = retry_after
+        self.documents = 0
+        self.counters = {"admitted": 0, "rejected": 0}
+        self._waiters: deque = deque()
+
+    def _free(self) -> bool:
+        return not self.max_documents or self.documents < self.max_documents
+
+    def admit(self) -> Callable[[], None]:
+        """
+        Take a document slot
+        Returns: the function releasing it (safe to call more than once)
+        Raises: Overloaded when the queue is full
+        """
+        if self._waiters or not self._free():
+            self.counters["rejected"] += 1
+            raise Overloaded(self.retry_after)
+        return self._take()
+
+    async def acquire(self) -> Callable[[], None]:
+        """
+        Wait for a document slot, in FIFO order
+        Returns: the function releasing it (safe to call more than once)
+        """
+        if not self._waiters and self._free():
+            return self._take()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just before the cancellation landed
+                waiter.result()()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def _take(self) -> Callable[[], None]:
+        self.documents += 1
+        self.counters["admitted"] += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.documents -= 1
+                self._wake()
+
+        return release
+
+    def _wake(self):
+        while self._waiters and self._free():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(self._take())
+
+    def snapshot(self) -> dict:
+        return {
+            "documents": self.documents,
+            "max_documents": self.max_documents or None,
+            "waiting": len(self._waiters),
+            **self.counters,
+            "memory": self.budget.snapshot(),
+        }
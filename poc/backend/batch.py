@@ -0,0 +1,231 @@
+import asyncio
+import io
+import os
+import zipfile
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Union
+
+from uploads import UploadSpool, detect_file_type
+
+IMAGE_TYPES = ("tiff", "jpeg", "png")
+UNSUPPORTED_TYPE = "Unsupported file type (expected PDF, TIFF, JPEG, PNG or ZIP)"
+# Read size when extracting archive members
+ZIP_CHUNK = 1024 * 1024
+
+
+@dataclass
+class BatchFile:
+    """
+    One file of a batch: a PDF spool ready for the pipeline (images already
+    converted, archives already expanded), or the error that stopped it
+    """
+
+    name: str
+    spool: Optional[UploadSpool] = None
+    error: Optional[str] = None
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+
+class _SpoolFactory:
+    """
+    Spools created while preparing a batch, keeping at most `memory_limit`
+    bytes in memory across all of them
+    """
+
+    def __init__(self, memory_limit: int, spool_dir: str):
+        self.memory_limit = memory_limit
+        self.spool_dir = spool_dir
+        self.created: List[UploadSpool] = []
+        self.closed = False
+
+    def create(self, filename: str, data: Optional[bytes] = None) -> UploadSpool:
+        if self.closed:
+            # An extraction thread outliving a cancelled batch stops here
+            raise RuntimeError("Batch preparation was abandoned")
+        in_memory = sum(spool.size for spool in self.created if spool.in_memory)
+        suffix = os.path.splitext(filename)[1].lower()
+        spool = UploadSpool(
+            filename, max(0, self.memory_limit - in_memory), self.spool_dir, suffix
+        )
+        self.created.append(spool)
+        if data is not None:
+            spool.write(data)
+            spool.finish()
+        return spool
+
+    def close(self):
+        """
+        Close every spool created so far that is still open
+        """
+        self.closed = True
+        for spool in self.created:
+            if not spool.closed:
+                spool.close()
+
+
+def _is_archive_junk(name: str) -> bool:
+    return name.startswith("__MACOSX/") or os.path.basename(name).startswith(".")
+
+
+def extract_zip(
+    archive: UploadSpool,
+    spools: _SpoolFactory,
+    max_files: int,
+    max_file_bytes: int,
+    max_total_bytes: int,
+) -> List[BatchFile]:
+    """
+    Files of a ZIP archive, each in its own spool. Sizes are enforced while
+    decompressing (declared sizes can lie), so an archive bomb stops at the
+    limits; members over a limit are reported as errors.
+    """
+    source: Union[bytes, str] = archive.source
+    try:
+        zip_file = zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source)
+    except (zipfile.BadZipFile, OSError) as e:
+        return [BatchFile(archive.filename, error=f"Invalid ZIP archive: {e}")]
+
+    files: List[BatchFile] = []
+    total = 0
+    with zip_file:
+        members = [
+            info
+            for info in zip_file.infolist()
+            if not info.is_dir() and not _is_archive_junk(info.filename)
+        ]
+        for info in members:
+            name = f"{archive.filename}/{info.filename}"
+            if len(files) >= max_files:
+                error = "Archive has more files than the batch allows"
+                files.append(BatchFile(archive.filename, error=error))
+                break
+            if info.flag_bits & 0x1:
+                files.append(BatchFile(name, error="Encrypted archive members are not supported"))
+                continue
+            spool = spools.create(name)
+            try:
+                with zip_file.open(info) as member:
+                    for chunk in iter(lambda: member.read(ZIP_CHUNK), b""):
+                        total += len(chunk)
+                        if total > max_total_bytes:
+                            spool.discard("Archive is too large once extracted")
+                            break
+                        spool.write(chunk)
+                        if spool.size > max_file_bytes:
+                            spool.discard("File is too large")
+                            break
+            except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                spool.discard(f"Invalid ZIP member: {e}")
+            spool.finish()
+            files.append(BatchFile(name, spool=spool))
+            if total > max_total_bytes:
+                break
+    return files
+
+
+async def prepare_batch(
+    uploads: List[UploadSpool],
+    convert_images: Callable[[Union[bytes, str], str], Awaitable[bytes]],
+    memory_limit: int,
+    spool_dir: str,
+    max_files: int,
+    max_file_bytes: int,
+    max_total_bytes: int,
+) -> List[BatchFile]:
+    """
+    Turn the uploaded files into PDFs for the pipeline, in upload order.
+    PDFs are used as they are, images (multi-page TIFF, JPEG, PNG) are
+    converted with `convert_images(source, file_type)` and ZIP archives are
+    expanded (one level). Each problem is reported on its own file.
+    The uploads are owned by the batch from here on.
+    """
+    spools = _SpoolFactory(memory_limit, spool_dir)
+    files: List[BatchFile] = []
+    try:
+        for position, upload in enumerate(uploads):
+            if detect_file_type(upload.head) == "zip" and upload.error is None:
+                # Room left once the uploads after this one are counted
+                room = max_files - len(files) - (len(uploads) - position - 1)
+                members = await asyncio.to_thread(
+                    extract_zip, upload, spools, room, max_file_bytes, max_total_bytes
+                )
+                upload.close()
+                files.extend(members)
+            else:
+                files.append(BatchFile(upload.filename, spool=upload))
+
+        for batch_file in files:
+            spool = batch_file.spool
+            if spool is None:
+                continue
+            file_type = detect_file_type(spool.head)
+            if spool.error is not None or file_type != "pdf":
+                if spool.error is not None:
+                    batch_file.error = spool.error
+                elif file_type == "zip":
+                    batch_file.error = "Nested archives are not supported"
+                elif file_type not in IMAGE_TYPES:
+                    batch_file.error = UNSUPPORTED_TYPE
+                else:
+                    try:
+                        pdf = await convert_images(spool.source, file_type)
+                    except Exception as e:
+                        batch_file.error = f"Could not read image: {e}"
+                    else:
+                        batch_file.spool = spools.create(f"{batch_file.name}.pdf", pdf)
+                spool.close()
+                if batch_file.error is not None:
+                    batch_file.spool = None
+    except BaseException:
+        # Nothing is handed over: close the uploads not reached yet and every
+        # spool created so far, including those of a half-extracted archive
+        for upload in uploads:
+            if not upload.closed:
+                upload.close()
+        spools.close()
+        raise
+    return files
+
+
+async def run_batch(
+    files: List[BatchFile],
+    process: Callable[[UploadSpool, asyncio.Semaphore], Awaitable[dict]],
+    max_inflight_pages: int,
+) -> dict:
+    """
+    Process every file of a batch at once. `process(spool, slots)` runs the
+    document pipeline with `slots` as its page slots, so the pages of all
+    files share one pool of `max_inflight_pages` and no file waits for the
+    previous one to finish. At most as many files as page slots are in
+    progress at once: each holds at least one rendered page while waiting
+    for a slot, so more would only hold more of the memory budget. A
+    failing file only affects its own entry.
+    Returns: Response dict with one entry per file, in upload order
+    """
+    slots = asyncio.Semaphore(max(1, max_inflight_pages))
+    documents = asyncio.Semaphore(max(1, max_inflight_pages))
+
+    async def run_file(batch_file: BatchFile) -> dict:
+        if batch_file.error is not None:
+            return {"file": batch_file.name, "success": False, "error": batch_file.error}
+        try:
+            async with documents:
+                response = await process(batch_file.spool, slots)
+        except Exception as e:
+            print(f"❌ {batch_file.name} failed: {str(e)}")
+            return {"file": batch_file.name, "success": False, "error": str(e)}
+        return {"file": batch_file.name, **response}
+
+    results = await asyncio.gather(*(run_file(batch_file) for batch_file in files))
+    failed = sum(1 for result in results if not result["success"])
+    return {
+        "success": failed == 0,
+        "total_files": len(results),
+        "failed_files": failed,
+        "total_pages": sum(result.get("total_pages", 0) for result in results),
+        "files": results,
+    }
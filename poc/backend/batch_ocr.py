@@ -0,0 +1,374 @@
+"""
+Bulk offline OCR of a directory or manifest of PDFs into a JSONL file.
+
+Runs the same page pipeline as the API (aiter_document_pages ->
+extract_page_markdown -> parse_markdown: text layer, blank pages, tiling,
+rules and the result cache included) without HTTP, several documents and
+pages at a time. Pages are not grouped into invoices, and repeated pages
+are not detected (their original may have been done in an earlier run).
+Each successful page is appended to the output as one JSON line and
+recorded in a checkpoint manifest, so an interrupted run can simply be
+restarted: pages already done are skipped without being rendered and
+failed pages are retried. Failures go to a separate errors JSONL. Throughput, ETA and errors are printed to stderr as
+it runs (--quiet hides the per-page pipeline logs on stdout).
+
+    python batch_ocr.py invoices/ --output results.jsonl
+    python batch_ocr.py --manifest files.txt --output results.jsonl --documents 8 --pages 16
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+
+from admission import PageMemory
+from pipeline import PageExecutor
+
+
+def iter_inputs(directory: Optional[str], manifest: Optional[str]) -> Iterator[str]:
+    """
+    PDF paths from a directory (recursively, sorted) or from a manifest file
+    with one path per line (blank lines and # comments are ignored; relative
+    paths are relative to the manifest)
+    """
+    if directory:
+        for path in sorted(Path(directory).rglob("*")):
+            if path.is_file() and path.suffix.lower() == ".pdf":
+                yield str(path)
+    if manifest:
+        base = Path(manifest).parent
+        with open(manifest, encoding="utf-8") as lines:
+            for line in lines:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield str(base / line)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    Manifest of completed pages (JSONL, one line per page), keyed by the
+    sha256 of the document so renamed or moved files are still recognised.
+    Lines are flushed after the page result itself, so a killed run can at
+    worst write the pages it was finishing twice to the output.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Dict[str, Set[int]] = {}
+        self.total_pages: Dict[str, int] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as lines:
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # last line of a killed run
+                    self.done.setdefault(entry["sha256"], set()).add(entry["page"])
+                    self.total_pages[entry["sha256"]] = entry["total_pages"]
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_complete(self, sha256: str) -> bool:
+        total = self.total_pages.get(sha256)
+        return total is not None and len(self.done.get(sha256, ())) >= total
+
+    def pages_done(self, sha256: str) -> Set[int]:
+        return self.done.get(sha256, set())
+
+    def record(self, document: str, sha256: str, page: int, total_pages: int):
+        self.done.setdefault(sha256, set()).add(page)
+        self.total_pages[sha256] = total_pages
+        entry = {"document": document, "sha256": sha256, "page": page, "total_pages": total_pages}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    """
+    Counters of one batch run, printed as a one-line status
+    """
+
+    def __init__(self, documents: int):
+        self.documents = documents
+        self.started = time.monotonic()
+        self.counters = {
+            "documents_done": 0,
+            "documents_skipped": 0,
+            "documents_failed": 0,
+            "pages_done": 0,
+            "pages_skipped": 0,
+            "pages_failed": 0,
+        }
+        self.document_pages: List[int] = []
+        self.errors: Counter = Counter()
+
+    def error(self, message: str):
+        # Group by the start of the message, ignoring details like page numbers
+        self.errors[message.splitlines()[0][:80] if message else "unknown"] += 1
+
+    def status(self) -> str:
+        elapsed = time.monotonic() - self.started
+        counters = self.counters
+        finished = (
+            counters["documents_done"]
+            + counters["documents_skipped"]
+            + counters["documents_failed"]
+        )
+        rate = counters["pages_done"] / elapsed if elapsed > 0 else 0.0
+        average_pages = (
+            sum(self.document_pages) / len(self.document_pages) if self.document_pages else None
+        )
+        eta = "?"
+        if rate > 0 and average_pages is not None:
+            processed = counters["pages_done"] + counters["pages_skipped"] + counters["pages_failed"]
+            remaining = max(0.0, self.documents * average_pages - processed)
+            eta = format_seconds(remaining / rate)
+        return (
+            f"📊 {finished}/{self.documents} documents, "
+            f"{counters['pages_done']} pages ({rate:.2f} pages/s), "
+            f"{counters['pages_skipped']} skipped, "
+            f"{counters['pages_failed'] + counters['documents_failed']} errors, "
+            f"elapsed {format_seconds(elapsed)}, ETA {eta}"
+        )
+
+    def summary(self, title: str = "✅ Done:") -> str:
+        lines = [self.status().replace("📊", title, 1)]
+        for message, count in self.errors.most_common(10):
+            lines.append(f"   {count:>6} x {message}")
+        return "\n".join(lines)
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class BatchRunner:
+    """
+    Process documents with `document_workers` concurrent documents and at
+    most `page_concurrency` pages rendered or in the VLM/LLM stages at once
+    (across documents). Output and checkpoint lines are written as pages complete.
+    """
+
+    def __init__(
+        self,
+        output: str,
+        errors: str,
+        checkpoint: Checkpoint,
+        progress: Progress,
+        document_workers: int = 4,
+        page_concurrency: int = 8,
+        structure: bool = True,
+    ):
+        self.output = open(output, "a", encoding="utf-8")
+        self.errors = open(errors, "a", encoding="utf-8")
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.document_workers = max(1, document_workers)
+        self.page_slots = asyncio.Semaphore(max(1, page_concurrency))
+        self.structure = structure
+
+    def close(self):
+        self.output.close()
+        self.errors.close()
+
+    def write_error(self, document: str, sha256: Optional[str], page: Optional[int], message: str):
+        entry = {"document": document, "sha256": sha256, "page": page, "error": message}
+        self.errors.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.errors.flush()
+        self.progress.error(message)
+
+    def page_error(self, result: dict) -> Optional[str]:
+        """
+        Why a page result of the pipeline does not count as done
+        Returns: None when the page is done
+        """
+        if "error" in result:
+            return result["error"]
+        if result["content"].startswith("Error:"):
+            return result["content"]
+        if self.structure and result["parsed_json"] is None and result["content"].strip():
+            return "LLM returned no valid JSON"
+        return None
+
+    def record_page(self, document: str, sha256: str, total_pages: int, result: dict):
+        """
+        Write a finished page to the output and the checkpoint, or to the errors
+        """
+        counters = self.progress.counters
+        error = self.page_error(result)
+        if error is not None:
+            counters["pages_failed"] += 1
+            self.write_error(document, sha256, result["page"], error)
+            return
+        line = {"document": document, "sha256": sha256, "page": result["page"]}
+        line.update(total_pages=total_pages, **result)
+        self.output.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.output.flush()
+        self.checkpoint.record(document, sha256, result["page"], total_pages)
+        counters["pages_done"] += 1
+
+    async def process_document(self, document: str):
+        from main import (
+            aiter_document_pages,
+            document_page_count,
+            extract_page_markdown,
+            memory_budget,
+            parse_markdown,
+        )
+
+        counters = self.progress.counters
+        try:
+            sha256 = await asyncio.to_thread(file_sha256, document)
+        except OSError as e:
+            counters["documents_failed"] += 1
+            self.write_error(document, None, None, f"Cannot read file: {e}")
+            return
+        if self.checkpoint.is_complete(sha256):
+            counters["documents_skipped"] += 1
+            counters["pages_skipped"] += self.checkpoint.total_pages[sha256]
+            return
+
+        try:
+            total_pages = await document_page_count(document)
+        except Exception as e:
+            counters["documents_failed"] += 1
+            self.write_error(document, sha256, None, f"Could not render PDF: {e}")
+            return
+        self.progress.document_pages.append(total_pages)
+        # Pages already in the checkpoint are not rendered again
+        skip = {page - 1 for page in self.checkpoint.pages_done(sha256) if page <= total_pages}
+        counters["pages_skipped"] += len(skip)
+
+        # Pages are rendered as page slots free up (in the sandboxed raster
+        # pool when enabled) and held within the memory budget
+        memory = PageMemory(memory_budget)
+        pages = memory.watch(aiter_document_pages(document, memory, skip=skip))
+        executor = PageExecutor(
+            vlm_stage=memory.stage(extract_page_markdown),
+            llm_stage=parse_markdown if self.structure else None,
+            slots=self.page_slots,
+        )
+        try:
+            results = await executor.run(
+                pages,
+                on_result=lambda result: self.record_page(document, sha256, total_pages, result),
+            )
+        except Exception as e:
+            counters["documents_failed"] += 1
+            self.write_error(document, sha256, None, f"Could not render PDF: {e}")
+            return
+        finally:
+            memory.close()
+
+        if all(self.page_error(result) is None for result in results):
+            counters["documents_done"] += 1
+        else:
+            counters["documents_failed"] += 1
+
+    async def run(self, documents: List[str], progress_interval: float):
+        queue: "asyncio.Queue" = asyncio.Queue()
+        for document in documents:
+            queue.put_nowait(document)
+
+        async def worker():
+            while True:
+                try:
+                    document = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self.process_document(document)
+
+        async def report():
+            while True:
+                await asyncio.sleep(progress_interval)
+                print(self.progress.status(), file=sys.stderr, flush=True)
+
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.document_workers)))
+        finally:
+            reporter.cancel()
+
+
+async def run_batch(args, progress: Progress):
+    from main import raster_pool, upstream_client
+
+    documents = list(dict.fromkeys(iter_inputs(args.directory, args.manifest)))
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.checkpoint")
+    progress.documents = len(documents)
+    runner = BatchRunner(
+        output=args.output,
+        errors=args.errors or f"{args.output}.errors.jsonl",
+        checkpoint=checkpoint,
+        progress=progress,
+        document_workers=args.documents,
+        page_concurrency=args.pages,
+        structure=not args.no_llm,
+    )
+    print(f"🚀 {len(documents)} documents -> {args.output}", file=sys.stderr, flush=True)
+    try:
+        await runner.run(documents, args.progress_interval)
+    finally:
+        runner.close()
+        checkpoint.close()
+        await upstream_client.aclose()
+        if raster_pool is not None:
+            raster_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("directory", nargs="?", help="Directory searched recursively for PDFs")
+    parser.add_argument("--manifest", help="Text file with one PDF path per line")
+    parser.add_argument("--output", required=True, help="JSONL file page results are appended to")
+    parser.add_argument(
+        "--checkpoint", help="Checkpoint manifest (default: <output>.checkpoint)"
+    )
+    parser.add_argument("--errors", help="Errors JSONL (default: <output>.errors.jsonl)")
+    parser.add_argument("--documents", type=int, default=4, help="Documents processed at once")
+    parser.add_argument("--pages", type=int, default=8, help="Pages in VLM/LLM at once")
+    parser.add_argument(
+        "--no-llm", action="store_true", help="Only extract markdown, skip the LLM stage"
+    )
+    parser.add_argument(
+        "--progress-interval", type=float, default=10, help="Seconds between status lines"
+    )
+    parser.add_argument("--quiet", action="store_true", help="Hide per-page pipeline logs")
+    args = parser.parse_args()
+    if not args.directory and not args.manifest:
+        parser.error("give a directory or --manifest")
+
+    progress = Progress(0)
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull) if args.quiet else contextlib.nullcontext():
+            try:
+                asyncio.run(run_batch(args, progress))
+            except KeyboardInterrupt:
+                print(progress.summary("⏹️ Interrupted:"), file=sys.stderr)
+                print("Run the same command again to resume", file=sys.stderr)
+                raise SystemExit(130)
+    print(progress.summary(), file=sys.stderr)
+    raise SystemExit(1 if progress.counters["documents_failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark page image encodings on sample documents.
+
+For every encoding setting it reports the total payload bytes sent to the VLM,
+the mean encode time per page and, with --vlm, how closely the extracted
+markdown agrees with the lossless PNG baseline.
+
+    python bench_encoding.py invoices/*.pdf
+    python bench_encoding.py --vlm --max-pages 5 invoices/*.pdf
+"""
+import argparse
+import asyncio
+import difflib
+import time
+
+import fitz  # PyMuPDF
+
+from encoding import AUTO_CANDIDATES, PNG, EncodingOptions, encode_pixmap, fit_scale
+from rendering import RENDER_SCALE, RenderedPage
+
+SETTINGS = [
+    PNG,
+    *AUTO_CANDIDATES,
+    EncodingOptions(format="jpeg", quality=50),
+    EncodingOptions(format="webp", quality=80, max_pixels=2_000_000),
+    EncodingOptions(format="auto"),
+]
+
+
+def render_setting(pdf_paths: list, options: EncodingOptions, max_pages: int):
+    """
+    Encode every page with one setting
+    Returns: (pages, total encode seconds)
+    """
+    pages = []
+    encode_seconds = 0.0
+    for pdf_path in pdf_paths:
+        with fitz.open(pdf_path) as document:
+            for page in list(document)[:max_pages]:
+                scale = fit_scale(page.rect, RENDER_SCALE, options.max_pixels)
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+                started = time.perf_counter()
+                image, mime, used = encode_pixmap(pix, options)
+                encode_seconds += time.perf_counter() - started
+                pages.append(
+                    RenderedPage(
+                        index=page.number,
+                        image=image,
+                        mime=mime,
+                        meta={"encoding": used.label},
+                    )
+                )
+    return pages, encode_seconds
+
+
+async def extract_all(pages: list) -> list:
+    # Imported lazily so the byte/time benchmark runs without API settings
+    from main import call_vlm_api, upstream_client
+
+    try:
+        return await asyncio.gather(*(call_vlm_api(page.data_uri) for page in pages))
+    finally:
+        await upstream_client.aclose()
+
+
+def agreement(baseline: list, candidate: list) -> float:
+    ratios = [
+        difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(baseline, candidate)
+    ]
+    return sum(ratios) / len(ratios) if ratios else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("pdfs", nargs="+", help="Sample PDF files")
+    parser.add_argument("--max-pages", type=int, default=10, help="Pages per document")
+    parser.add_argument(
+        "--vlm", action="store_true", help="Also measure extraction agreement"
+    )
+    args = parser.parse_args()
+
+    baseline_text = None
+    print(f"{'setting':<28} {'pages':>5} {'bytes':>12} {'ms/page':>8} {'agreement':>9}")
+    for options in SETTINGS:
+        pages, encode_seconds = render_setting(args.pdfs, options, args.max_pages)
+        total_bytes = sum(len(page.image) for page in pages)
+        ms_per_page = 1000 * encode_seconds / max(1, len(pages))
+
+        score = ""
+        if args.vlm:
+            texts = asyncio.run(extract_all(pages))
+            if baseline_text is None:
+                baseline_text = texts
+            score = f"{agreement(baseline_text, texts):.3f}"
+
+        print(
+            f"{options.label:<28} {len(pages):>5} {total_bytes:>12,} "
+            f"{ms_per_page:>8.1f} {score:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
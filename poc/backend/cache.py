@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional, Tuple, Union
+
+# Access times of cache hits are written to SQLite in batches, once this
+# many are pending or the oldest is this old (and before any eviction)
+TOUCH_FLUSH_ENTRIES = 256
+TOUCH_FLUSH_SECONDS = 30.0
+# Returned by the memory lookup when the disk has to be asked
+_MISS = object()
+
+
+def make_key(*parts: Union[bytes, str]) -> str:
+    """
+    Content address for a cache entry: sha256 over all parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def normalize_markdown(markdown_text: str) -> str:
+    """
+    Normalize VLM markdown so cosmetic whitespace differences share a cache entry
+    """
+    text = unicodedata.normalize("NFC", markdown_text)
+    lines = (" ".join(line.split()) for line in text.strip().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class ResultCache:
+    """
+    Two-level cache for pipeline results.
+
+    An in-memory LRU sits in front of a SQLite store. Entries expire after
+    `ttl_seconds`; the SQLite store evicts least recently used entries once
+    it holds more than `max_disk_bytes` of values. Values must be JSON
+    serializable and are returned as fresh copies.
+
+    `get`/`set` block on SQLite; from the event loop use `aget`/`aset`,
+    which answer memory hits in place and run SQLite work in a thread. The
+    LRU has its own lock, so a memory hit never waits for a SQLite write.
+    Access times used for eviction are recorded in memory and written in
+    batches rather than with one UPDATE + commit per hit. The size of the
+    store is kept as a running total (read once when the database is
+    opened), and eviction only runs once it goes over `max_disk_bytes`.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        memory_entries: int = 512,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # SQLite lock, then memory lock (never the other way round); the
+        # memory lock also guards the counters and pending access times
+        self._lock = threading.Lock()
+        self._memory_lock = threading.Lock()
+        self._counters = defaultdict(lambda: {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        self._touched: Dict[Tuple[str, str], float] = {}
+        self._touched_since: Optional[float] = None
+
+        self.db_path = db_path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Opened lazily (and again after close) like the other shared clients
+        if self._connection is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._init_schema(self._connection)
+            (self._disk_bytes,) = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()
+        return self._connection
+
+    @staticmethod
+    def _init_schema(db: sqlite3.Connection):
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)"
+        )
+        db.commit()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        value = self._get_memory(namespace, key)
+        if value is _MISS:
+            value = self._get_disk(namespace, key)
+        return value
+
+    async def aget(self, namespace: str, key: str) -> Optional[Any]:
+        value = self._get_memory(namespace, key)
+        if value is _MISS:
+            value = await asyncio.to_thread(self._get_disk, namespace, key)
+        return value
+
+    def _get_memory(self, namespace: str, key: str) -> Any:
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get((namespace, key))
+            if entry is None:
+                return _MISS
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._memory[(namespace, key)]
+                return _MISS
+            self._memory.move_to_end((namespace, key))
+            self._touch(namespace, key, now)
+            self._counters[namespace]["memory_hits"] += 1
+            return json.loads(value)
+
+    def _get_disk(self, namespace: str, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, size, created_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is not None and row[2] + self.ttl_seconds <= now:
+                self._db.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+                )
+                self._db.commit()
+                self._disk_bytes -= row[1]
+                row = None
+            if row is None:
+                with self._memory_lock:
+                    self._counters[namespace]["misses"] += 1
+                return None
+
+            value, _, created_at = row
+            with self._memory_lock:
+                self._touch(namespace, key, now)
+                flush = (
+                    len(self._touched) >= TOUCH_FLUSH_ENTRIES
+                    or now - self._touched_since >= TOUCH_FLUSH_SECONDS
+                )
+                self._remember(namespace, key, value, created_at + self.ttl_seconds)
+                self._counters[namespace]["disk_hits"] += 1
+            if flush:
+                self._flush_touched()
+                self._db.commit()
+            return json.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any):
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        size = len(serialized.encode("utf-8"))
+        with self._lock:
+            with self._memory_lock:
+                self._remember(namespace, key, serialized, now + self.ttl_seconds)
+                self._touched.pop((namespace, key), None)
+            replaced = self._db.execute(
+                "SELECT size FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            self._db.execute(
+                """
+                INSERT OR REPLACE INTO cache
+                    (namespace, key, value, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (namespace, key, serialized, size, now, now),
+            )
+            self._disk_bytes += size - (replaced[0] if replaced else 0)
+            if self._disk_bytes > self.max_disk_bytes:
+                # Evict by up-to-date access times
+                self._flush_touched()
+                self._evict(now)
+            self._db.commit()
+
+    async def aset(self, namespace: str, key: str, value: Any):
+        await asyncio.to_thread(self.set, namespace, key, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+            with self._memory_lock:
+                return {
+                    "memory_entries": len(self._memory),
+                    "disk_entries": entries,
+                    "disk_bytes": self._disk_bytes,
+                    "namespaces": {name: dict(c) for name, c in self._counters.items()},
+                }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._flush_touched()
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+
+    def _touch(self, namespace: str, key: str, now: float):
+        if not self._touched:
+            self._touched_since = now
+        self._touched[(namespace, key)] = now
+
+    def _flush_touched(self):
+        """
+        Write pending access times (the caller holds the SQLite lock and commits)
+        """
+        with self._memory_lock:
+            touched, self._touched = self._touched, {}
+            self._touched_since = None
+        if touched:
+            self._db.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                [(at, namespace, key) for (namespace, key), at in touched.items()],
+            )
+
+    def _remember(self, namespace: str, key: str, value: str, expires_at: float):
+        self._memory[(namespace, key)] = (value, expires_at)
+        self._memory.move_to_end((namespace, key))
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        """
+        Drop expired entries, then least recently used ones, until the store
+        is within `max_disk_bytes` (the caller holds the SQLite lock)
+        """
+        expired = (now - self.ttl_seconds,)
+        (expired_bytes,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache WHERE created_at <= ?", expired
+        ).fetchone()
+        self._db.execute("DELETE FROM cache WHERE created_at <= ?", expired)
+        self._disk_bytes -= expired_bytes
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+
+        rows = self._db.execute(
+            "SELECT namespace, key, size FROM cache ORDER BY accessed_at"
+        )
+        evicted = []
+        for namespace, key, size in rows:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            evicted.append((namespace, key))
+            self._disk_bytes -= size
+        rows.close()
+        self._db.executemany(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?", evicted
+        )
+        with self._memory_lock:
+            for entry in evicted:
+                self._memory.pop(entry, None)
@@ -0,0 +1,173 @@
+import os
+
+
+class Settings:
+    """POC backend settings."""
+
+    # Model API
+    API_URL: str = os.getenv(
+        "API_URL", "https://mkp-api.fptcloud.com/v1/chat/completions"
+    )
+    API_KEY: str = os.getenv("API_KEY", "sk-gojYePiQueqAHdllper3UA")
+    VLM_MODEL: str = os.getenv("VLM_MODEL", "FPT.AI-KIE-v1.7")
+    LLM_MODEL: str = os.getenv("LLM_MODEL", "gpt-oss-120b")
+
+    # Uploads: kept in memory up to UPLOAD_MEMORY_LIMIT, spilled to disk above
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+    UPLOAD_MEMORY_LIMIT: int = int(os.getenv("UPLOAD_MEMORY_LIMIT", str(8 * 1024 * 1024)))
+
+    # Upstream HTTP client
+    UPSTREAM_MAX_CONNECTIONS: int = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+    UPSTREAM_MAX_KEEPALIVE: int = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "10"))
+    UPSTREAM_TIMEOUT: float = float(os.getenv("UPSTREAM_TIMEOUT", "60"))
+    UPSTREAM_CONNECT_TIMEOUT: float = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+    UPSTREAM_MAX_RETRIES: int = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+    UPSTREAM_BACKOFF_BASE: float = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+    UPSTREAM_BACKOFF_MAX: float = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+
+    # Upstream quotas per model (0 = no limit) and adaptive concurrency
+    VLM_REQUESTS_PER_MINUTE: float = float(os.getenv("VLM_REQUESTS_PER_MINUTE", "0"))
+    VLM_TOKENS_PER_MINUTE: float = float(os.getenv("VLM_TOKENS_PER_MINUTE", "0"))
+    LLM_REQUESTS_PER_MINUTE: float = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+    LLM_TOKENS_PER_MINUTE: float = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+    UPSTREAM_INITIAL_CONCURRENCY: int = int(os.getenv("UPSTREAM_INITIAL_CONCURRENCY", "4"))
+    UPSTREAM_MIN_CONCURRENCY: int = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", "1"))
+    UPSTREAM_MAX_CONCURRENCY: int = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))
+    # A response this many times slower than usual counts as congestion
+    UPSTREAM_LATENCY_SPIKE_FACTOR: float = float(
+        os.getenv("UPSTREAM_LATENCY_SPIKE_FACTOR", "2.0")
+    )
+    # Prompt tokens assumed per page image when accounting tokens/min
+    UPSTREAM_IMAGE_TOKENS: int = int(os.getenv("UPSTREAM_IMAGE_TOKENS", "1000"))
+
+    # Hedged model calls: a call slower than the HEDGE_PERCENTILE latency of
+    # recent calls is duplicated, for at most HEDGE_MAX_EXTRA_RATIO extra calls
+    HEDGE_ENABLED: bool = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+    HEDGE_PERCENTILE: float = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    HEDGE_MAX_EXTRA_RATIO: float = float(os.getenv("HEDGE_MAX_EXTRA_RATIO", "0.05"))
+    HEDGE_MIN_SAMPLES: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+    # Page pipeline
+    MAX_INFLIGHT_PAGES: int = int(os.getenv("MAX_INFLIGHT_PAGES", "4"))
+    # Pages rendered ahead of inference (bounds memory for long documents)
+    RENDER_PREFETCH: int = int(os.getenv("RENDER_PREFETCH", "2"))
+
+    # Memory budget for page images held across all documents (0 = no limit):
+    # rendering pauses while it is used up
+    MEMORY_BUDGET_MB: int = int(os.getenv("MEMORY_BUDGET_MB", "512"))
+    # Documents pending at once on /api/convert*; more are answered 503
+    ADMISSION_MAX_DOCUMENTS: int = int(os.getenv("ADMISSION_MAX_DOCUMENTS", "16"))
+    ADMISSION_RETRY_AFTER: int = int(os.getenv("ADMISSION_RETRY_AFTER", "10"))
+
+    # Rasterization process pool (0 = render in a thread of the API process)
+    RASTER_WORKERS: int = int(os.getenv("RASTER_WORKERS", str(os.cpu_count() or 1)))
+    RASTER_CHUNK_PAGES: int = int(os.getenv("RASTER_CHUNK_PAGES", "4"))
+    # Replace worker processes after this many documents to release fitz memory
+    RASTER_RECYCLE_DOCUMENTS: int = int(os.getenv("RASTER_RECYCLE_DOCUMENTS", "50"))
+    # Sandbox limits for malformed / adversarial PDFs (0 = no limit): pages per
+    # document, worker address space, CPU seconds per document and wall-clock
+    # seconds per page range
+    RASTER_MAX_PAGES: int = int(os.getenv("RASTER_MAX_PAGES", "500"))
+    RASTER_MAX_MEMORY_MB: int = int(os.getenv("RASTER_MAX_MEMORY_MB", "2048"))
+    RASTER_MAX_CPU_SECONDS: int = int(os.getenv("RASTER_MAX_CPU_SECONDS", "120"))
+    RASTER_TASK_TIMEOUT: float = float(os.getenv("RASTER_TASK_TIMEOUT", "120"))
+
+    # Render scale (2 = 144 dpi); with ADAPTIVE_DPI it is chosen per page
+    RENDER_SCALE: float = float(os.getenv("RENDER_SCALE", "2"))
+    ADAPTIVE_DPI: bool = os.getenv("ADAPTIVE_DPI", "false").lower() == "true"
+    DPI_MIN_SCALE: float = float(os.getenv("DPI_MIN_SCALE", "1"))
+    DPI_MAX_SCALE: float = float(os.getenv("DPI_MAX_SCALE", "3"))
+    # Pixel height the smallest glyphs should keep to stay legible
+    DPI_TARGET_GLYPH_PX: float = float(os.getenv("DPI_TARGET_GLYPH_PX", "16"))
+
+    # Native text-layer fast path: digitally-born pages skip the VLM
+    TEXT_LAYER_ENABLED: bool = os.getenv("TEXT_LAYER_ENABLED", "true").lower() == "true"
+    TEXT_LAYER_MIN_GLYPHS: int = int(os.getenv("TEXT_LAYER_MIN_GLYPHS", "100"))
+    TEXT_LAYER_MIN_COVERAGE: float = float(os.getenv("TEXT_LAYER_MIN_COVERAGE", "0.02"))
+    TEXT_LAYER_MAX_IMAGE_RATIO: float = float(
+        os.getenv("TEXT_LAYER_MAX_IMAGE_RATIO", "0.3")
+    )
+
+    # Blank / duplicate page detection on the rendered pixmap
+    PAGE_CHECK_ENABLED: bool = os.getenv("PAGE_CHECK_ENABLED", "true").lower() == "true"
+    # Pages with less ink than this share of their area are skipped
+    BLANK_MAX_INK: float = float(os.getenv("BLANK_MAX_INK", "0.002"))
+    # Pages whose render is byte-identical to an earlier page reuse its
+    # result; rescans or near-identical pages are not detected
+    DUPLICATE_PAGES_ENABLED: bool = (
+        os.getenv("DUPLICATE_PAGES_ENABLED", "false").lower() == "true"
+    )
+
+    # Scan clean-up between rendering and encoding
+    PREPROCESS_ENABLED: bool = os.getenv("PREPROCESS_ENABLED", "false").lower() == "true"
+    PREPROCESS_DESKEW: bool = os.getenv("PREPROCESS_DESKEW", "true").lower() == "true"
+    PREPROCESS_MAX_SKEW: float = float(os.getenv("PREPROCESS_MAX_SKEW", "5"))
+    PREPROCESS_CROP: bool = os.getenv("PREPROCESS_CROP", "true").lower() == "true"
+    # Blank margin kept around the content when cropping (pixels)
+    PREPROCESS_MARGIN_PX: int = int(os.getenv("PREPROCESS_MARGIN_PX", "24"))
+    PREPROCESS_DENOISE: bool = os.getenv("PREPROCESS_DENOISE", "false").lower() == "true"
+    PREPROCESS_BINARIZE: bool = os.getenv("PREPROCESS_BINARIZE", "false").lower() == "true"
+    # Also encode the unprocessed page to report the bytes saved per page
+    # (a second full encode of every page, so for measurements only)
+    PREPROCESS_REPORT_SAVINGS: bool = (
+        os.getenv("PREPROCESS_REPORT_SAVINGS", "false").lower() == "true"
+    )
+
+    # VLM output budget per page (max_tokens), estimated from the amount of ink
+    VLM_MIN_TOKENS: int = int(os.getenv("VLM_MIN_TOKENS", "1024"))
+    VLM_MAX_TOKENS: int = int(os.getenv("VLM_MAX_TOKENS", "4096"))
+    # Truncated answers are completed with continuation requests
+    VLM_MAX_CONTINUATIONS: int = int(os.getenv("VLM_MAX_CONTINUATIONS", "2"))
+    VLM_CONTINUATION_TOKENS: int = int(os.getenv("VLM_CONTINUATION_TOKENS", "1024"))
+
+    # Oversized pages (A3, long receipts) are split into overlapping strips
+    # read concurrently and stitched back together
+    TILING_ENABLED: bool = os.getenv("TILING_ENABLED", "false").lower() == "true"
+    TILE_MAX_HEIGHT: int = int(os.getenv("TILE_MAX_HEIGHT", "2048"))
+    TILE_MAX_PIXELS: int = int(os.getenv("TILE_MAX_PIXELS", "2500000"))
+    TILE_OVERLAP_PX: int = int(os.getenv("TILE_OVERLAP_PX", "96"))
+    TILE_MAX_TILES: int = int(os.getenv("TILE_MAX_TILES", "8"))
+
+    # Rule-based invoice extraction: the LLM is only called when required
+    # fields are missing or the totals do not add up
+    RULES_ENABLED: bool = os.getenv("RULES_ENABLED", "true").lower() == "true"
+    RULES_MIN_CONFIDENCE: float = float(os.getenv("RULES_MIN_CONFIDENCE", "0.75"))
+    RULES_REQUIRED_FIELDS: str = os.getenv(
+        "RULES_REQUIRED_FIELDS",
+        "seller.tax_code,invoice.serial,invoice.number,invoice.date,totals.total,items",
+    )
+
+    # Group pages into invoices and structure each invoice once (instead of
+    # once per page)
+    INVOICE_GROUPING: bool = os.getenv("INVOICE_GROUPING", "true").lower() == "true"
+
+    # Page image encoding sent to the VLM: png, jpeg, webp or auto
+    IMAGE_FORMAT: str = os.getenv("IMAGE_FORMAT", "png")
+    IMAGE_QUALITY: int = int(os.getenv("IMAGE_QUALITY", "85"))
+    IMAGE_GRAYSCALE: bool = os.getenv("IMAGE_GRAYSCALE", "false").lower() == "true"
+    IMAGE_PALETTE_COLORS: int = int(os.getenv("IMAGE_PALETTE_COLORS", "0"))
+    IMAGE_MAX_PIXELS: int = int(os.getenv("IMAGE_MAX_PIXELS", "0"))
+    # Minimum luminance PSNR (dB) an auto-selected encoding must keep
+    IMAGE_FIDELITY_PSNR: float = float(os.getenv("IMAGE_FIDELITY_PSNR", "38"))
+
+    # Batch uploads (POST /api/convert/batch): files per request, total size,
+    # and pages in flight shared by all files of a batch
+    BATCH_MAX_FILES: int = int(os.getenv("BATCH_MAX_FILES", "200"))
+    BATCH_MAX_BYTES: int = int(os.getenv("BATCH_MAX_BYTES", str(200 * 1024 * 1024)))
+    BATCH_MAX_INFLIGHT_PAGES: int = int(os.getenv("BATCH_MAX_INFLIGHT_PAGES", "16"))
+
+    # Background jobs (POST /api/jobs)
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_QUEUE_SIZE: int = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+    # Empty = in-memory; otherwise a SQLAlchemy URL (sqlite:///jobs.sqlite3, mysql://...)
+    JOB_STORE_URL: str = os.getenv("JOB_STORE_URL", "")
+
+    # Result cache (in-memory LRU in front of SQLite)
+    CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+    CACHE_DB_PATH: str = os.getenv("CACHE_DB_PATH", "cache/results.sqlite3")
+    CACHE_MEMORY_ENTRIES: int = int(os.getenv("CACHE_MEMORY_ENTRIES", "512"))
+    CACHE_MAX_DISK_MB: int = int(os.getenv("CACHE_MAX_DISK_MB", "512"))
+    CACHE_TTL_SECONDS: int = int(os.getenv("CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+settings = Settings()
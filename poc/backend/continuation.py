@@ -0,0 +1,94 @@
+from typing import Optional
+
+from tiling import seam_overlap
+
+# Initial VLM output tokens per square point of ink, refined from the
+# usage of complete answers
+TOKENS_PER_INK_AREA = 0.05
+# Margin over the estimate, so most pages finish in a single request
+BUDGET_HEADROOM = 1.5
+# Pages with less ink than this (square points) do not refine the estimate
+MIN_OBSERVED_INK_AREA = 2000.0
+
+
+def is_truncated(content: str, finish_reason: Optional[str]) -> bool:
+    """
+    True when the VLM stopped at its token budget rather than at the end
+    of the page: finish_reason "length", or markdown cut in the middle of
+    a table row or of a code block
+    """
+    if finish_reason == "length":
+        return True
+    lines = content.rstrip("\n").splitlines()
+    last = lines[-1].strip() if lines else ""
+    if last.startswith("|") and not last.endswith("|"):
+        return True
+    return content.count("```") % 2 == 1
+
+
+def append_continuation(previous: str, continuation: str) -> str:
+    """
+    Output of a truncated answer followed by its continuation. The model
+    may restart the line it was cut in, or repeat a few lines; those are
+    not duplicated.
+    """
+    if not continuation.strip():
+        return previous
+    if not previous.strip():
+        return continuation
+    if previous.endswith("\n") or continuation.startswith("\n"):
+        head, tail = previous.rstrip("\n").splitlines(), continuation.strip("\n").splitlines()
+    else:
+        head, tail = previous.splitlines(), continuation.splitlines()
+        cut, first = head[-1], tail[0]
+        if not first.strip().startswith(cut.strip()[:8]) or not cut.strip():
+            # Resumed mid-line
+            return previous + continuation
+        # Restarted the cut line: keep the complete version
+        head = head[:-1]
+    drop, skip = seam_overlap(head, tail)
+    if drop:
+        head = head[:-drop]
+    return "\n".join(head + tail[skip:])
+
+
+class TokenBudget:
+    """
+    Per-page max_tokens for the VLM, estimated from the page's ink area.
+
+    Starts from TOKENS_PER_INK_AREA and follows the tokens actually used by
+    pages that finished within their budget (moving average), so the
+    estimate adapts to the model, the prompt and the documents.
+    """
+
+    def __init__(
+        self,
+        min_tokens: int = 1024,
+        max_tokens: int = 4096,
+        tokens_per_ink_area: float = TOKENS_PER_INK_AREA,
+    ):
+        self.min_tokens = min_tokens
+        self.max_tokens = max(min_tokens, max_tokens)
+        self.tokens_per_ink_area = tokens_per_ink_area
+        self.counters = {"pages": 0, "truncated": 0, "continuations": 0, "incomplete": 0}
+
+    def estimate(self, ink_area: float) -> int:
+        tokens = int(ink_area * self.tokens_per_ink_area * BUDGET_HEADROOM)
+        return min(self.max_tokens, max(self.min_tokens, tokens))
+
+    def observe(self, ink_area: float, completion_tokens: Optional[int]):
+        """
+        Record the output size of a page answered without truncation
+        """
+        if not completion_tokens or ink_area < MIN_OBSERVED_INK_AREA:
+            return
+        ratio = completion_tokens / ink_area
+        self.tokens_per_ink_area = 0.9 * self.tokens_per_ink_area + 0.1 * ratio
+
+    def snapshot(self) -> dict:
+        return {
+            "min_tokens": self.min_tokens,
+            "max_tokens": self.max_tokens,
+            "tokens_per_ink_area": round(self.tokens_per_ink_area, 4),
+            **self.counters,
+        }
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Awaitable, TypeVar
+
+from starlette.requests import ClientDisconnect, Request
+
+T = TypeVar("T")
+
+
+async def wait_for_disconnect(request: Request):
+    """
+    Return once the client has gone away. Only valid after the request body
+    has been read: the next ASGI message is then the disconnect.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable`, cancelling it as soon as the client disconnects
+    Raises: ClientDisconnect when the client went away first
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        task.cancel()
+        # Let the work unwind (close renderers, release upstream slots)
+        await asyncio.gather(task, return_exceptions=True)
+        raise ClientDisconnect()
+    finally:
+        watcher.cancel()
+        task.cancel()
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+
+import fitz  # PyMuPDF
+
+# Pages whose images cover more than this share of the page are treated as scans
+SCAN_COVERAGE = 0.5
+
+
+@dataclass(frozen=True)
+class DpiPolicy:
+    """
+    Adaptive render scale per page.
+
+    Text-layer pages are rendered at the lowest scale that makes the smallest
+    glyphs (5th percentile font size, weighted by characters) about
+    `target_glyph_px` pixels tall. Scanned pages follow the resolution of the
+    embedded scan, but never above `default_scale`: a 300 dpi scan rendered
+    at its native resolution only inflates encoding and upload. Pages with
+    nothing to measure use `default_scale`. The result is always clamped to
+    [min_scale, max_scale].
+    """
+
+    min_scale: float = 1.0
+    max_scale: float = 3.0
+    target_glyph_px: float = 16.0
+    default_scale: float = 2.0
+
+    @property
+    def label(self) -> str:
+        return f"dpi{self.min_scale}-{self.max_scale}-{self.target_glyph_px}"
+
+    def clamp(self, scale: float) -> float:
+        return max(self.min_scale, min(self.max_scale, scale))
+
+    def choose_scale(self, page: fitz.Page) -> float:
+        glyph_size = smallest_glyph_size(page)
+        if glyph_size:
+            # 1pt renders as 1px at scale 1 (72 dpi)
+            return self.clamp(self.target_glyph_px / glyph_size)
+
+        native_scale = scan_native_scale(page)
+        if native_scale:
+            return self.clamp(min(native_scale, self.default_scale))
+        return self.clamp(self.default_scale)
+
+
+def smallest_glyph_size(page: fitz.Page, percentile: float = 0.05) -> float:
+    """
+    Font size (pt) below which `percentile` of the page's characters fall,
+    or 0 when the page has no text layer
+    """
+    sizes = []
+    for block in page.get_text("dict", flags=0)["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                chars = len(span["text"].strip())
+                if chars and span["size"] > 0:
+                    sizes.append((span["size"], chars))
+    if not sizes:
+        return 0.0
+
+    sizes.sort()
+    threshold = percentile * sum(chars for _, chars in sizes)
+    seen = 0
+    for size, chars in sizes:
+        seen += chars
+        if seen >= threshold:
+            return size
+    return sizes[-1][0]
+
+
+def scan_native_scale(page: fitz.Page) -> float:
+    """
+    Scale at which the page renders at the resolution of its largest embedded
+    image, if images cover most of the page; 0 otherwise
+    """
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0.0
+
+    images = [info for info in page.get_image_info() if not fitz.Rect(info["bbox"]).is_empty]
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in images)
+    if covered / page_area < SCAN_COVERAGE:
+        return 0.0
+
+    largest = max(images, key=lambda info: abs(fitz.Rect(info["bbox"])))
+    bbox = fitz.Rect(largest["bbox"])
+    return largest["width"] / bbox.width
@@ -0,0 +1,176 @@
+import io
+import math
+from dataclasses import dataclass, replace
+from typing import List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageChops
+
+FORMAT_MIME = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+@dataclass(frozen=True)
+class EncodingOptions:
+    """
+    How a rendered page is encoded before it is sent to the VLM.
+
+    format: png, jpeg, webp, or auto (smallest candidate meeting the
+        fidelity target)
+    quality: JPEG/WebP quality (1-95)
+    grayscale: drop colour channels
+    palette_colors: reduce to an adaptive palette of N colours (png only, 0 = off)
+    max_pixels: cap on width * height; pages are rendered smaller to fit (0 = off)
+    fidelity_psnr: minimum luminance PSNR (dB) against the lossless render,
+        used by the auto format
+    """
+
+    format: str = "png"
+    quality: int = 85
+    grayscale: bool = False
+    palette_colors: int = 0
+    max_pixels: int = 0
+    fidelity_psnr: float = 38.0
+
+    @property
+    def label(self) -> str:
+        parts = [self.format]
+        if self.format in ("jpeg", "webp"):
+            parts.append(f"q{self.quality}")
+        if self.grayscale:
+            parts.append("gray")
+        if self.palette_colors:
+            parts.append(f"p{self.palette_colors}")
+        if self.max_pixels:
+            parts.append(f"max{self.max_pixels}")
+        return "-".join(parts)
+
+
+PNG = EncodingOptions()
+
+# Candidates tried by the auto format; the smallest one meeting the fidelity
+# target wins, lossless PNG is the fallback
+AUTO_CANDIDATES = [
+    EncodingOptions(format="webp", quality=60, grayscale=True),
+    EncodingOptions(format="jpeg", quality=70, grayscale=True),
+    EncodingOptions(format="png", grayscale=True, palette_colors=16),
+    EncodingOptions(format="webp", quality=80),
+    EncodingOptions(format="jpeg", quality=85),
+    EncodingOptions(format="png", grayscale=True),
+]
+
+
+def fit_scale(page_rect: fitz.Rect, scale: float, max_pixels: int) -> float:
+    """
+    Largest scale <= `scale` whose rendered page stays within `max_pixels`
+    """
+    if not max_pixels:
+        return scale
+    area = page_rect.width * page_rect.height
+    if area * scale * scale <= max_pixels:
+        return scale
+    return math.sqrt(max_pixels / area)
+
+
+def pixmap_to_image(pix: fitz.Pixmap) -> Image.Image:
+    """
+    Wrap the pixmap samples in a PIL image without copying them
+    """
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    mode = "L" if pix.n == 1 else "RGB"
+    return Image.frombuffer(
+        mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1
+    )
+
+
+def image_to_pixmap(image: Image.Image) -> fitz.Pixmap:
+    """
+    Pixmap of a PIL image (RGB or grey), e.g. to reuse the fitz PNG encoder
+    """
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    colorspace = fitz.csGRAY if image.mode == "L" else fitz.csRGB
+    return fitz.Pixmap(colorspace, image.width, image.height, image.tobytes(), 0)
+
+
+def encode_image(image: Image.Image, options: EncodingOptions) -> Tuple[bytes, str]:
+    """
+    Encode a page image with fixed options
+    Returns: (encoded bytes, mime type)
+    """
+    if options.grayscale and image.mode != "L":
+        image = image.convert("L")
+    if options.palette_colors and options.format == "png":
+        image = image.quantize(colors=options.palette_colors)
+
+    buffer = io.BytesIO()
+    if options.format == "png":
+        image.save(buffer, format="PNG", optimize=False)
+    elif options.format == "jpeg":
+        image.save(buffer, format="JPEG", quality=options.quality)
+    elif options.format == "webp":
+        image.save(buffer, format="WEBP", quality=options.quality, method=4)
+    else:
+        raise ValueError(f"Unsupported image format: {options.format}")
+    return buffer.getvalue(), FORMAT_MIME[options.format]
+
+
+def luminance_psnr(reference: Image.Image, encoded: bytes) -> float:
+    """
+    PSNR (dB) between a reference image and a decoded candidate, on luminance
+    """
+    candidate = Image.open(io.BytesIO(encoded)).convert("L")
+    if reference.mode != "L":
+        reference = reference.convert("L")
+    histogram = ImageChops.difference(reference, candidate).histogram()
+    squared_error = sum(count * (value**2) for value, count in enumerate(histogram))
+    mse = squared_error / (reference.width * reference.height)
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255**2 / mse)
+
+
+def encode_pixmap(
+    pix: fitz.Pixmap, options: Optional[EncodingOptions] = None
+) -> Tuple[bytes, str, EncodingOptions]:
+    """
+    Encode a rendered page.
+    Returns: (encoded bytes, mime type, options actually used)
+    """
+    options = options or PNG
+    if options.format == "png" and not options.grayscale and not options.palette_colors:
+        # Plain PNG straight from fitz, no round trip through PIL
+        return pix.tobytes("png"), FORMAT_MIME["png"], options
+    return encode_page_image(pixmap_to_image(pix), options)
+
+
+def encode_page_image(
+    image: Image.Image, options: Optional[EncodingOptions] = None
+) -> Tuple[bytes, str, EncodingOptions]:
+    """
+    Encode a page image (e.g. a preprocessed page), auto format included.
+    Returns: (encoded bytes, mime type, options actually used)
+    """
+    options = options or PNG
+    if options.format == "png" and not options.grayscale and not options.palette_colors:
+        # Same encoder as encode_pixmap, so sizes stay comparable
+        return image_to_pixmap(image).tobytes("png"), FORMAT_MIME["png"], options
+    if options.format != "auto":
+        data, mime = encode_image(image, options)
+        return data, mime, options
+
+    best: Optional[Tuple[bytes, str, EncodingOptions]] = None
+    for candidate in candidates_for(options):
+        data, mime = encode_image(image, candidate)
+        if best is not None and len(data) >= len(best[0]):
+            continue
+        if luminance_psnr(image, data) >= options.fidelity_psnr:
+            best = (data, mime, candidate)
+
+    if best is None:
+        return encode_page_image(image, replace(PNG, max_pixels=options.max_pixels))
+    return best
+
+
+def candidates_for(options: EncodingOptions) -> List[EncodingOptions]:
+    return [replace(c, max_pixels=options.max_pixels) for c in AUTO_CANDIDATES]
@@ -0,0 +1,247 @@
+import asyncio
+import inspect
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from invoice_rules import (
+    LABEL_AND_PATTERN,
+    extract_invoice,
+    is_separator_row,
+    split_table_row,
+    table_columns,
+)
+from pipeline import ParsedPage
+
+_PAGE_OF_RE = re.compile(
+    r"\b(?:trang|page)\s*(\d{1,3})\s*(?:/|of|trên)\s*(\d{1,3})\b", re.IGNORECASE
+)
+_CONTINUATION_RE = re.compile(
+    r"\(\s*ti[ếe]p theo\s*\)|ti[ếe]p theo trang trước|continued", re.IGNORECASE
+)
+
+
+@dataclass
+class PageMarkers:
+    """
+    Invoice boundary hints found in one page of markdown
+    """
+
+    title: bool
+    key: Optional[Tuple[str, str]]  # (serial, number) when both were read
+    page_of: Optional[Tuple[int, int]]  # "Trang 2/3"
+    continuation: bool  # "(tiếp theo)", "tiếp theo trang trước", ...
+
+
+def page_markers(markdown_text: str) -> PageMarkers:
+    extraction = extract_invoice(markdown_text)
+    invoice = extraction.data["invoice"]
+    confident = all(
+        extraction.confidence[f"invoice.{name}"] >= LABEL_AND_PATTERN
+        for name in ("serial", "number")
+    )
+    page_of = _PAGE_OF_RE.search(markdown_text)
+    return PageMarkers(
+        title=bool(invoice["title"]),
+        key=(invoice["serial"], invoice["number"]) if confident else None,
+        page_of=(int(page_of.group(1)), int(page_of.group(2))) if page_of else None,
+        continuation=bool(_CONTINUATION_RE.search(markdown_text)),
+    )
+
+
+def starts_new_invoice(markers: PageMarkers, group: List[PageMarkers]) -> bool:
+    """
+    True when a page opens a new invoice rather than continuing `group`,
+    the pages of the invoice read so far
+    """
+    if not group:
+        return True
+    if markers.page_of is not None:
+        return markers.page_of[0] == 1
+    if markers.continuation:
+        return False
+    group_key = next((page.key for page in group if page.key), None)
+    if markers.key is not None and group_key is not None:
+        # Multi-page invoices often repeat their header on every page
+        return markers.key != group_key
+    # Without serial/number, a second title page means a second invoice
+    return markers.title and any(page.title for page in group)
+
+
+def _blocks(markdown_text: str) -> List[Tuple[str, List[str]]]:
+    """
+    Split markdown into ("text", lines) and ("table", rows) blocks
+    """
+    blocks = []
+    for line in markdown_text.strip().splitlines():
+        kind = "table" if line.strip().startswith("|") else "text"
+        if blocks and blocks[-1][0] == kind:
+            blocks[-1][1].append(line)
+        else:
+            blocks.append((kind, [line]))
+    return blocks
+
+
+def _is_item_header(row: str) -> bool:
+    fields = table_columns(split_table_row(row)).values()
+    return "name" in fields and "amount" in fields
+
+
+def merge_invoice_pages(markdowns: List[str]) -> str:
+    """
+    Markdown of one invoice spread over several pages. Item tables that
+    continue on the next page (with a repeated header or none at all) are
+    joined into a single table so the items are extracted in one pass.
+    """
+    merged: List[Tuple[str, List[str]]] = []
+    item_table: Optional[List[str]] = None
+    for markdown_text in markdowns:
+        for kind, lines in _blocks(markdown_text):
+            if kind == "text":
+                lines = [line for line in lines if line.strip()]
+                if lines:
+                    merged.append((kind, lines))
+                continue
+            rows = [line for line in lines if not is_separator_row(split_table_row(line))]
+            width = len(split_table_row(lines[0]))
+            if item_table is not None and width == len(split_table_row(item_table[0])):
+                if _is_item_header(rows[0]):
+                    rows = rows[1:]
+                if not any(_is_item_header(row) for row in rows):
+                    item_table.extend(rows)
+                    continue
+            merged.append((kind, list(lines)))
+            if _is_item_header(lines[0]):
+                item_table = merged[-1][1]
+    return "\n\n".join("\n".join(lines) for _, lines in merged)
+
+
+class InvoiceGrouper:
+    """
+    Groups page results into invoices and structures each invoice once.
+
+    Pages are fed in completion order with `add`; they are grouped in page
+    order as soon as the preceding pages are known. Blank pages join no
+    invoice and duplicate pages reuse the result of their original. When a
+    page opens a new invoice, the previous one is complete: its pages are
+    merged and sent to `structure` (rules or LLM) as a single document,
+    while VLM work on later pages continues. Each page result then gets the
+    invoice JSON and is passed to `on_result`.
+    """
+
+    def __init__(
+        self,
+        structure: Callable[[str], Awaitable[Any]],
+        on_result: Optional[Callable[[dict], Any]] = None,
+    ):
+        self.structure = structure
+        self.on_result = on_result
+        self._pending: Dict[int, dict] = {}
+        self._next_page = 1
+        self._group: List[dict] = []
+        self._markers: List[PageMarkers] = []
+        self._tasks: List[asyncio.Task] = []
+        self._done: Dict[int, dict] = {}
+        self._duplicates: Dict[int, List[dict]] = {}
+        self.invoices: List[dict] = []
+
+    async def add(self, result: dict):
+        self._pending[result["page"]] = result
+        while self._next_page in self._pending:
+            page = self._pending.pop(self._next_page)
+            self._next_page += 1
+            check = page.get("page_check") or {}
+            if check.get("decision") == "blank":
+                # Separator sheets and blank backs belong to no invoice
+                page.update({"invoice": None, "parsed_json": None})
+                await self._emit(page)
+                continue
+            if check.get("decision") == "duplicate":
+                # A repeated page reuses its original's invoice, without
+                # adding its items a second time
+                original = check["duplicate_of"]
+                if original in self._done:
+                    await self._copy_result(page, self._done[original])
+                else:
+                    self._duplicates.setdefault(original, []).append(page)
+                continue
+
+            content = page.get("content") or ""
+            if "error" in page or content.startswith("Error:"):
+                # Nothing to read on a failed page: keep it with the current invoice
+                markers = PageMarkers(title=False, key=None, page_of=None, continuation=True)
+            else:
+                markers = page_markers(content)
+            if starts_new_invoice(markers, self._markers):
+                self._close_group()
+            self._group.append(page)
+            self._markers.append(markers)
+
+    async def _emit(self, page: dict):
+        if self.on_result is not None:
+            callback = self.on_result(page)
+            if inspect.isawaitable(callback):
+                await callback
+
+    async def _copy_result(self, page: dict, original: dict):
+        page.update(
+            {
+                key: original[key]
+                for key in ("invoice", "parsed_json", "extraction", "error")
+                if key in original
+            }
+        )
+        if page.get("invoice") is not None:
+            # Listed with the invoice; its page_check names the page it repeats
+            invoice = self.invoices[page["invoice"] - 1]
+            invoice["pages"] = sorted(invoice["pages"] + [page["page"]])
+        await self._emit(page)
+
+    def _close_group(self):
+        if not self._group:
+            return
+        invoice = {"invoice": len(self.invoices) + 1, "pages": [p["page"] for p in self._group]}
+        self.invoices.append(invoice)
+        self._tasks.append(asyncio.create_task(self._structure(invoice, self._group)))
+        self._group, self._markers = [], []
+
+    async def _structure(self, invoice: dict, pages: List[dict]):
+        markdowns = [
+            p["content"]
+            for p in pages
+            if "error" not in p and p["content"] and not p["content"].startswith("Error:")
+        ]
+        parsed, meta = None, {}
+        if markdowns:
+            try:
+                parsed = await self.structure(merge_invoice_pages(markdowns))
+            except Exception as e:
+                print(f"❌ Invoice {invoice['invoice']} failed: {str(e)}")
+                meta = {"error": str(e)}
+        if isinstance(parsed, ParsedPage):
+            parsed, meta = parsed.parsed_json, parsed.meta
+        invoice.update({"parsed_json": parsed, **meta})
+
+        for page in pages:
+            page.update({"invoice": invoice["invoice"], "parsed_json": parsed, **meta})
+            self._done[page["page"]] = page
+            await self._emit(page)
+            for duplicate in self._duplicates.pop(page["page"], []):
+                await self._copy_result(duplicate, page)
+
+    async def finish(self) -> List[dict]:
+        """
+        Close the last invoice and wait until every invoice is structured
+        Returns: one entry per invoice with its pages and JSON
+        """
+        self._close_group()
+        try:
+            await asyncio.gather(*self._tasks)
+        except BaseException:
+            self.cancel()
+            raise
+        return self.invoices
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
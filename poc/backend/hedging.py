@@ -0,0 +1,155 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Hedges that can be saved up while traffic is fast, so a burst of slow
+# calls can still be hedged
+MAX_HEDGE_CREDIT = 10.0
+
+
+class LatencyTracker:
+    """
+    Latency of the most recent `window` calls of one model
+    """
+
+    def __init__(self, window: int = 200):
+        self.samples: deque = deque(maxlen=window)
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, quantile: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class _ModelHedging:
+    def __init__(self, window: int):
+        self.latency = LatencyTracker(window)
+        self.credit = 0.0
+        self.counters = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "skipped_budget": 0,
+            "skipped_busy": 0,
+        }
+
+
+class Hedger:
+    """
+    Hedged requests against tail latency.
+
+    When a call has not finished after the `quantile` latency of the
+    model's recent calls, a duplicate is started; the first successful
+    response wins and the other call is cancelled. Every call earns
+    `max_extra_ratio` hedge credit and every hedge spends one, so hedges
+    stay below that fraction of the traffic. No hedge is sent before
+    `min_samples` calls have been measured, or when `is_busy()` says the
+    model has no spare capacity (a duplicate would only queue).
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        max_extra_ratio: float = 0.05,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self.quantile = quantile
+        self.max_extra_ratio = max_extra_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self._models: Dict[str, _ModelHedging] = {}
+
+    def _state(self, model: str) -> _ModelHedging:
+        if model not in self._models:
+            self._models[model] = _ModelHedging(self.window)
+        return self._models[model]
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        state = self._state(model)
+        if len(state.latency.samples) < self.min_samples:
+            return None
+        return state.latency.percentile(self.quantile)
+
+    async def run(
+        self,
+        model: str,
+        call: Callable[[], Awaitable[T]],
+        is_busy: Optional[Callable[[], bool]] = None,
+    ) -> T:
+        state = self._state(model)
+        state.counters["calls"] += 1
+        state.credit = min(MAX_HEDGE_CREDIT, state.credit + self.max_extra_ratio)
+        delay = self.hedge_delay(model)
+
+        primary = asyncio.ensure_future(self._timed(state, call))
+        if delay is None:
+            return await primary
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if state.credit < 1:
+                state.counters["skipped_budget"] += 1
+                return await primary
+            if is_busy is not None and is_busy():
+                state.counters["skipped_busy"] += 1
+                return await primary
+
+            state.credit -= 1
+            state.counters["hedged"] += 1
+            hedge = asyncio.ensure_future(self._timed(state, call))
+            winner = await _first_success(primary, hedge)
+            if winner is hedge:
+                state.counters["hedge_wins"] += 1
+            return winner.result()
+        finally:
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+
+    async def _timed(self, state: _ModelHedging, call: Callable[[], Awaitable[T]]) -> T:
+        started = time.monotonic()
+        try:
+            return await call()
+        finally:
+            # Cancelled losers count with the time they had run: a lower
+            # bound that keeps slow calls visible in the percentile
+            state.latency.record(time.monotonic() - started)
+
+    def metrics(self) -> dict:
+        snapshot = {}
+        for model, state in self._models.items():
+            calls = state.counters["calls"] or 1
+            hedged = state.counters["hedged"] or 1
+            delay = self.hedge_delay(model)
+            snapshot[model] = {
+                "hedge_after_ms": round(delay * 1000, 1) if delay is not None else None,
+                "hedge_rate": round(state.counters["hedged"] / calls, 4),
+                "hedge_win_rate": round(state.counters["hedge_wins"] / hedged, 4),
+                **state.counters,
+            }
+        return snapshot
+
+
+async def _first_success(*tasks: asyncio.Future) -> asyncio.Future:
+    """
+    The first task to finish without an error; the last one to fail when
+    they all fail
+    """
+    pending = set(tasks)
+    while True:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() is None:
+                return task
+        if not pending:
+            return next(iter(done))
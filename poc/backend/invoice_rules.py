@@ -0,0 +1,480 @@
+import re
+import unicodedata
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+# Same schema as the LLM prompt in main.py
+INVOICE_SCHEMA = {
+    "seller": ("name", "address", "phone", "fax", "tax_code"),
+    "invoice": ("title", "serial", "number", "date", "cqt_code"),
+    "buyer": ("name", "unit_name", "cccd", "passport", "tax_code", "address", "payment_method"),
+    "totals": ("subtotal", "vat_rate", "vat_amount", "total", "total_in_words"),
+}
+ITEM_FIELDS = ("stt", "name", "unit", "quantity", "unit_price", "amount")
+
+DEFAULT_REQUIRED_FIELDS = (
+    "seller.tax_code",
+    "invoice.serial",
+    "invoice.number",
+    "invoice.date",
+    "totals.total",
+    "items",
+)
+
+# Per-field confidence levels
+LABEL_AND_PATTERN = 0.95  # labelled value that also has the expected shape
+LABEL_ONLY = 0.8  # labelled free text (names, addresses, ...)
+PATTERN_ONLY = 0.6  # found by its shape alone, without a label
+MALFORMED = 0.3  # labelled value that does not have the expected shape
+
+# Labels of the standard Vietnamese e-invoice layout (lowercase, NFC).
+# "party.*" targets go to the seller or the buyer depending on the section
+# the line is in; None marks known labels whose value is not extracted.
+LINE_LABELS = [
+    ("đơn vị bán hàng", "seller.name"),
+    ("đơn vị bán", "seller.name"),
+    ("tên người bán", "seller.name"),
+    ("người bán hàng", "seller.name"),
+    ("người bán", "seller.name"),
+    ("họ tên người mua hàng", "buyer.name"),
+    ("họ và tên người mua hàng", "buyer.name"),
+    ("họ tên người mua", "buyer.name"),
+    ("người mua hàng", "buyer.name"),
+    ("người mua", "buyer.name"),
+    ("tên đơn vị", "party.unit_name"),
+    ("mã số thuế", "party.tax_code"),
+    ("mst", "party.tax_code"),
+    ("địa chỉ", "party.address"),
+    ("số điện thoại", "party.phone"),
+    ("điện thoại", "party.phone"),
+    ("fax", "party.fax"),
+    ("số cccd", "buyer.cccd"),
+    ("cccd", "buyer.cccd"),
+    ("căn cước công dân", "buyer.cccd"),
+    ("mã định danh", "buyer.cccd"),
+    ("số hộ chiếu", "buyer.passport"),
+    ("hộ chiếu", "buyer.passport"),
+    ("hình thức thanh toán", "buyer.payment_method"),
+    ("mẫu số - ký hiệu", "invoice.serial"),
+    ("ký hiệu", "invoice.serial"),
+    ("số hóa đơn", "invoice.number"),
+    ("số", "invoice.number"),
+    ("ngày lập", "invoice.date"),
+    ("ngày", "invoice.date"),
+    ("mã của cqt", "invoice.cqt_code"),
+    ("mã cqt", "invoice.cqt_code"),
+    ("cộng tiền hàng hóa, dịch vụ", "totals.subtotal"),
+    ("cộng tiền hàng", "totals.subtotal"),
+    ("tổng tiền hàng", "totals.subtotal"),
+    ("thuế suất gtgt", "totals.vat_rate"),
+    ("thuế suất", "totals.vat_rate"),
+    ("tiền thuế gtgt", "totals.vat_amount"),
+    ("tiền thuế", "totals.vat_amount"),
+    ("tổng cộng tiền thanh toán", "totals.total"),
+    ("tổng tiền thanh toán", "totals.total"),
+    ("tổng cộng", "totals.total"),
+    ("số tiền viết bằng chữ", "totals.total_in_words"),
+    ("số tiền bằng chữ", "totals.total_in_words"),
+    ("viết bằng chữ", "totals.total_in_words"),
+    ("số tài khoản", None),
+    ("tài khoản", None),
+    ("ngân hàng", None),
+    ("email", None),
+    ("website", None),
+    ("mẫu số", None),
+]
+LABEL_TARGETS = dict(LINE_LABELS)
+
+# Item table columns, matched against the normalized header cell
+ITEM_COLUMNS = [
+    (re.compile(r"^(stt|tt|số thứ tự)$"), "stt"),
+    (re.compile(r"^(đơn vị tính|đvt|đơn vị)$"), "unit"),
+    (re.compile(r"^(số lượng|sl)$"), "quantity"),
+    (re.compile(r"^đơn giá"), "unit_price"),
+    (re.compile(r"^(thành tiền|số tiền|tiền)"), "amount"),
+    (re.compile(r"tên hàng|hàng hóa|dịch vụ|diễn giải|nội dung|^tên"), "name"),
+]
+
+_LABEL_RE = re.compile(
+    r"(?:^|(?<=[\s|]))(?P<label>"
+    + "|".join(re.escape(label) for label, _ in sorted(LINE_LABELS, key=lambda l: -len(l[0])))
+    + r")\s*(?:\([^)]*\)\s*)?[:：]",
+    re.IGNORECASE,
+)
+_SELLER_HEADING_RE = re.compile(r"^(thông tin )?(đơn vị bán|người bán)", re.IGNORECASE)
+_BUYER_HEADING_RE = re.compile(r"^(thông tin )?(đơn vị mua|người mua)", re.IGNORECASE)
+_TITLE_RE = re.compile(r"^h[óo]a đ[ơo]n\b.*", re.IGNORECASE)
+_SPELLED_DATE_RE = re.compile(
+    r"ngày\s*(\d{1,2})\s*tháng\s*(\d{1,2})\s*năm\s*(\d{4})", re.IGNORECASE
+)
+_NUMERIC_DATE_RE = re.compile(r"\b(\d{1,2})\s*[/.-]\s*(\d{1,2})\s*[/.-]\s*(\d{4})\b")
+_TAX_CODE_RE = re.compile(r"(?<!\d)(\d{10})(?:\s*-\s*(\d{3}))?(?!\d)")
+_SERIAL_RE = re.compile(r"\b(\d[CK]\d{2}[A-Z]{3}|[A-Z]{2}/\d{2}[A-Z])\b")
+_INVOICE_NUMBER_RE = re.compile(r"^\d{1,8}$")
+_VAT_RATE_RE = re.compile(r"^(\d{1,2}(?:[.,]\d+)?)\s*%$|^(kct|kkknt)$", re.IGNORECASE)
+_PHONE_RE = re.compile(r"^\+?[\d\s().-]{8,}$")
+_NUMBER_RE = re.compile(r"^-?[\d.,]+$")
+_CURRENCY_RE = re.compile(r"\s*(vnđ|vnd|đồng|đ)\.?$", re.IGNORECASE)
+
+
+def empty_invoice() -> dict:
+    return {
+        "seller": {name: "" for name in INVOICE_SCHEMA["seller"]},
+        "invoice": {name: "" for name in INVOICE_SCHEMA["invoice"]},
+        "buyer": {name: "" for name in INVOICE_SCHEMA["buyer"]},
+        "items": [],
+        "totals": {name: "" for name in INVOICE_SCHEMA["totals"]},
+    }
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def normalize_label(text: str) -> str:
+    text = re.sub(r"\([^)]*\)", " ", normalize_text(text).lower())
+    return " ".join(text.strip(" :：*_#|").split())
+
+
+def parse_number(text: str) -> Optional[str]:
+    """
+    Number without thousands separators ("256.050" -> "256050", "1,5" -> "1.5").
+    Vietnamese formatting is assumed: '.' groups thousands, ',' marks decimals,
+    unless the shape of the number says otherwise.
+    Returns: None when the text is not a number
+    """
+    text = _CURRENCY_RE.sub("", normalize_text(text)).replace(" ", "")
+    if not text or not _NUMBER_RE.match(text) or not any(c.isdigit() for c in text):
+        return None
+    sign = "-" if text.startswith("-") else ""
+    text = text.lstrip("-")
+
+    integer, decimals = text, ""
+    separators = [c for c in text if c in ".,"]
+    if separators:
+        if len(set(separators)) == 2:
+            decimal_sep = separators[-1]
+            if separators.count(decimal_sep) > 1:
+                return None
+            integer, decimals = text.rsplit(decimal_sep, 1)
+            groups = integer.split("," if decimal_sep == "." else ".")
+        else:
+            groups = text.split(separators[0])
+            if len(groups) == 2 and len(groups[1]) != 3:
+                # A single separator not followed by 3 digits is a decimal mark
+                integer, decimals = groups
+                groups = [integer]
+        if not groups[0] or not decimals.isdigit() and decimals:
+            return None
+        if len(groups) > 1 and (
+            len(groups[0]) > 3 or any(len(group) != 3 for group in groups[1:])
+        ):
+            return None
+        integer = "".join(groups)
+
+    decimals = decimals.rstrip("0")
+    return sign + integer + (f".{decimals}" if decimals else "")
+
+
+def to_decimal(value: str) -> Optional[Decimal]:
+    try:
+        return Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+
+
+def normalize_date(text: str) -> Optional[str]:
+    """
+    Returns: the date as dd/mm/yyyy, or None when no valid date is found
+    """
+    match = _SPELLED_DATE_RE.search(text) or _NUMERIC_DATE_RE.search(text)
+    if not match:
+        return None
+    day, month, year = (int(part) for part in match.groups())
+    if not (1 <= day <= 31 and 1 <= month <= 12):
+        return None
+    return f"{day:02d}/{month:02d}/{year}"
+
+
+def _clean_value(text: str) -> str:
+    return normalize_text(text).strip(" |*_#:;,-")
+
+
+def _validate(field: str, value: str) -> Tuple[str, float]:
+    """
+    Normalize a labelled value for its field
+    Returns: (value, confidence)
+    """
+    name = field.split(".")[-1]
+    if name == "tax_code":
+        match = _TAX_CODE_RE.search(value)
+        if match:
+            return "-".join(part for part in match.groups() if part), LABEL_AND_PATTERN
+        return value, MALFORMED
+    if name == "serial":
+        match = _SERIAL_RE.search(value.upper())
+        if match:
+            return match.group(1), LABEL_AND_PATTERN
+        return value, MALFORMED
+    if name == "number":
+        value = value.split()[0] if value else value
+        return value, LABEL_AND_PATTERN if _INVOICE_NUMBER_RE.match(value) else MALFORMED
+    if name == "date":
+        date = normalize_date(value)
+        return (date, LABEL_AND_PATTERN) if date else (value, MALFORMED)
+    if name in ("subtotal", "vat_amount", "total"):
+        number = parse_number(value)
+        return (number, LABEL_AND_PATTERN) if number is not None else (value, MALFORMED)
+    if name == "vat_rate":
+        match = _VAT_RATE_RE.match(value.replace(" ", ""))
+        if match:
+            rate = match.group(1)
+            return (f"{rate.replace(',', '.')}%" if rate else match.group(2).upper()), LABEL_AND_PATTERN
+        return value, MALFORMED
+    if name in ("phone", "fax"):
+        return value, LABEL_AND_PATTERN if _PHONE_RE.match(value) else MALFORMED
+    return value, LABEL_ONLY
+
+
+def split_table_row(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [_clean_value(cell) for cell in line.split("|")]
+
+
+def is_separator_row(cells: List[str]) -> bool:
+    return all(re.fullmatch(r":?-{2,}:?", cell.replace(" ", "")) for cell in cells if cell)
+
+
+def table_columns(header: List[str]) -> Dict[int, str]:
+    columns = {}
+    for idx, cell in enumerate(header):
+        label = normalize_label(cell)
+        for pattern, field in ITEM_COLUMNS:
+            if pattern.search(label) and field not in columns.values():
+                columns[idx] = field
+                break
+    return columns
+
+
+class _Extractor:
+    def __init__(self):
+        self.data = empty_invoice()
+        self.confidence: Dict[str, float] = {}
+        self.section = "seller"
+
+    def set(self, field: str, value: str, confidence: float):
+        section, name = field.split(".")
+        if not value or self.confidence.get(field, 0.0) >= confidence:
+            return
+        self.data[section][name] = value
+        self.confidence[field] = confidence
+
+    def resolve(self, target: str) -> str:
+        section, name = target.split(".")
+        if section != "party":
+            return target
+        if self.section == "seller" and name == "unit_name":
+            return "seller.name"
+        return f"{self.section}.{name}"
+
+    def line(self, line: str):
+        line = normalize_text(line.replace("**", "").replace("__", "")).lstrip("#>-* ")
+        if not line:
+            return
+        if _SELLER_HEADING_RE.match(line):
+            self.section = "seller"
+        elif _BUYER_HEADING_RE.match(line):
+            self.section = "buyer"
+        if _TITLE_RE.match(line) and ":" not in line:
+            self.set("invoice.title", line.upper(), LABEL_AND_PATTERN if line.isupper() else LABEL_ONLY)
+
+        matches = list(_LABEL_RE.finditer(line))
+        for idx, match in enumerate(matches):
+            target = LABEL_TARGETS[match.group("label").lower()]
+            if target is None:
+                continue
+            if target.startswith("seller."):
+                self.section = "seller"
+            elif target.startswith("buyer."):
+                self.section = "buyer"
+            end = matches[idx + 1].start() if idx + 1 < len(matches) else len(line)
+            value = _clean_value(line[match.end() : end])
+            if value:
+                field = self.resolve(target)
+                self.set(field, *_validate(field, value))
+
+    def table(self, rows: List[List[str]]):
+        rows = [row for row in rows if not is_separator_row(row)]
+        if not rows:
+            return
+        columns = table_columns(rows[0])
+        if "name" not in columns.values() or "amount" not in columns.values():
+            # Not an item table: read two-column tables as key:value lines
+            for row in rows:
+                if len(row) == 2 and row[0] and row[1]:
+                    self.line(f"{row[0]}: {row[1]}")
+            return
+
+        for row in rows[1:]:
+            item = {field: "" for field in ITEM_FIELDS}
+            for idx, field in columns.items():
+                if idx < len(row):
+                    item[field] = row[idx]
+            total_field = LABEL_TARGETS.get(normalize_label(item["name"]))
+            if total_field and total_field.startswith("totals."):
+                # Summary rows such as "Cộng tiền hàng" inside the table
+                self.set(total_field, *_validate(total_field, item["amount"]))
+                continue
+            amount = parse_number(item["amount"])
+            if not item["name"] or amount is None:
+                # Column index rows ("A | B | 1 | 2 | 3=1x2") and blank rows
+                continue
+            item["amount"] = amount
+            for field in ("quantity", "unit_price"):
+                number = parse_number(item[field])
+                if number is not None:
+                    item[field] = number
+            self.data["items"].append(item)
+
+
+@dataclass
+class RuleExtraction:
+    """
+    Result of the rule-based extractor: the invoice JSON in the LLM schema,
+    a confidence in [0, 1] per field ("seller.tax_code", ..., "items") and
+    whether items, subtotal, VAT and total add up.
+    """
+
+    data: dict
+    confidence: Dict[str, float]
+    reconciled: bool
+
+
+def extract_invoice(markdown_text: str, amount_tolerance: float = 1.0) -> RuleExtraction:
+    """
+    Deterministic extraction for the standard Vietnamese e-invoice layout:
+    labelled "key: value" lines, tax code / serial / date patterns and a
+    markdown item table. Amounts lose their thousands separators and dates
+    become dd/mm/yyyy, like the LLM prompt asks.
+    """
+    extractor = _Extractor()
+    table: List[List[str]] = []
+    for line in markdown_text.splitlines():
+        if line.strip().startswith("|"):
+            table.append(split_table_row(line))
+            continue
+        if table:
+            extractor.table(table)
+            table = []
+        extractor.line(line)
+    if table:
+        extractor.table(table)
+
+    # "Ngày 05 tháng 03 năm 2024" carries its own labels; other matches are
+    # unlabelled fallbacks
+    spelled_date = _SPELLED_DATE_RE.search(markdown_text)
+    if spelled_date:
+        extractor.set("invoice.date", normalize_date(spelled_date.group(0)), LABEL_AND_PATTERN)
+    date = normalize_date(markdown_text)
+    if date:
+        extractor.set("invoice.date", date, PATTERN_ONLY)
+    match = _TAX_CODE_RE.search(markdown_text)
+    if match:
+        extractor.set(
+            "seller.tax_code", "-".join(part for part in match.groups() if part), PATTERN_ONLY
+        )
+
+    data = extractor.data
+    confidence = {
+        f"{section}.{name}": extractor.confidence.get(f"{section}.{name}", 0.0)
+        for section, fields in INVOICE_SCHEMA.items()
+        for name in fields
+    }
+    items_ok = _items_consistent(data["items"], Decimal(str(amount_tolerance)))
+    confidence["items"] = (
+        0.0 if not data["items"] else LABEL_AND_PATTERN if items_ok else LABEL_ONLY
+    )
+    return RuleExtraction(
+        data=data,
+        confidence=confidence,
+        reconciled=reconcile_totals(data, amount_tolerance),
+    )
+
+
+def _items_consistent(items: List[dict], tolerance: Decimal) -> bool:
+    for item in items:
+        quantity, price, amount = (
+            to_decimal(item["quantity"]),
+            to_decimal(item["unit_price"]),
+            to_decimal(item["amount"]),
+        )
+        if None in (quantity, price, amount):
+            continue
+        if abs(quantity * price - amount) > tolerance + abs(amount) * Decimal("0.0005"):
+            return False
+    return True
+
+
+def reconcile_totals(data: dict, amount_tolerance: float = 1.0) -> bool:
+    """
+    True when the amounts that are present agree: sum of items == subtotal
+    and subtotal + VAT == total (within a rounding tolerance per line).
+    False when nothing can be checked.
+    """
+    tolerance = Decimal(str(amount_tolerance))
+    totals = data["totals"]
+    subtotal = to_decimal(totals["subtotal"])
+    vat_amount = to_decimal(totals["vat_amount"])
+    total = to_decimal(totals["total"])
+
+    amounts = [to_decimal(item["amount"]) for item in data["items"]]
+    items_sum = sum(amounts) if amounts and None not in amounts else None
+
+    checks = []
+    if items_sum is not None and subtotal is not None:
+        checks.append(abs(items_sum - subtotal) <= tolerance * len(amounts))
+    if total is not None and subtotal is not None:
+        checks.append(abs(subtotal + (vat_amount or 0) - total) <= tolerance)
+    elif total is not None and items_sum is not None:
+        checks.append(abs(items_sum + (vat_amount or 0) - total) <= tolerance * len(amounts))
+    return bool(checks) and all(checks)
+
+
+@dataclass(frozen=True)
+class RuleExtractorPolicy:
+    """
+    When the rule-based result is used instead of calling the LLM: every
+    field in `required_fields` has at least `min_confidence` and, with
+    `require_reconciled`, the totals add up.
+    """
+
+    required_fields: Tuple[str, ...] = DEFAULT_REQUIRED_FIELDS
+    min_confidence: float = 0.75
+    amount_tolerance: float = 1.0
+    require_reconciled: bool = True
+
+    @property
+    def label(self) -> str:
+        return (
+            f"rules-{','.join(self.required_fields)}-{self.min_confidence}"
+            f"-{self.amount_tolerance}-{int(self.require_reconciled)}"
+        )
+
+    def evaluate(self, markdown_text: str) -> Tuple[RuleExtraction, List[str]]:
+        """
+        Returns: (extraction, reasons the LLM is still needed; empty if none)
+        """
+        extraction = extract_invoice(markdown_text, self.amount_tolerance)
+        reasons = [
+            f"missing {field}"
+            for field in self.required_fields
+            if extraction.confidence.get(field, 0.0) < self.min_confidence
+        ]
+        if self.require_reconciled and not extraction.reconciled:
+            reasons.append("totals do not reconcile")
+        return extraction, reasons
@@ -0,0 +1,165 @@
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from job_store import FINISHED_STATUSES, JobStore, new_job
+from uploads import UploadSpool
+
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be queued"""
+
+
+class JobManager:
+    """
+    Runs OCR jobs on a bounded pool of background workers.
+
+    `process(upload, on_page)` runs the whole document pipeline; `on_page`
+    is called with each page result as soon as it completes, so job status
+    shows progress while the document is still being processed. At most
+    `max_queued` jobs wait for a worker. Status changes that race (a worker
+    picking up a job that is being cancelled) are compare-and-set in the
+    store, so a cancelled job never runs.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        process: Callable[[UploadSpool, Callable], Awaitable[dict]],
+        workers: int = 2,
+        max_queued: int = 100,
+    ):
+        self.store = store
+        self.process = process
+        self.workers = max(1, workers)
+        self._queue: "asyncio.Queue" = asyncio.Queue(maxsize=max_queued)
+        self._worker_tasks = []
+        self._running = {}
+
+    def start(self):
+        if not self._worker_tasks:
+            self._worker_tasks = [
+                asyncio.create_task(self._worker(), name=f"ocr-job-worker-{i}")
+                for i in range(self.workers)
+            ]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        while not self._queue.empty():
+            _, upload = self._queue.get_nowait()
+            upload.close()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, upload: UploadSpool) -> dict:
+        """
+        Queue an uploaded document; the job takes ownership of the upload
+        """
+        if self._queue.full():
+            raise JobQueueFull()
+        job = new_job(uuid.uuid4().hex, upload.filename)
+        await asyncio.to_thread(self.store.create_job, job)
+        self._queue.put_nowait((job["job_id"], upload))
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return None
+        job["results"] = await asyncio.to_thread(self.store.get_page_results, job_id)
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        Cancel a queued or running job; finished jobs are left as they are
+        """
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return job
+
+        cancelled = await self._finish(job_id, "cancelled", statuses=("queued",))
+        if cancelled is not None:
+            return cancelled
+        # Already picked up: the worker registered its task before the job
+        # could become running, and records the cancellation once it unwinds
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            return {**job, "status": "cancelling"}
+        return await asyncio.to_thread(self.store.get_job, job_id)
+
+    async def _finish(
+        self, job_id: str, status: str, statuses: Optional[tuple] = None, **data
+    ) -> Optional[dict]:
+        return await asyncio.to_thread(
+            self.store.update_job,
+            job_id,
+            {"status": status, "finished_at": time.time(), **data},
+            statuses,
+        )
+
+    async def _worker(self):
+        while True:
+            job_id, upload = await self._queue.get()
+            try:
+                await self._run_job(job_id, upload)
+            except Exception as e:
+                print(f"❌ Job {job_id} crashed: {str(e)}")
+            finally:
+                upload.close()
+                self._queue.task_done()
+
+    async def _start(self, job_id: str, upload: UploadSpool) -> Optional[dict]:
+        started = await asyncio.to_thread(
+            self.store.update_job,
+            job_id,
+            {"status": "running", "started_at": time.time()},
+            ("queued",),
+        )
+        if started is None:
+            # Cancelled while waiting in the queue
+            return None
+
+        async def on_page(result: dict):
+            await asyncio.to_thread(self.store.add_page_result, job_id, result)
+
+        return await self.process(upload, on_page)
+
+    async def _run_job(self, job_id: str, upload: UploadSpool):
+        # Registered before the job can become running, so cancel() always
+        # finds the task of a running job
+        task = asyncio.create_task(self._start(job_id, upload))
+        self._running[job_id] = task
+        try:
+            response = await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # The worker itself is shutting down
+                await self._finish(job_id, "cancelled", error="Server shutting down")
+                raise
+            await self._finish(job_id, "cancelled")
+            return
+        except Exception as e:
+            await self._finish(job_id, "failed", error=str(e))
+            return
+        finally:
+            self._running.pop(job_id, None)
+
+        if response is None:
+            return
+        # Cached documents complete without per-page callbacks
+        for result in response["results"]:
+            await asyncio.to_thread(self.store.add_page_result, job_id, result)
+        # With invoice grouping, the invoices /api/convert would return
+        invoices = {
+            key: response[key] for key in ("total_invoices", "invoices") if key in response
+        }
+        await self._finish(
+            job_id, "succeeded", ("running",), total_pages=response["total_pages"], **invoices
+        )
@@ -1,112 +1,257 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.requests import ClientDisconnect
+from contextlib import asynccontextmanager
+from dataclasses import replace
+import asyncio
 from pathlib import Path
+from typing import AbstractSet, Literal, Optional, Tuple
 import fitz  # PyMuPDF
-import base64
-import requests
 import json
 import tempfile
 import os
 
-app = FastAPI(title="OCR POC")
-
-# Enable CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from admission import AdmissionController, MemoryBudget, Overloaded, PageMemory
+from batch import prepare_batch, run_batch
+from cache import ResultCache, make_key, normalize_markdown
+from config import settings
+from continuation import TokenBudget, append_continuation, is_truncated
+from disconnect import cancel_on_disconnect
+from dpi import DpiPolicy
+from encoding import EncodingOptions
+from grouping import InvoiceGrouper
+from hedging import Hedger
+from invoice_rules import RuleExtractorPolicy
+from job_store import create_job_store
+from jobs import JobManager, JobQueueFull
+from pagecheck import DuplicateTracker, PageCheckPolicy
+from pipeline import PageExecutor, ParsedPage
+from preprocess import PreprocessOptions
+from ratelimit import UpstreamLimiter
+from rasterizer import RasterPool
+from rendering import (
+    RenderError,
+    RenderedPage,
+    RenderOptions,
+    aiter_rendered_pages,
+    count_document_pages,
+    images_to_pdf,
+    iter_page_images,
+)
+from singleflight import SingleFlight
+from streaming import STREAM_MEDIA_TYPES, stream_pipeline
+from textlayer import TextLayerPolicy
+from tiling import TilingPolicy, stitch_markdown
+from uploads import (
+    BATCH_UPLOAD_OPENAPI,
+    PDF_UPLOAD_OPENAPI,
+    UploadSpool,
+    receive_batch_upload,
+    receive_pdf_upload,
+)
+from upstream import UpstreamClient
+
+API_URL = settings.API_URL
+VLM_MODEL = settings.VLM_MODEL
+LLM_MODEL = settings.LLM_MODEL
+API_KEY = settings.API_KEY
+
+# Shared by the VLM and LLM stages so both reuse the same keep-alive pool
+upstream_client = UpstreamClient(
+    api_url=API_URL,
+    api_key=API_KEY,
+    max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE,
+    timeout=settings.UPSTREAM_TIMEOUT,
+    connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+    max_retries=settings.UPSTREAM_MAX_RETRIES,
+    backoff_base=settings.UPSTREAM_BACKOFF_BASE,
+    backoff_max=settings.UPSTREAM_BACKOFF_MAX,
+    # Per-model quotas and adaptive concurrency shared by the VLM and LLM stages
+    limiter=UpstreamLimiter(
+        model_quotas={
+            VLM_MODEL: (settings.VLM_REQUESTS_PER_MINUTE, settings.VLM_TOKENS_PER_MINUTE),
+            LLM_MODEL: (settings.LLM_REQUESTS_PER_MINUTE, settings.LLM_TOKENS_PER_MINUTE),
+        },
+        initial_concurrency=settings.UPSTREAM_INITIAL_CONCURRENCY,
+        min_concurrency=settings.UPSTREAM_MIN_CONCURRENCY,
+        max_concurrency=settings.UPSTREAM_MAX_CONCURRENCY,
+        latency_spike_factor=settings.UPSTREAM_LATENCY_SPIKE_FACTOR,
+        image_tokens=settings.UPSTREAM_IMAGE_TOKENS,
+    ),
+    # Duplicate calls slower than the usual tail latency, within a load budget
+    hedger=(
+        Hedger(
+            quantile=settings.HEDGE_PERCENTILE,
+            max_extra_ratio=settings.HEDGE_MAX_EXTRA_RATIO,
+            min_samples=settings.HEDGE_MIN_SAMPLES,
+        )
+        if settings.HEDGE_ENABLED
+        else None
+    ),
 )
 
-# Create uploads directory
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
-API_URL = "https://mkp-api.fptcloud.com/v1/chat/completions"
-VLM_MODEL = "FPT.AI-KIE-v1.7"
-LLM_MODEL = "gpt-oss-120b"
-API_KEY = "sk-gojYePiQueqAHdllper3UA"
+# Per-page VLM output budget, estimated from the page's ink area
+vlm_budget = TokenBudget(
+    min_tokens=settings.VLM_MIN_TOKENS,
+    max_tokens=settings.VLM_MAX_TOKENS,
+)
 
+# Page images held in memory across all documents, and how many documents
+# may be pending at once before new uploads are turned away
+memory_budget = MemoryBudget(max_bytes=settings.MEMORY_BUDGET_MB * 1024 * 1024)
+admission = AdmissionController(
+    budget=memory_budget,
+    max_documents=settings.ADMISSION_MAX_DOCUMENTS,
+    retry_after=settings.ADMISSION_RETRY_AFTER,
+)
 
-def pdf_to_images(pdf_path: str) -> list:
-    """
-    Convert PDF pages to base64 encoded images
-    Returns: List of base64 encoded images
-    """
-    images = []
-    pdf_document = fitz.open(pdf_path)
+# Sandboxed multi-process page rasterization; RASTER_WORKERS=0 renders in a
+# thread of the API process instead (page-count limit only)
+raster_pool = (
+    RasterPool(
+        max_workers=settings.RASTER_WORKERS,
+        chunk_pages=settings.RASTER_CHUNK_PAGES,
+        recycle_after_documents=settings.RASTER_RECYCLE_DOCUMENTS,
+        max_pages=settings.RASTER_MAX_PAGES,
+        max_memory_mb=settings.RASTER_MAX_MEMORY_MB,
+        max_cpu_seconds=settings.RASTER_MAX_CPU_SECONDS,
+        task_timeout=settings.RASTER_TASK_TIMEOUT,
+    )
+    if settings.RASTER_WORKERS > 0
+    else None
+)
 
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document[page_num]
-        # Render page to image with 2x resolution
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
+# How pages are rendered and encoded for the VLM
+RENDER_OPTIONS = RenderOptions(
+    scale=settings.RENDER_SCALE,
+    encoding=EncodingOptions(
+        format=settings.IMAGE_FORMAT,
+        quality=settings.IMAGE_QUALITY,
+        grayscale=settings.IMAGE_GRAYSCALE,
+        palette_colors=settings.IMAGE_PALETTE_COLORS,
+        max_pixels=settings.IMAGE_MAX_PIXELS,
+        fidelity_psnr=settings.IMAGE_FIDELITY_PSNR,
+    ),
+    dpi=(
+        DpiPolicy(
+            min_scale=settings.DPI_MIN_SCALE,
+            max_scale=settings.DPI_MAX_SCALE,
+            target_glyph_px=settings.DPI_TARGET_GLYPH_PX,
+            default_scale=settings.RENDER_SCALE,
+        )
+        if settings.ADAPTIVE_DPI
+        else None
+    ),
+    text_layer=(
+        TextLayerPolicy(
+            min_glyphs=settings.TEXT_LAYER_MIN_GLYPHS,
+            min_text_coverage=settings.TEXT_LAYER_MIN_COVERAGE,
+            max_image_ratio=settings.TEXT_LAYER_MAX_IMAGE_RATIO,
+        )
+        if settings.TEXT_LAYER_ENABLED
+        else None
+    ),
+    page_check=(
+        PageCheckPolicy(
+            blank_max_ink=settings.BLANK_MAX_INK,
+            duplicates=settings.DUPLICATE_PAGES_ENABLED,
+        )
+        if settings.PAGE_CHECK_ENABLED
+        else None
+    ),
+    preprocess=(
+        PreprocessOptions(
+            deskew=settings.PREPROCESS_DESKEW,
+            crop_margins=settings.PREPROCESS_CROP,
+            denoise=settings.PREPROCESS_DENOISE,
+            binarize=settings.PREPROCESS_BINARIZE,
+            max_skew_degrees=settings.PREPROCESS_MAX_SKEW,
+            margin_px=settings.PREPROCESS_MARGIN_PX,
+            report_savings=settings.PREPROCESS_REPORT_SAVINGS,
+        )
+        if settings.PREPROCESS_ENABLED
+        else None
+    ),
+    tiling=(
+        TilingPolicy(
+            max_tile_height=settings.TILE_MAX_HEIGHT,
+            max_tile_pixels=settings.TILE_MAX_PIXELS,
+            overlap_px=settings.TILE_OVERLAP_PX,
+            max_tiles=settings.TILE_MAX_TILES,
+        )
+        if settings.TILING_ENABLED
+        else None
+    ),
+)
 
-        # Convert to bytes
-        img_bytes = pix.tobytes("png")
+# Identical documents / pages processed at the same time share one computation
+document_flights = SingleFlight()
+page_flights = SingleFlight()
+
+# Work dropped because the client went away
+cancellation_counters = {"disconnects": 0, "pages": 0}
+
+# Deterministic extraction for standard e-invoices; the LLM is the fallback
+RULE_POLICY = (
+    RuleExtractorPolicy(
+        required_fields=tuple(
+            field.strip() for field in settings.RULES_REQUIRED_FIELDS.split(",") if field.strip()
+        ),
+        min_confidence=settings.RULES_MIN_CONFIDENCE,
+    )
+    if settings.RULES_ENABLED
+    else None
+)
 
-        # Encode to base64
-        img_base64 = base64.b64encode(img_bytes).decode("utf-8")
-        images.append(f"data:image/png;base64,{img_base64}")
+# Content-addressed cache for VLM/LLM results and whole documents
+result_cache = (
+    ResultCache(
+        db_path=settings.CACHE_DB_PATH,
+        memory_entries=settings.CACHE_MEMORY_ENTRIES,
+        max_disk_bytes=settings.CACHE_MAX_DISK_MB * 1024 * 1024,
+        ttl_seconds=settings.CACHE_TTL_SECONDS,
+    )
+    if settings.CACHE_ENABLED
+    else None
+)
 
-    pdf_document.close()
-    return images
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_manager.start()
+    yield
+    await job_manager.stop()
+    await upstream_client.aclose()
+    if raster_pool is not None:
+        raster_pool.shutdown()
+    if result_cache is not None:
+        result_cache.close()
 
-def call_vlm_api(image_base64: str) -> str:
-    """
-    Call VLM API to extract text from image
-    Returns: Extracted text in markdown format
-    """
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {API_KEY}"}
 
-    payload = {
-        "model": "FPT.AI-KIE-v1.7",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "Trích xuất toàn bộ dữ liệu chữ từ ảnh thành định dạng markdown, không bỏ sót dữ liệu nào",
-                    },
-                    {"type": "image_url", "image_url": {"url": image_base64}},
-                ],
-            }
-        ],
-        "system_prompt": "Extract all text information from image to Key:Value text format (not a json format). Separate paragraphs with '###'",
-        "streaming": False,
-        "temperature": 1,
-        "max_tokens": 1024,
-        "top_p": 1,
-        "top_k": 40,
-        "presence_penalty": 0,
-        "frequency_penalty": 0,
-    }
+app = FastAPI(title="OCR POC", lifespan=lifespan)
 
-    try:
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
+# Enable CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
-        result = response.json()
-        content = result["choices"][0]["message"]["content"]
-        print(content)
-        return content
-    except Exception as e:
-        print(f"Error calling VLM API: {str(e)}")
-        return f"Error: {str(e)}"
+# Create uploads directory
+UPLOAD_DIR = Path("uploads")
+UPLOAD_DIR.mkdir(exist_ok=True)
 
 
-def call_llm_api(markdown_text: str) -> dict:
-    """
-    Call LLM API to convert markdown to structured JSON
-    Returns: Parsed JSON object or None if error
-    """
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {API_KEY}"}
+VLM_PROMPT = "Trích xuất toàn bộ dữ liệu chữ từ ảnh thành định dạng markdown, không bỏ sót dữ liệu nào"
+VLM_CONTINUE_PROMPT = "Câu trả lời trước bị ngắt giữa chừng. Tiếp tục trích xuất từ đúng vị trí đã dừng, không lặp lại nội dung đã viết"
+VLM_SYSTEM_PROMPT = "Extract all text information from image to Key:Value text format (not a json format). Separate paragraphs with '###'"
 
-    query = """Bạn là một hệ thống trích xuất dữ liệu chính xác từ văn bản hóa đơn dạng Markdown.
+LLM_PROMPT = """Bạn là một hệ thống trích xuất dữ liệu chính xác từ văn bản hóa đơn dạng Markdown.
     ## Yêu cầu:
     Phân tích kỹ nội dung Markdown của hóa đơn đầu vào và trả kết quả dưới dạng JSON theo đúng mẫu sau:
     {
@@ -164,7 +309,156 @@ def call_llm_api(markdown_text: str) -> dict:
     {markdown_text}
     </markdown>
     """
-    query = query.replace("{markdown_text}", markdown_text)
+
+
+def pdf_to_images(pdf_path: str, options: RenderOptions = None) -> list:
+    """
+    Convert PDF pages to base64 encoded images (RENDER_OPTIONS by default),
+    rendered in the sandboxed raster pool when enabled
+    Returns: List of base64 encoded images
+    Raises: RenderError when the PDF cannot be rendered within the limits
+    """
+    options = options or RENDER_OPTIONS
+    if raster_pool is not None:
+        # One image per page, as iter_page_images
+        pages = raster_pool.render_document(pdf_path, replace(options, tiling=None))
+        return [page.data_uri for page in pages]
+    return list(iter_page_images(pdf_path, options, max_pages=settings.RASTER_MAX_PAGES))
+
+
+async def document_page_count(source) -> int:
+    """
+    Number of pages of a PDF (path or bytes), opened on the raster pool when enabled
+    Raises: RenderError when the PDF cannot be opened within the limits
+    """
+    if raster_pool is not None:
+        return await raster_pool.page_count(source)
+    return await asyncio.to_thread(count_document_pages, source, settings.RASTER_MAX_PAGES)
+
+
+def aiter_document_pages(
+    source,
+    memory: Optional[PageMemory] = None,
+    options: Optional[RenderOptions] = None,
+    skip: AbstractSet[int] = frozenset(),
+):
+    """
+    Render PDF pages (from a path or bytes) lazily, in page order, with
+    RENDER_OPTIONS by default and on the raster pool when enabled. With
+    `memory`, pages are reserved against the memory budget before they are
+    rendered. 0-based page indexes in `skip` are not rendered at all.
+    Returns: Async iterator of RenderedPage
+    """
+    options = options or RENDER_OPTIONS
+    if raster_pool is not None:
+        return raster_pool.aiter_pages(source, options, memory=memory, skip=skip)
+    return aiter_rendered_pages(
+        source,
+        prefetch=settings.RENDER_PREFETCH,
+        options=options,
+        max_pages=settings.RASTER_MAX_PAGES,
+        memory=memory,
+        skip=skip,
+    )
+
+
+def vlm_payload(image_base64: str, max_tokens: int, partial: Optional[str] = None) -> dict:
+    """
+    VLM request for one page image; with `partial`, a continuation request
+    asking the model to carry on after the output it already produced
+    """
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": VLM_PROMPT},
+                {"type": "image_url", "image_url": {"url": image_base64}},
+            ],
+        }
+    ]
+    if partial is not None:
+        messages.append({"role": "assistant", "content": partial})
+        messages.append({"role": "user", "content": VLM_CONTINUE_PROMPT})
+    return {
+        "model": VLM_MODEL,
+        "messages": messages,
+        "system_prompt": VLM_SYSTEM_PROMPT,
+        "streaming": False,
+        "temperature": 1,
+        "max_tokens": max_tokens,
+        "top_p": 1,
+        "top_k": 40,
+        "presence_penalty": 0,
+        "frequency_penalty": 0,
+    }
+
+
+async def call_vlm_api(image_base64: str, ink_area: Optional[float] = None) -> str:
+    """
+    Call VLM API to extract text from image (see read_page_image)
+    Returns: Extracted text in markdown format
+    """
+    content, _ = await read_page_image(image_base64, ink_area)
+    return content
+
+
+async def read_page_image(
+    image_base64: str, ink_area: Optional[float] = None
+) -> Tuple[str, bool]:
+    """
+    Call VLM API to extract text from image. max_tokens is estimated from
+    the page's ink area when known; an answer cut off by its budget is
+    completed with continuation requests instead of re-reading the page
+    from scratch. Each continuation still carries the image: the model has
+    to look at the rest of the page to carry on.
+    Returns: (extracted text in markdown format, False when the answer is
+    still truncated after VLM_MAX_CONTINUATIONS)
+    """
+    max_tokens = vlm_budget.min_tokens if ink_area is None else vlm_budget.estimate(ink_area)
+    vlm_budget.counters["pages"] += 1
+
+    try:
+        result = await upstream_client.chat_completion(vlm_payload(image_base64, max_tokens))
+        choice = result["choices"][0]
+        content = choice["message"]["content"] or ""
+        truncated = is_truncated(content, choice.get("finish_reason"))
+        if not truncated and ink_area is not None:
+            # Only a first answer that fit its budget measures the page;
+            # continuation tokens would count the seam and prompt overhead
+            vlm_budget.observe(
+                ink_area, (result.get("usage") or {}).get("completion_tokens")
+            )
+        if truncated:
+            vlm_budget.counters["truncated"] += 1
+
+        continuations = 0
+        while truncated and continuations < settings.VLM_MAX_CONTINUATIONS:
+            continuations += 1
+            vlm_budget.counters["continuations"] += 1
+            print(f"✂️ VLM output truncated at {max_tokens} tokens, continuing ({continuations})")
+            result = await upstream_client.chat_completion(
+                vlm_payload(image_base64, settings.VLM_CONTINUATION_TOKENS, partial=content)
+            )
+            choice = result["choices"][0]
+            content = append_continuation(content, choice["message"]["content"] or "")
+            truncated = is_truncated(content, choice.get("finish_reason"))
+
+        if truncated:
+            vlm_budget.counters["incomplete"] += 1
+            print(f"⚠️ VLM output still truncated after {continuations} continuations")
+        print(content)
+        return content, not truncated
+    except Exception as e:
+        print(f"Error calling VLM API: {str(e)}")
+        return f"Error: {str(e)}", False
+
+
+async def call_llm_api(markdown_text: str) -> dict:
+    """
+    Call LLM API to convert markdown to structured JSON
+    Returns: Parsed JSON object or None if error
+    """
+    query = LLM_PROMPT.replace("{markdown_text}", markdown_text)
     payload = {
         "model": LLM_MODEL,
         "messages": [{"role": "user", "content": query}],
@@ -183,10 +477,7 @@ def call_llm_api(markdown_text: str) -> dict:
         print("🤖 Calling LLM API to parse markdown to JSON...")
         print("=" * 50)
 
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-
-        result = response.json()
+        result = await upstream_client.chat_completion(payload)
         content = result["choices"][0]["message"]["content"]
 
         # Try to parse JSON from response
@@ -219,59 +510,486 @@ def call_llm_api(markdown_text: str) -> dict:
         return None
 
 
-@app.post("/api/convert")
-async def convert_pdf(file: UploadFile = File(...)):
+async def extract_page_markdown(page: RenderedPage) -> str:
     """
-    Upload PDF and convert to text using VLM
+    VLM stage for one rendered page, served from the result cache when possible.
+    Pages converted from the PDF text layer skip the VLM entirely; tiled
+    pages are read one strip per request.
+    Returns: Extracted text in markdown format
     """
-    if not file.filename.endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    if page.text is not None:
+        return page.text
+    if page.tiles:
+        # Oversized page: all strips at once, then stitched in reading order
+        contents = await asyncio.gather(*(extract_page_markdown(tile) for tile in page.tiles))
+        if any(tile.meta.get("truncated") for tile in page.tiles):
+            page.meta["truncated"] = True
+        failed = next((content for content in contents if content.startswith("Error:")), None)
+        return failed if failed is not None else stitch_markdown(contents)
+
+    key = make_key(page.image, VLM_MODEL, VLM_PROMPT, VLM_SYSTEM_PROMPT)
+    if result_cache is not None:
+        cached = await result_cache.aget("vlm", key)
+        if cached is not None:
+            return cached
+
+    async def fetch(emit):
+        content, complete = await read_page_image(page.data_uri, page.ink_area)
+        # A truncated answer depends on the token budget, which the key
+        # ignores: it is returned, but a later read may do better
+        if result_cache is not None and complete:
+            await result_cache.aset("vlm", key, content)
+        return content, complete
+
+    content, complete = await page_flights.do(f"vlm:{key}", fetch)
+    if not complete and not content.startswith("Error:"):
+        page.meta["truncated"] = True
+    return content
+
+
+async def parse_markdown(markdown_text: str) -> ParsedPage:
+    """
+    Structuring stage for one page of markdown. Standard e-invoices are
+    handled by the rule-based extractor; the LLM (served from the result
+    cache when possible) is only called when the rules are not confident.
+    Returns: Parsed JSON object (None if error) and how it was extracted
+    """
+    if not markdown_text.strip():
+        # Blank page: nothing to extract
+        return ParsedPage(None, {"extraction": {"method": "skipped"}})
+
+    reasons = []
+    if RULE_POLICY is not None:
+        extraction, reasons = RULE_POLICY.evaluate(markdown_text)
+        if not reasons:
+            return ParsedPage(
+                extraction.data,
+                {"extraction": {"method": "rules", "confidence": extraction.confidence}},
+            )
+
+    meta = {"extraction": {"method": "llm", "reasons": reasons}}
+    key = make_key(normalize_markdown(markdown_text), LLM_MODEL, LLM_PROMPT)
+    if result_cache is not None:
+        cached = await result_cache.aget("llm", key)
+        if cached is not None:
+            return ParsedPage(cached, meta)
+
+    async def fetch(emit):
+        parsed_json = await call_llm_api(markdown_text)
+        if result_cache is not None and parsed_json is not None:
+            await result_cache.aset("llm", key, parsed_json)
+        return parsed_json
+
+    return ParsedPage(await page_flights.do(f"llm:{key}", fetch), meta)
+
 
-    # Save uploaded file temporarily
-    temp_pdf_path = UPLOAD_DIR / file.filename
+def document_cache_key(pdf_sha256: str) -> str:
+    return make_key(
+        pdf_sha256,
+        RENDER_OPTIONS.label,
+        VLM_MODEL,
+        VLM_PROMPT,
+        LLM_MODEL,
+        LLM_PROMPT,
+        RULE_POLICY.label if RULE_POLICY is not None else "llm-only",
+        "invoices" if settings.INVOICE_GROUPING else "pages",
+    )
 
+
+def is_complete(results: list) -> bool:
+    """
+    True when every page went through both stages without an error or an
+    answer left truncated
+    """
+    return all(
+        "error" not in r
+        and not r.get("truncated")
+        and (r["parsed_json"] is not None or r.get("source") == "blank")
+        and not r["content"].startswith("Error:")
+        for r in results
+    )
+
+
+async def process_document(
+    upload: UploadSpool, on_page=None, slots: Optional[asyncio.Semaphore] = None
+) -> dict:
+    """
+    Run the whole pipeline for one uploaded PDF: document cache, lazy
+    rendering, concurrent VLM per page, then rules/LLM per invoice
+    (or per page when invoice grouping is off). Documents given the same
+    `slots` share their pages in flight (batch uploads).
+    Returns: Response dict with total_pages and per-page results
+    """
+    # A known document is answered straight from the cache
+    doc_key = document_cache_key(upload.sha256)
+    if result_cache is not None:
+        cached = await result_cache.aget("document", doc_key)
+        if cached is not None:
+            print(f"Cache hit for PDF: {upload.filename}")
+            return cached
+
+    def start(emit):
+        # The shared run may outlive the request that started it
+        upload.retain()
+        task = asyncio.ensure_future(run_document(upload, doc_key, emit, slots))
+        task.add_done_callback(lambda _: upload.close())
+        return task
+
+    # Concurrent uploads of the same PDF attach to the run already in flight
+    return await document_flights.do(doc_key, start, on_page)
+
+
+async def process_until_disconnect(request: Request, upload: UploadSpool, on_page=None) -> dict:
+    """
+    process_document for a request, cancelled when its client disconnects:
+    queued and in-flight pages and their upstream calls are dropped (unless
+    another request is waiting for the same document)
+    Raises: ClientDisconnect
+    """
     try:
-        # Save uploaded file
-        with open(temp_pdf_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        # Convert PDF to images
-        print(f"Converting PDF: {file.filename}")
-        images_base64 = pdf_to_images(str(temp_pdf_path))
-        print(f"Total pages: {len(images_base64)}")
-
-        # Process each page with VLM API
-        results = []
-        for idx, img_base64 in enumerate(images_base64):
-            print(f"Processing page {idx + 1}/{len(images_base64)}")
-            extracted_text = call_vlm_api(img_base64)
-
-            # Parse markdown to JSON using LLM
-            parsed_json = call_llm_api(extracted_text)
-
-            results.append(
-                {"page": idx + 1, "content": extracted_text, "parsed_json": parsed_json}
-            )
+        return await cancel_on_disconnect(request, process_document(upload, on_page))
+    except (ClientDisconnect, asyncio.CancelledError):
+        # A streaming response is cancelled by the server when its client leaves
+        cancellation_counters["disconnects"] += 1
+        print(f"🔌 Client disconnected, stopped processing {upload.filename}")
+        raise
 
-        # Clean up temporary file
-        os.remove(temp_pdf_path)
 
-        return JSONResponse(
-            content={
-                "success": True,
-                "total_pages": len(images_base64),
-                "results": results,
-            }
+async def run_document(
+    upload: UploadSpool, doc_key: str, on_page=None, slots: Optional[asyncio.Semaphore] = None
+) -> dict:
+    """
+    Render and process every page of one document (no cache lookup)
+    Returns: Response dict with total_pages and per-page results
+    """
+    # Render pages lazily: inference starts as soon as page 1 is ready
+    print(f"Converting PDF: {upload.filename} ({upload.size} bytes)")
+    # Rendering waits while the page images of all documents (including
+    # pages rendered ahead) fill the memory budget; a page is released once
+    # its VLM stage is done
+    memory = PageMemory(memory_budget)
+    pages = aiter_document_pages(upload.source, memory)
+    vlm_stage = extract_page_markdown
+    if RENDER_OPTIONS.page_check is not None and RENDER_OPTIONS.page_check.duplicates:
+        # Repeated pages reuse the markdown of the page they repeat
+        duplicates = DuplicateTracker(RENDER_OPTIONS.page_check)
+        pages = duplicates.watch(pages)
+        vlm_stage = duplicates.stage(extract_page_markdown)
+    pages = memory.watch(pages)
+    vlm_stage = memory.stage(vlm_stage)
+
+    if not settings.INVOICE_GROUPING:
+        # Process pages concurrently: VLM to markdown, then LLM to JSON
+        executor = PageExecutor(
+            vlm_stage=vlm_stage,
+            llm_stage=parse_markdown,
+            max_inflight_pages=settings.MAX_INFLIGHT_PAGES,
+            slots=slots,
+        )
+        try:
+            results = await executor.run(pages, on_result=on_page)
+        finally:
+            memory.close()
+            cancellation_counters["pages"] += executor.cancelled_pages
+        print(f"Total pages: {len(results)}")
+        response = {"success": True, "total_pages": len(results), "results": results}
+    else:
+        # VLM per page; pages of the same invoice are merged and structured
+        # with a single rules/LLM pass once the invoice is complete
+        grouper = InvoiceGrouper(structure=parse_markdown, on_result=on_page)
+        executor = PageExecutor(
+            vlm_stage=vlm_stage,
+            llm_stage=None,
+            max_inflight_pages=settings.MAX_INFLIGHT_PAGES,
+            slots=slots,
         )
+        try:
+            results = await executor.run(pages, on_result=grouper.add)
+            invoices = await grouper.finish()
+        finally:
+            grouper.cancel()
+            memory.close()
+            cancellation_counters["pages"] += executor.cancelled_pages
+        print(f"Total pages: {len(results)}, invoices: {len(invoices)}")
+        response = {
+            "success": True,
+            "total_pages": len(results),
+            "total_invoices": len(invoices),
+            "invoices": invoices,
+            "results": results,
+        }
 
-    except Exception as e:
-        # Clean up on error
-        if temp_pdf_path.exists():
-            os.remove(temp_pdf_path)
+    if result_cache is not None and is_complete(results):
+        await result_cache.aset("document", doc_key, response)
+    return response
+
+
+async def receive_upload(request: Request) -> UploadSpool:
+    # Stream the upload: small files stay in memory, large ones spill to a
+    # unique temp file; header and size are checked while receiving
+    return await receive_pdf_upload(
+        request,
+        max_bytes=settings.UPLOAD_MAX_BYTES,
+        memory_limit=settings.UPLOAD_MEMORY_LIMIT,
+        spool_dir=str(UPLOAD_DIR),
+    )
+
+
+def admit_request():
+    """
+    Take a document slot before reading the body, so an overloaded server
+    turns uploads away cheaply
+    Returns: the function releasing the slot
+    Raises: HTTPException 503 with Retry-After when too many documents are pending
+    """
+    try:
+        return admission.admit()
+    except Overloaded as e:
+        print(f"🚦 Rejected upload: {admission.documents} documents pending")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def receive_admitted_upload(request: Request) -> UploadSpool:
+    """
+    receive_upload within a document slot, freed with the upload (after any
+    shared run of the document has finished)
+    Raises: HTTPException 503 with Retry-After when too many documents are pending
+    """
+    release = admit_request()
+    try:
+        upload = await receive_upload(request)
+    except BaseException:
+        release()
+        raise
+    upload.on_close(release)
+    return upload
+
+
+# Background OCR jobs: the upload is accepted immediately and processed by a
+# bounded worker pool; state lives in a pluggable store
+async def process_job(upload: UploadSpool, on_page) -> dict:
+    """
+    process_document for a background job, within a document slot taken
+    once a worker picks the job up (queued jobs do not hold one)
+    """
+    release = await admission.acquire()
+    try:
+        return await process_document(upload, on_page)
+    finally:
+        release()
+
+
+job_manager = JobManager(
+    store=create_job_store(settings.JOB_STORE_URL),
+    process=process_job,
+    workers=settings.JOB_WORKERS,
+    max_queued=settings.JOB_QUEUE_SIZE,
+)
+
+
+@app.post("/api/convert", openapi_extra=PDF_UPLOAD_OPENAPI)
+async def convert_pdf(request: Request):
+    """
+    Upload PDF and convert to text using VLM
+    """
+    upload = await receive_admitted_upload(request)
+
+    try:
+        response = await process_until_disconnect(request, upload)
+        return JSONResponse(content=response)
+
+    except ClientDisconnect:
+        # Nobody is left to read the response
+        return Response(status_code=499)
 
+    except RenderError as e:
+        # Malformed PDF, or one that hit the rendering sandbox limits
+        raise HTTPException(status_code=422, detail=f"Could not render PDF: {str(e)}")
+
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
+    finally:
+        # Clean up the in-memory buffer or temporary file
+        upload.close()
+
+
+@app.post("/api/convert/stream", openapi_extra=PDF_UPLOAD_OPENAPI)
+async def convert_pdf_stream(request: Request, format: Literal["ndjson", "sse"] = "ndjson"):
+    """
+    Upload PDF and stream each page result as soon as it is ready
+    (NDJSON lines or Server-Sent Events), followed by a summary event
+    """
+    upload = await receive_admitted_upload(request)
+
+    async def events():
+        try:
+            async for event in stream_pipeline(
+                lambda on_page: process_until_disconnect(request, upload, on_page), format
+            ):
+                yield event
+        finally:
+            upload.close()
+
+    return StreamingResponse(
+        events(),
+        media_type=STREAM_MEDIA_TYPES[format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def convert_images_to_pdf(source, filetype: str) -> bytes:
+    """
+    PDF of an uploaded image file, decoded in the sandboxed raster pool when enabled
+    """
+    if raster_pool is not None:
+        return await raster_pool.convert_images(source, filetype)
+    return await asyncio.to_thread(images_to_pdf, source, filetype)
+
+
+@app.post("/api/convert/batch", openapi_extra=BATCH_UPLOAD_OPENAPI)
+async def convert_batch(request: Request):
+    """
+    Upload many files at once (`files`: PDF, multi-page TIFF, JPEG/PNG, or
+    ZIP archives of them) and convert them all. Pages of every file are
+    scheduled onto one shared pool; each file gets its own result or error.
+    """
+    # A batch counts as one pending document; its pages are bounded by
+    # BATCH_MAX_INFLIGHT_PAGES and the memory budget
+    release = admit_request()
+    files = []
+    try:
+        uploads = await receive_batch_upload(
+            request,
+            max_bytes=settings.BATCH_MAX_BYTES,
+            max_file_bytes=settings.UPLOAD_MAX_BYTES,
+            max_files=settings.BATCH_MAX_FILES,
+            memory_limit=settings.UPLOAD_MEMORY_LIMIT,
+            spool_dir=str(UPLOAD_DIR),
+        )
+        files = await prepare_batch(
+            uploads,
+            convert_images=convert_images_to_pdf,
+            memory_limit=settings.UPLOAD_MEMORY_LIMIT,
+            spool_dir=str(UPLOAD_DIR),
+            max_files=settings.BATCH_MAX_FILES,
+            max_file_bytes=settings.UPLOAD_MAX_BYTES,
+            max_total_bytes=settings.BATCH_MAX_BYTES,
+        )
+        print(f"📦 Batch of {len(files)} files")
+        response = await cancel_on_disconnect(
+            request,
+            run_batch(
+                files,
+                process=lambda upload, slots: process_document(upload, slots=slots),
+                max_inflight_pages=settings.BATCH_MAX_INFLIGHT_PAGES,
+            ),
+        )
+        return JSONResponse(content=response)
+
+    except ClientDisconnect:
+        cancellation_counters["disconnects"] += 1
+        print("🔌 Client disconnected, stopped processing the batch")
+        return Response(status_code=499)
+
+    finally:
+        for batch_file in files:
+            batch_file.close()
+        release()
+
+
+@app.post("/api/jobs", status_code=202, openapi_extra=PDF_UPLOAD_OPENAPI)
+async def create_job(request: Request):
+    """
+    Upload PDF and queue it for background OCR
+    Returns: Job id to poll with GET /api/jobs/{job_id}
+    """
+    # The document slot only covers receiving the upload; the job takes
+    # one again when a worker picks it up. Queued uploads wait on disk, so
+    # the job queue does not add to memory.
+    release = admit_request()
+    try:
+        upload = await receive_pdf_upload(
+            request,
+            max_bytes=settings.UPLOAD_MAX_BYTES,
+            memory_limit=0,
+            spool_dir=str(UPLOAD_DIR),
+        )
+    finally:
+        release()
+    try:
+        job = await job_manager.submit(upload)
+    except JobQueueFull:
+        upload.close()
+        raise HTTPException(
+            status_code=503,
+            detail="Too many queued jobs, try again later",
+            headers={"Retry-After": "30"},
+        )
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Job status, progress and the per-page results completed so far
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running job
+    """
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters and size of the result cache
+    """
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **(await asyncio.to_thread(result_cache.stats))}
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """
+    Upstream limiter state per model (quota buckets, adaptive concurrency
+    limit, requests in flight and queue depth), hedging rate and wins,
+    request coalescing counters, work cancelled by client disconnects,
+    VLM token budget / truncation counters and admission state (pending
+    documents, rejected uploads, page image memory in use) and rendering
+    sandbox failures (limits hit, crashed workers, restarts)
+    """
+    hedger = upstream_client.hedger
+    return {
+        "upstream": upstream_client.limiter.metrics(),
+        "hedging": hedger.metrics() if hedger is not None else None,
+        "coalescing": {"documents": document_flights.stats(), "pages": page_flights.stats()},
+        "cancellations": {
+            **cancellation_counters,
+            "documents": document_flights.counters["cancelled"],
+            "upstream_calls": upstream_client.cancelled,
+        },
+        "vlm_budget": vlm_budget.snapshot(),
+        "admission": admission.snapshot(),
+        "rendering": raster_pool.metrics() if raster_pool is not None else None,
+    }
+
 
 @app.get("/")
 async def root():
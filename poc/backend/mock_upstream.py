@@ -0,0 +1,157 @@
+"""
+Local stand-in for the chat completions API, for running the POC offline.
+
+    python mock_upstream.py
+    API_URL=http://localhost:8001/v1/chat/completions python main.py
+
+MOCK_LATENCY (seconds) and MOCK_FAILURE_RATE (0..1, answered with HTTP 503)
+make it easy to exercise concurrency and the client retry path; a share
+MOCK_SLOW_RATE of calls takes MOCK_SLOW_LATENCY seconds instead. Answers are
+cut at max_tokens * MOCK_CHARS_PER_TOKEN characters (finish_reason "length");
+a request ending with the assistant's partial answer gets the rest.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import asyncio
+import random
+import json
+import time
+import os
+
+MOCK_LATENCY = float(os.getenv("MOCK_LATENCY", "0.5"))
+MOCK_FAILURE_RATE = float(os.getenv("MOCK_FAILURE_RATE", "0"))
+MOCK_PORT = int(os.getenv("MOCK_PORT", "8001"))
+MOCK_CHARS_PER_TOKEN = float(os.getenv("MOCK_CHARS_PER_TOKEN", "4"))
+MOCK_SLOW_RATE = float(os.getenv("MOCK_SLOW_RATE", "0"))
+MOCK_SLOW_LATENCY = float(os.getenv("MOCK_SLOW_LATENCY", "5"))
+
+app = FastAPI(title="OCR POC mock upstream")
+
+MOCK_MARKDOWN = """### HÓA ĐƠN GIÁ TRỊ GIA TĂNG
+Ký hiệu: 1C24TAA
+Số: 0000123
+Ngày: 05/03/2024
+### Đơn vị bán hàng: CÔNG TY TNHH MẪU
+Mã số thuế: 0101234567
+Địa chỉ: 1 Đường Mẫu, Hà Nội
+### Người mua hàng
+Tên đơn vị: CÔNG TY CỔ PHẦN KHÁCH HÀNG
+Mã số thuế: 0309876543
+Hình thức thanh toán: TM/CK
+
+| STT | Tên hàng hóa, dịch vụ | Đơn vị tính | Số lượng | Đơn giá | Thành tiền |
+|---|---|---|---|---|---|
+| 1 | Dịch vụ mẫu | Gói | 1 | 100.000 | 100.000 |
+
+Cộng tiền hàng: 100.000
+Thuế suất GTGT: 10%
+Tiền thuế GTGT: 10.000
+Tổng cộng tiền thanh toán: 110.000
+Số tiền viết bằng chữ: Một trăm mười nghìn đồng
+"""
+
+MOCK_JSON = {
+    "seller": {
+        "name": "CÔNG TY TNHH MẪU",
+        "address": "1 Đường Mẫu, Hà Nội",
+        "phone": "",
+        "fax": "",
+        "tax_code": "0101234567",
+    },
+    "invoice": {
+        "title": "HÓA ĐƠN GIÁ TRỊ GIA TĂNG",
+        "serial": "1C24TAA",
+        "number": "0000123",
+        "date": "05/03/2024",
+        "cqt_code": "",
+    },
+    "buyer": {
+        "name": "",
+        "unit_name": "CÔNG TY CỔ PHẦN KHÁCH HÀNG",
+        "cccd": "",
+        "passport": "",
+        "tax_code": "0309876543",
+        "address": "",
+        "payment_method": "TM/CK",
+    },
+    "items": [
+        {
+            "stt": "1",
+            "name": "Dịch vụ mẫu",
+            "unit": "Gói",
+            "quantity": "1",
+            "unit_price": "100000",
+            "amount": "100000",
+        }
+    ],
+    "totals": {
+        "subtotal": "100000",
+        "vat_rate": "10%",
+        "vat_amount": "10000",
+        "total": "110000",
+        "total_in_words": "Một trăm mười nghìn đồng",
+    },
+}
+
+
+def _has_image(messages: list) -> bool:
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(
+            part.get("type") == "image_url" for part in content
+        ):
+            return True
+    return False
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    slow = random.random() < MOCK_SLOW_RATE
+    await asyncio.sleep(MOCK_SLOW_LATENCY if slow else MOCK_LATENCY)
+
+    if random.random() < MOCK_FAILURE_RATE:
+        return JSONResponse(
+            status_code=503, content={"error": {"message": "mock overload"}}
+        )
+
+    messages = payload.get("messages", [])
+    if _has_image(messages):
+        content = MOCK_MARKDOWN
+    else:
+        content = json.dumps(MOCK_JSON, ensure_ascii=False)
+    partial = next(
+        (m["content"] for m in reversed(messages) if m.get("role") == "assistant"), None
+    )
+    if partial is not None and content.startswith(partial):
+        content = content[len(partial) :]
+
+    finish_reason = "stop"
+    limit = int((payload.get("max_tokens") or 0) * MOCK_CHARS_PER_TOKEN)
+    if limit and len(content) > limit:
+        content, finish_reason = content[:limit], "length"
+
+    return {
+        "id": f"mock-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", ""),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 0,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": len(content) // 4,
+        },
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=MOCK_PORT)
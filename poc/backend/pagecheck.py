@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+# Width of the grey image used for ink coverage
+THUMBNAIL_WIDTH = 200
+# Border ignored for ink coverage (scanner edges, punch holes)
+BORDER_RATIO = 0.03
+
+
+@dataclass(frozen=True)
+class PageCheckPolicy:
+    """
+    Cheap checks run on the rendered pixmap before inference.
+
+    A page is blank when less than `blank_max_ink` of its area (inside a
+    small border) is ink, i.e. clearly darker than the page background.
+    With `duplicates`, a page repeating an earlier page of the same
+    document reuses its result. Only byte-identical renders are detected
+    (the same page inserted twice), not rescans or near-identical pages:
+    downsampled comparisons cannot tell apart two invoices sharing one
+    template.
+    """
+
+    blank_max_ink: float = 0.002
+    duplicates: bool = False
+
+    @property
+    def label(self) -> str:
+        return f"check{self.blank_max_ink}-{'dup' if self.duplicates else 'nodup'}"
+
+
+def pixmap_gray(pix: fitz.Pixmap, target_width: int) -> np.ndarray:
+    """
+    Downsampled grey image of a pixmap. The samples are viewed in place;
+    only the strided subset is converted.
+    """
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    rows = samples[: pix.stride * pix.height].reshape(pix.height, pix.stride)
+    pixels = rows[:, : pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+    step = max(1, pix.width // target_width)
+    view = pixels[::step, ::step]
+    if pix.n - pix.alpha >= 3:
+        weights = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        return view[..., :3] @ weights
+    return view[..., 0].astype(np.float32)
+
+
+def image_gray(image, target_width: int) -> np.ndarray:
+    """
+    Downsampled grey image of a PIL image (box-averaged)
+    """
+    step = max(1, image.width // target_width)
+    small = image.reduce(step) if step > 1 else image
+    return np.asarray(small.convert("L"), dtype=np.float32)
+
+
+def ink_coverage(gray: np.ndarray) -> float:
+    """
+    Share of pixels clearly darker than the page background; the
+    background level is measured, so grey scans are handled too
+    """
+    height, width = gray.shape
+    dy, dx = int(height * BORDER_RATIO), int(width * BORDER_RATIO)
+    inner = gray[dy : height - dy or None, dx : width - dx or None]
+    if inner.size == 0:
+        return 0.0
+    background = np.percentile(inner, 90)
+    return float(np.count_nonzero(inner < background - 64) / inner.size)
+
+
+def pixel_digest(pix: fitz.Pixmap) -> str:
+    """
+    Digest of the full-resolution pixels of a pixmap
+    """
+    digest = hashlib.blake2b(f"{pix.width}x{pix.height}x{pix.n}".encode(), digest_size=16)
+    digest.update(pix.samples_mv)
+    return digest.hexdigest()
+
+
+def check_pixmap(pix: fitz.Pixmap, policy: PageCheckPolicy) -> Tuple[dict, Optional[str]]:
+    """
+    Returns: (per-page report with "decision" blank/process, pixel digest
+    when duplicates are detected)
+    """
+    gray = pixmap_gray(pix, THUMBNAIL_WIDTH)
+    coverage = ink_coverage(gray)
+    report = {"decision": "blank" if coverage < policy.blank_max_ink else "process"}
+    report["ink_coverage"] = round(coverage, 5)
+    if report["decision"] == "blank":
+        return report, None
+    return report, pixel_digest(pix) if policy.duplicates else None
+
+
+class DuplicateTracker:
+    """
+    Repeated pages within one document.
+
+    `watch` marks each page of the (in-order) page stream as a duplicate of
+    an earlier page with identical pixels; `stage` wraps the VLM stage so a
+    duplicate waits for its original's markdown instead of calling the VLM.
+    """
+
+    def __init__(self, policy: PageCheckPolicy):
+        self.policy = policy
+        self._seen: Dict[str, int] = {}  # pixel digest -> page index
+        self._results: Dict[int, asyncio.Future] = {}
+
+    def classify(self, page):
+        check = page.meta.get("page_check")
+        if not check or check["decision"] != "process" or page.pixel_digest is None:
+            return
+        index = self._seen.get(page.pixel_digest)
+        if index is not None:
+            check.update(decision="duplicate", duplicate_of=index + 1)
+            return
+        self._seen[page.pixel_digest] = page.index
+
+    async def watch(self, pages) -> AsyncIterator:
+        try:
+            async for page in pages:
+                self.classify(page)
+                yield page
+        finally:
+            if hasattr(pages, "aclose"):
+                await pages.aclose()
+
+    def _future(self, index: int) -> asyncio.Future:
+        if index not in self._results:
+            future = asyncio.get_running_loop().create_future()
+            # Nobody may wait for it; do not warn about unretrieved errors
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._results[index] = future
+        return self._results[index]
+
+    def stage(self, vlm_stage: Callable) -> Callable:
+        async def run(page):
+            check = page.meta.get("page_check") or {}
+            if check.get("decision") == "duplicate":
+                return await asyncio.shield(self._future(check["duplicate_of"] - 1))
+
+            future = self._future(page.index)
+            try:
+                content = await vlm_stage(page)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            future.set_result(content)
+            return content
+
+        return run
@@ -0,0 +1,124 @@
+import asyncio
+import inspect
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, List, Optional, Union
+
+
+async def _as_async_iter(items: Iterable):
+    for item in items:
+        yield item
+
+
+@dataclass
+class ParsedPage:
+    """
+    What an LLM stage may return instead of the bare JSON: the JSON plus
+    details to add to the page result (e.g. how it was extracted)
+    """
+
+    parsed_json: Optional[dict]
+    meta: dict = field(default_factory=dict)
+
+
+class PageExecutor:
+    """
+    Run the VLM -> LLM stages for every page of a document concurrently.
+
+    At most `max_inflight_pages` pages are being processed at any time, so the
+    VLM stage of later pages overlaps with the LLM stage of earlier ones.
+    Pages are pulled from the source only when a slot is free, which keeps a
+    streaming renderer from running ahead of inference. Results are returned
+    in page order and a failing page only affects its own entry. When the
+    run is cancelled, pages still in flight are cancelled with it and
+    counted in `cancelled_pages`. Executors given the same `slots` share
+    one in-flight limit, so pages of several documents are scheduled
+    together. A shared slot is only taken once the page has been rendered:
+    rendering may wait for memory held by pages of other documents, which
+    in turn wait for a slot, so a slot must never wait for rendering.
+    """
+
+    def __init__(
+        self,
+        vlm_stage: Callable[[Any], Awaitable[str]],
+        llm_stage: Optional[Callable[[str], Awaitable[Union[Optional[dict], ParsedPage]]]],
+        max_inflight_pages: int = 4,
+        slots: Optional[asyncio.Semaphore] = None,
+    ):
+        self.vlm_stage = vlm_stage
+        self.llm_stage = llm_stage
+        self.max_inflight_pages = max(1, max_inflight_pages)
+        self.slots = slots
+        self.cancelled_pages = 0
+
+    async def process_page(self, idx: int, page: Any) -> dict:
+        print(f"Processing page {idx + 1}")
+        # Per-page details from the renderer (encoding, sizes, ...)
+        result = {"page": idx + 1, **(getattr(page, "meta", None) or {})}
+        try:
+            content = await self.vlm_stage(page)
+            # The VLM stage may add details too (e.g. an answer left truncated)
+            result.update(getattr(page, "meta", None) or {})
+            # Without an LLM stage, pages are structured later (e.g. per invoice)
+            parsed = await self.llm_stage(content) if self.llm_stage is not None else None
+        except Exception as e:
+            print(f"❌ Page {idx + 1} failed: {str(e)}")
+            result.update({"content": "", "parsed_json": None, "error": str(e)})
+            return result
+        if isinstance(parsed, ParsedPage):
+            result.update({"content": content, "parsed_json": parsed.parsed_json, **parsed.meta})
+        else:
+            result.update({"content": content, "parsed_json": parsed})
+        return result
+
+    async def run(
+        self,
+        pages: Union[AsyncIterable, Iterable],
+        on_result: Optional[Callable[[dict], Any]] = None,
+    ) -> List[dict]:
+        """
+        Process all pages and return one result dict per page, in page order.
+        `on_result` (sync or async) is called with each page result as soon as
+        that page completes, in completion order.
+        """
+        if not hasattr(pages, "__aiter__"):
+            pages = _as_async_iter(pages)
+        source = pages.__aiter__()
+        semaphore = self.slots or asyncio.Semaphore(self.max_inflight_pages)
+        tasks = []
+
+        async def process(idx: int, page: Any) -> dict:
+            try:
+                result = await self.process_page(idx, page)
+                if on_result is not None:
+                    callback = on_result(result)
+                    if inspect.isawaitable(callback):
+                        await callback
+                return result
+            finally:
+                semaphore.release()
+
+        try:
+            while True:
+                if self.slots is None:
+                    await semaphore.acquire()
+                try:
+                    page = await source.__anext__()
+                except StopAsyncIteration:
+                    if self.slots is None:
+                        semaphore.release()
+                    break
+                if self.slots is not None:
+                    await semaphore.acquire()
+                # Rendered pages know their own index (some may have been skipped)
+                idx = getattr(page, "index", len(tasks))
+                tasks.append(asyncio.create_task(process(idx, page)))
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                # gather() may already have cancelled them
+                if task.cancelled() or task.cancel():
+                    self.cancelled_pages += 1
+            raise
+        finally:
+            if hasattr(source, "aclose"):
+                await source.aclose()
@@ -0,0 +1,192 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image, ImageFilter
+
+from encoding import pixmap_to_image
+from pagecheck import image_gray, pixmap_gray
+
+# Width of the grey image skew and margins are measured on
+ANALYSIS_WIDTH = 1000
+# Ink: pixels this much darker than the page background (0-255)
+INK_CONTRAST = 64
+# Skews below this are left alone (degrees)
+MIN_SKEW_DEGREES = 0.2
+# Crops saving less than this share of the page are skipped
+MIN_CROP_SAVING = 0.05
+
+
+@dataclass(frozen=True)
+class PreprocessOptions:
+    """
+    Optional clean-up of the rendered page before it is encoded.
+
+    deskew: estimate the text skew (up to `max_skew_degrees`) and rotate it away
+    crop_margins: crop blank margins, keeping `margin_px` pixels around the content
+    denoise: 3x3 median filter (removes scanner speckle)
+    binarize: black and white with an Otsu threshold
+    report_savings: also encode the unprocessed page to report bytes saved
+        (encodes every page twice, meant for measuring)
+    """
+
+    deskew: bool = True
+    crop_margins: bool = True
+    denoise: bool = False
+    binarize: bool = False
+    max_skew_degrees: float = 5.0
+    margin_px: int = 24
+    report_savings: bool = False
+
+    @property
+    def label(self) -> str:
+        parts = ["pre"]
+        if self.deskew:
+            parts.append(f"deskew{self.max_skew_degrees}")
+        if self.crop_margins:
+            parts.append(f"crop{self.margin_px}")
+        if self.denoise:
+            parts.append("denoise")
+        if self.binarize:
+            parts.append("bin")
+        return "-".join(parts)
+
+
+def ink_mask(gray: np.ndarray) -> np.ndarray:
+    return gray < np.percentile(gray, 90) - INK_CONTRAST
+
+
+def _projection_scores(ys: np.ndarray, xs: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    """
+    Sharpness of the horizontal projection profile of the ink points for
+    every candidate angle (radians), all angles at once
+    """
+    rows = ys[None, :] * np.cos(angles)[:, None] - xs[None, :] * np.sin(angles)[:, None]
+    rows = np.rint(rows).astype(np.int64)
+    rows -= rows.min()
+    bins = int(rows.max()) + 1
+    offsets = np.arange(len(angles))[:, None] * bins
+    histogram = np.bincount((rows + offsets).ravel(), minlength=len(angles) * bins)
+    histogram = histogram.reshape(len(angles), bins).astype(np.float64)
+    return (histogram**2).sum(axis=1)
+
+
+def estimate_skew(gray: np.ndarray, max_degrees: float, max_points: int = 60000) -> float:
+    """
+    Text skew in degrees (positive: lines run down to the right), found by
+    maximizing the projection profile sharpness; coarse then fine search
+    """
+    ys, xs = np.nonzero(ink_mask(gray))
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > max_points:
+        step = len(ys) // max_points + 1
+        ys, xs = ys[::step], xs[::step]
+    ys = ys.astype(np.float32)
+    xs = xs.astype(np.float32)
+
+    coarse = np.arange(-max_degrees, max_degrees + 1e-9, 0.5)
+    best = coarse[np.argmax(_projection_scores(ys, xs, np.deg2rad(coarse)))]
+    fine = np.arange(best - 0.5, best + 0.5 + 1e-9, 0.05)
+    return float(fine[np.argmax(_projection_scores(ys, xs, np.deg2rad(fine)))])
+
+
+def content_box(
+    gray: np.ndarray, step: int, margin: int, size: Tuple[int, int]
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Bounding box of the ink in full-resolution pixels, padded by `margin`
+    Returns: None when there is no content or the crop would not pay off
+    """
+    mask = ink_mask(gray)
+    # Ignore isolated specks: a content row/column has a few ink pixels
+    rows = np.flatnonzero(mask.sum(axis=1) > max(1, mask.shape[1] // 500))
+    cols = np.flatnonzero(mask.sum(axis=0) > max(1, mask.shape[0] // 500))
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+    width, height = size
+    box = (
+        max(0, cols[0] * step - margin),
+        max(0, rows[0] * step - margin),
+        min(width, (cols[-1] + 1) * step + margin),
+        min(height, (rows[-1] + 1) * step + margin),
+    )
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area > (1 - MIN_CROP_SAVING) * width * height:
+        return None
+    return box
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)
+    total = weight[-1]
+    mean = np.cumsum(histogram * levels)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mean[-1] * weight - mean * total) ** 2 / (weight * (total - weight))
+    return int(np.nanargmax(between))
+
+
+def _analysis_gray(image: Image.Image) -> Tuple[np.ndarray, int]:
+    return image_gray(image, ANALYSIS_WIDTH), max(1, image.width // ANALYSIS_WIDTH)
+
+
+def preprocess_pixmap(
+    pix: fitz.Pixmap, options: PreprocessOptions
+) -> Tuple[Image.Image, dict]:
+    """
+    Deskew, crop, denoise and binarize a rendered page. Measurements are
+    taken on strided views of the pixmap samples; only the transforms
+    that are actually needed allocate a new image.
+    Returns: (processed image, per-page report)
+    """
+    started = time.perf_counter()
+    image = pixmap_to_image(pix)
+    original_pixels = image.width * image.height
+    report = {}
+    gray, step = pixmap_gray(pix, ANALYSIS_WIDTH), max(1, pix.width // ANALYSIS_WIDTH)
+
+    skew = 0.0
+    if options.deskew:
+        skew = estimate_skew(gray, options.max_skew_degrees)
+        report["skew_degrees"] = round(skew, 2)
+        if abs(skew) < MIN_SKEW_DEGREES:
+            skew = 0.0
+
+    box = None
+    if options.crop_margins:
+        # Crop first so only the content is rotated; leave room for the
+        # rotation when the page is skewed
+        slack = int(max(image.size) * abs(math.sin(math.radians(skew)))) if skew else 0
+        box = content_box(gray, step, options.margin_px + slack, image.size)
+        if box:
+            image = image.crop(box)
+    if skew:
+        fill = 255 if image.mode == "L" else (255, 255, 255)
+        image = image.rotate(skew, resample=Image.BILINEAR, fillcolor=fill)
+        if options.crop_margins:
+            gray, step = _analysis_gray(image)
+            inner = content_box(gray, step, options.margin_px, image.size)
+            if inner:
+                image = image.crop(inner)
+                box = box or (0, 0, 0, 0)
+                box = (box[0] + inner[0], box[1] + inner[1], box[0] + inner[2], box[1] + inner[3])
+    if options.crop_margins:
+        report["crop"] = [int(v) for v in box] if box else None
+
+    if options.denoise or options.binarize:
+        image = image.convert("L")
+        if options.denoise:
+            image = image.filter(ImageFilter.MedianFilter(3))
+        if options.binarize:
+            threshold = otsu_threshold(_analysis_gray(image)[0])
+            report["threshold"] = threshold
+            image = image.point([0 if level <= threshold else 255 for level in range(256)])
+
+    report["pixel_ratio"] = round(image.width * image.height / original_pixels, 3)
+    report["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return image, report
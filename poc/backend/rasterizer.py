@@ -0,0 +1,548 @@
+import asyncio
+import math
+import multiprocessing
+import queue
+import resource
+import signal
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AbstractSet, AsyncIterator, Callable, Iterator, List, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+
+from rendering import (
+    RenderError,
+    RenderedPage,
+    RenderOptions,
+    check_page_count,
+    images_to_pdf,
+    open_document,
+    render_page,
+)
+
+# Documents a worker keeps open between tasks (least recently used first
+# out), so page ranges of documents sharing a worker do not reopen them
+WORKER_DOCUMENTS = 4
+
+
+class _CachedDocument:
+    def __init__(self, source: Union[str, bytes]):
+        self.source = source
+        self.document: Optional[fitz.Document] = None
+        self.cpu_used = 0.0
+
+    def open(self) -> fitz.Document:
+        if self.document is None:
+            self.document = open_document(self.source)
+        return self.document
+
+    def close(self):
+        if self.document is not None:
+            self.document.close()
+            self.document = None
+
+
+# Per worker process: documents received from the parent, by document id.
+# The source of a document is sent once per worker; later tasks for the
+# same document only carry its id
+_worker_documents: "OrderedDict[str, _CachedDocument]" = OrderedDict()
+# Per worker process: CPU seconds each document may use (0 = no limit)
+_worker_limits = {"cpu_seconds": 0}
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _receive_document(doc_id: str, source: Optional[Union[str, bytes]]) -> _CachedDocument:
+    if source is not None:
+        _forget_document(doc_id)
+        _worker_documents[doc_id] = _CachedDocument(source)
+        while len(_worker_documents) > WORKER_DOCUMENTS:
+            _, evicted = _worker_documents.popitem(last=False)
+            evicted.close()
+    cached = _worker_documents.get(doc_id)
+    if cached is None:
+        raise RuntimeError(f"Document {doc_id} was not sent to this worker")
+    _worker_documents.move_to_end(doc_id)
+    return cached
+
+
+def _forget_document(doc_id: str):
+    cached = _worker_documents.pop(doc_id, None)
+    if cached is not None:
+        cached.close()
+
+
+def count_pages(cached: _CachedDocument) -> int:
+    return cached.open().page_count
+
+
+def render_page_range(
+    cached: _CachedDocument,
+    start: int,
+    stop: int,
+    options: Optional[RenderOptions] = None,
+) -> List[RenderedPage]:
+    """
+    Worker task: render and encode pages [start, stop) of a document.
+    Returns the encoded buffers as produced by the encoder, without re-copying.
+    """
+    document = cached.open()
+    return [
+        render_page(document[page_num], options)
+        for page_num in range(start, stop)
+    ]
+
+
+def convert_images(cached: _CachedDocument, filetype: str) -> bytes:
+    """
+    Worker task: PDF bytes of an image file, decoded inside the sandbox
+    """
+    return images_to_pdf(cached.source, filetype)
+
+
+def _run_task(function: Callable, doc_id: str, source, args):
+    cached = _receive_document(doc_id, source)
+    cpu_seconds = _worker_limits["cpu_seconds"]
+    if cpu_seconds:
+        # The kernel stops the worker (SIGXCPU) once this document has used
+        # its CPU time across all of its tasks; the parent reports it and
+        # starts a new worker
+        used = _cpu_used()
+        soft = math.ceil(used + max(0.0, cpu_seconds - cached.cpu_used))
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    else:
+        used = 0.0
+    try:
+        return function(cached, *args)
+    finally:
+        if cpu_seconds:
+            cached.cpu_used += _cpu_used() - used
+
+
+def _worker_main(conn, memory_limit: int, cpu_seconds: int):
+    """
+    Worker process loop: run (function, doc_id, source, args) tasks received
+    on `conn` one at a time and send back ("ok", result) or ("error", message).
+    `source` is None when the document was sent with an earlier task.
+    """
+    # Ctrl-C is for the parent, which stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        # Address space rather than RSS: Linux does not enforce RLIMIT_RSS.
+        # MuPDF allocations beyond it fail with an error instead of growing
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
+    _worker_limits["cpu_seconds"] = cpu_seconds
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        function, doc_id, source, args = task
+        if function is _forget_document:
+            # The parent is done with the document; nothing to reply
+            _forget_document(doc_id)
+            continue
+        try:
+            reply = ("ok", _run_task(function, doc_id, source, args))
+        except MemoryError:
+            reply = ("memory", "Rendering exceeded the worker memory limit")
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        if reply[0] != "ok":
+            # The parent forgets it too and sends the source again if needed
+            _forget_document(doc_id)
+        try:
+            conn.send(reply)
+        except MemoryError:
+            conn.send(("memory", "Rendering exceeded the worker memory limit"))
+
+
+class _Worker:
+    """
+    One sandboxed rendering process, driven over a pipe (blocking calls).
+    Mirrors the worker's document cache, so each document's source is sent
+    to it only once. Tasks and forget messages may be sent from different
+    threads; `_send_lock` keeps them and the mirror in step.
+    """
+
+    def __init__(self, context, memory_limit: int, cpu_seconds: int):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child, memory_limit, cpu_seconds),
+            name="raster-worker",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.documents = 0
+        self.loaded: "OrderedDict[str, None]" = OrderedDict()
+        self.broken = False
+        self._send_lock = threading.Lock()
+
+    def _load(self, doc_id: str) -> bool:
+        """
+        Record that `doc_id` is used next, as the worker will
+        Returns: whether its source has to be sent
+        """
+        send = doc_id not in self.loaded
+        if send:
+            self.documents += 1
+        self.loaded[doc_id] = None
+        self.loaded.move_to_end(doc_id)
+        while len(self.loaded) > WORKER_DOCUMENTS:
+            self.loaded.popitem(last=False)
+        return send
+
+    def call(self, timeout: float, function: Callable, doc_id: str, source, *args):
+        try:
+            with self._send_lock:
+                send = self._load(doc_id)
+                self.conn.send((function, doc_id, source if send else None, args))
+            if timeout and not self.conn.poll(timeout):
+                self.broken = True
+                self.kill()
+                raise RenderError("timeout", f"Rendering took longer than {timeout:g}s")
+            status, value = self.conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            self.broken = True
+            self.process.join(1)
+            if self.process.exitcode == -signal.SIGXCPU:
+                raise RenderError("cpu_limit", "Rendering exceeded the CPU time limit")
+            raise RenderError(
+                "crash", f"Rendering worker crashed (exit code {self.process.exitcode})"
+            )
+        if status != "ok":
+            with self._send_lock:
+                self.loaded.pop(doc_id, None)
+        if status == "memory":
+            # The process may be left fragmented or half-initialized
+            self.broken = True
+            raise RenderError("memory_limit", value)
+        if status == "error":
+            raise RenderError("error", value)
+        return value
+
+    def forget(self, doc_id: str):
+        """
+        Tell the worker to close `doc_id` and drop its source, if it has it.
+        Does not wait: the worker handles it after its current task.
+        """
+        with self._send_lock:
+            if doc_id not in self.loaded:
+                return
+            del self.loaded[doc_id]
+            try:
+                self.conn.send((_forget_document, doc_id, None, ()))
+            except OSError:
+                # Dead worker: it is replaced after its current task
+                pass
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(1)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+
+class RasterPool:
+    """
+    Sandboxed process pool for CPU-bound page rasterization.
+
+    Documents are split into page ranges of `chunk_pages` that are rendered in
+    parallel across `max_workers` processes and yielded back in page order.
+    A document is sent to each worker once and stays open there (up to
+    WORKER_DOCUMENTS per worker), so its page ranges only carry its id and
+    concurrent documents sharing a worker do not reopen each other. Each
+    worker is a separate process driven over its own pipe, limited to
+    `max_memory_mb` of address space and `max_cpu_seconds` of CPU per
+    document (across all its tasks); a range taking longer than `task_timeout` seconds is killed.
+    Documents with more than `max_pages` pages are rejected before any page
+    is rendered. A worker that crashes or hits a limit fails only the
+    document it was rendering (RenderError) and is replaced by a fresh one,
+    so one bad file does not affect other documents. Workers are also
+    replaced after `recycle_after_documents` documents so fitz memory growth
+    is released. 0 disables a limit. Once a document is done (or its
+    rendering is cancelled), every worker that loaded it is told to close
+    it, so finished documents do not stay open in the workers.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        chunk_pages: int = 4,
+        recycle_after_documents: int = 50,
+        max_pages: int = 0,
+        max_memory_mb: int = 0,
+        max_cpu_seconds: int = 0,
+        task_timeout: float = 0,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.chunk_pages = max(1, chunk_pages)
+        self.recycle_after_documents = recycle_after_documents
+        self.max_pages = max_pages
+        self.memory_limit = max_memory_mb * 1024 * 1024
+        self.max_cpu_seconds = max_cpu_seconds
+        self.task_timeout = task_timeout
+        self.counters = {
+            "documents": 0,
+            "failed_documents": 0,
+            "workers_started": 0,
+            "too_many_pages": 0,
+            "timeout": 0,
+            "cpu_limit": 0,
+            "memory_limit": 0,
+            "crash": 0,
+            "error": 0,
+        }
+        # Avoid forking a process that already runs threads
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[Optional[_Worker]]" = queue.Queue()
+        for _ in range(self.max_workers):
+            self._idle.put(None)  # started on first use
+        # One dispatch thread per worker, so a dispatched call never waits
+        # for a worker and pending calls can still be cancelled
+        self._dispatch = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="raster-dispatch"
+        )
+        self._lock = threading.Lock()
+        # Every live worker, idle or busy, for forgetting finished documents
+        self._workers = set()
+
+    def _start_worker(self) -> _Worker:
+        worker = _Worker(self._context, self.memory_limit, self.max_cpu_seconds)
+        with self._lock:
+            self.counters["workers_started"] += 1
+            self._workers.add(worker)
+        return worker
+
+    def _call(self, function: Callable, doc_id: str, source, *args):
+        worker = self._idle.get()
+        try:
+            if worker is None:
+                worker = self._start_worker()
+            return worker.call(self.task_timeout, function, doc_id, source, *args)
+        except RenderError as e:
+            with self._lock:
+                self.counters[e.reason] += 1
+            raise
+        finally:
+            if worker is not None and (
+                worker.broken
+                or (
+                    self.recycle_after_documents > 0
+                    and worker.documents >= self.recycle_after_documents
+                )
+            ):
+                with self._lock:
+                    self._workers.discard(worker)
+                worker.stop()
+                worker = None
+            self._idle.put(worker)
+
+    def submit(self, function: Callable, doc_id: str, source, *args) -> Future:
+        """
+        Run `function(document, *args)` in a worker. `source` (path or bytes)
+        is only sent to workers that do not have the document yet.
+        """
+        return self._dispatch.submit(self._call, function, doc_id, source, *args)
+
+    def _new_document(self) -> str:
+        with self._lock:
+            self.counters["documents"] += 1
+        return uuid.uuid4().hex
+
+    def forget(self, doc_id: str):
+        """
+        Close a document in every worker that has it open
+        """
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            worker.forget(doc_id)
+
+    def _close_document(self, doc_id: str, futures):
+        """
+        Cancel the document's tasks that have not started and forget the
+        document once the ones already running are done (one of them may
+        still be about to send it to a worker)
+        """
+        running = [future for future in futures if not future.cancel()]
+        remaining = len(running)
+        if not remaining:
+            self.forget(doc_id)
+            return
+        lock = threading.Lock()
+
+        def done(_):
+            nonlocal remaining
+            with lock:
+                remaining -= 1
+                last = remaining == 0
+            if last:
+                self.forget(doc_id)
+
+        for future in running:
+            future.add_done_callback(done)
+
+    def _check_page_count(self, page_count: int):
+        if self.max_pages and page_count > self.max_pages:
+            with self._lock:
+                self.counters["too_many_pages"] += 1
+        check_page_count(page_count, self.max_pages)
+
+    def _page_ranges(
+        self, page_count: int, skip: AbstractSet[int] = frozenset()
+    ) -> Iterator[Tuple[int, int]]:
+        """
+        Ranges [start, stop) of at most `chunk_pages` consecutive pages,
+        covering every page not in `skip`
+        """
+        self._check_page_count(page_count)
+        start = None
+        for page_num in range(page_count + 1):
+            wanted = page_num < page_count and page_num not in skip
+            if start is not None and (not wanted or page_num - start == self.chunk_pages):
+                yield start, page_num
+                start = None
+            if wanted and start is None:
+                start = page_num
+
+    async def page_count(self, source: Union[str, bytes]) -> int:
+        """
+        Number of pages of a document (path or bytes), opened in the sandbox
+        Raises: RenderError when the document cannot be opened or has too many pages
+        """
+        doc_id = self._new_document()
+        future = self.submit(count_pages, doc_id, source)
+        try:
+            page_count = await asyncio.wrap_future(future)
+        finally:
+            self._close_document(doc_id, [future])
+        self._check_page_count(page_count)
+        return page_count
+
+    def shutdown(self):
+        self._dispatch.shutdown(wait=False, cancel_futures=True)
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if worker is not None:
+                worker.stop()
+        with self._lock:
+            self._workers.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"workers": self.max_workers, **self.counters}
+
+    async def convert_images(self, source: Union[str, bytes], filetype: str) -> bytes:
+        """
+        PDF of an image file (multi-page TIFF, JPEG, PNG), converted in a worker
+        Raises: RenderError when the image cannot be decoded within the limits
+        """
+        doc_id = self._new_document()
+        future = self.submit(convert_images, doc_id, source, filetype)
+        try:
+            return await asyncio.wrap_future(future)
+        except RenderError:
+            with self._lock:
+                self.counters["failed_documents"] += 1
+            raise
+        finally:
+            self._close_document(doc_id, [future])
+
+    def render_document(
+        self, source: Union[str, bytes], options: Optional[RenderOptions] = None
+    ) -> List[RenderedPage]:
+        """
+        Blocking variant of aiter_pages: every page of a document, in order
+        Raises: RenderError when the document cannot be rendered in the sandbox
+        """
+        doc_id = self._new_document()
+        futures = [self.submit(count_pages, doc_id, source)]
+        try:
+            page_count = futures[0].result()
+            futures += [
+                self.submit(render_page_range, doc_id, source, *page_range, options)
+                for page_range in self._page_ranges(page_count)
+            ]
+            return [page for future in futures[1:] for page in future.result()]
+        except RenderError:
+            with self._lock:
+                self.counters["failed_documents"] += 1
+            raise
+        finally:
+            self._close_document(doc_id, futures)
+
+    async def aiter_pages(
+        self,
+        source: Union[str, bytes],
+        options: Optional[RenderOptions] = None,
+        memory=None,
+        skip: AbstractSet[int] = frozenset(),
+    ) -> AsyncIterator[RenderedPage]:
+        """
+        Render a document (path or bytes) across the pool, yielding pages in
+        order and leaving out the 0-based page indexes in `skip`.
+        At most one page range per worker is in flight at a time. With
+        `memory` (admission.PageMemory), the pages of a range are reserved
+        against the memory budget before the range is submitted, so ranges in
+        workers and rendered ranges not yet consumed are charged; ranges are
+        only prefetched into room that is free right now.
+        Raises: RenderError when the document cannot be rendered in the sandbox
+        """
+        doc_id = self._new_document()
+        pending = deque()
+        counting = self.submit(count_pages, doc_id, source)
+        try:
+            page_count = await asyncio.wrap_future(counting)
+            ranges = deque(self._page_ranges(page_count, skip))
+
+            async def schedule(may_wait: bool):
+                while ranges and len(pending) < self.max_workers:
+                    start, stop = ranges[0]
+                    # Only wait for the budget with no rendered range held back
+                    if memory is not None and not await memory.reserve(
+                        stop - start, may_wait and not pending
+                    ):
+                        return
+                    ranges.popleft()
+                    pending.append(
+                        self.submit(render_page_range, doc_id, source, start, stop, options)
+                    )
+
+            await schedule(may_wait=True)
+            while pending:
+                pages = await asyncio.wrap_future(pending[0])
+                pending.popleft()
+                await schedule(may_wait=False)
+                for page in pages:
+                    yield page
+                if not pending:
+                    await schedule(may_wait=True)
+        except RenderError:
+            with self._lock:
+                self.counters["failed_documents"] += 1
+            raise
+        finally:
+            self._close_document(doc_id, [counting, *pending])
@@ -0,0 +1,329 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+# Rough size of one page image in prompt tokens, for quota accounting
+IMAGE_TOKEN_ESTIMATE = 1000
+# Characters per token for the token estimate of text messages
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(payload: dict, image_tokens: int = IMAGE_TOKEN_ESTIMATE) -> int:
+    """
+    Upper-bound token cost of a chat completion request: prompt text,
+    images and the max_tokens the model may generate
+    """
+    chars = len(payload.get("system_prompt") or "")
+    images = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += 1
+    return chars // CHARS_PER_TOKEN + images * image_tokens + int(payload.get("max_tokens") or 0)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` tokens per minute,
+    holding at most one minute of quota. A rate of 0 means unlimited.
+    Waiters are served in FIFO order.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.waiting = 0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.per_minute / 60
+        )
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        if self.unlimited:
+            return
+        amount = min(amount, self.capacity)
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return
+                    await asyncio.sleep((amount - self.tokens) * 60 / self.per_minute)
+        finally:
+            self.waiting -= 1
+
+    def credit(self, amount: float):
+        """
+        Give back tokens that were reserved but not used
+        """
+        if self.unlimited or amount <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        """
+        Empty the bucket, e.g. after the provider answered 429
+        """
+        if not self.unlimited:
+            self._refill()
+            self.tokens = 0.0
+
+    def snapshot(self) -> dict:
+        if self.unlimited:
+            return {"per_minute": None, "available": None, "waiting": self.waiting}
+        self._refill()
+        return {
+            "per_minute": self.per_minute,
+            "available": round(self.tokens, 1),
+            "waiting": self.waiting,
+        }
+
+
+class AIMDController:
+    """
+    Adaptive concurrency limit (additive increase, multiplicative decrease).
+
+    Every healthy response raises the limit by `increase / limit` (about +1
+    per round of requests); a 429, a 5xx, a transport error or a latency
+    spike (`latency_spike_factor` x the usual latency) multiplies it by
+    `decrease_factor`, at most once per round trip so one burst of failures
+    counts once.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        latency_spike_factor: float = 2.0,
+        min_latency_samples: int = 5,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.min_latency_samples = min_latency_samples
+        self.in_flight = 0
+        self.latency: Optional[float] = None  # EWMA of healthy response latency
+        self.counters = {"ok": 0, "throttled": 0, "error": 0, "latency_spike": 0, "decreases": 0}
+        self._samples = 0
+        self._last_decrease = 0.0
+        self._waiters: deque = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just before the cancellation landed
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, outcome: str, latency: float):
+        """
+        Free a slot and adapt the limit. `outcome` is "ok", "throttled",
+        "error" or "cancelled" (which does not change the limit).
+        """
+        self.in_flight -= 1
+        if outcome == "ok":
+            self._on_success(latency)
+        elif outcome in ("throttled", "error"):
+            self.counters[outcome] += 1
+            self._decrease()
+        self._wake()
+
+    def _on_success(self, latency: float):
+        self.counters["ok"] += 1
+        self._samples += 1
+        spike = (
+            self.latency is not None
+            and self._samples > self.min_latency_samples
+            and latency > self.latency * self.latency_spike_factor
+        )
+        # The baseline follows slowly, so a lasting slowdown is accepted in time
+        self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+        if spike:
+            self.counters["latency_spike"] += 1
+            self._decrease()
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < max(1.0, self.latency or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.counters["decreases"] += 1
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            **self.counters,
+        }
+
+
+class Permit:
+    """
+    One admitted request; the caller records how it went before leaving
+    the `ModelLimiter.slot` block
+    """
+
+    def __init__(self, reserved_tokens: int):
+        self.reserved_tokens = reserved_tokens
+        self.outcome = "cancelled"
+        self.used_tokens: Optional[int] = None
+
+
+class ModelLimiter:
+    """
+    Limits for one model: requests/min and tokens/min buckets plus an
+    adaptive concurrency limit
+    """
+
+    def __init__(
+        self,
+        model: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        controller: AIMDController,
+    ):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.controller = controller
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        self.waiting += 1
+        acquired = []
+        try:
+            await self.requests.acquire(1)
+            acquired.append((self.requests, 1))
+            await self.tokens.acquire(estimated_tokens)
+            acquired.append((self.tokens, estimated_tokens))
+            await self.controller.acquire()
+        except BaseException:
+            # Cancelled (or failed) while queued: the request was never sent,
+            # so the quota already taken goes back
+            for bucket, amount in acquired:
+                bucket.credit(amount)
+            raise
+        finally:
+            self.waiting -= 1
+
+        permit = Permit(estimated_tokens)
+        started = time.monotonic()
+        try:
+            yield permit
+        finally:
+            self.controller.release(permit.outcome, time.monotonic() - started)
+            if permit.outcome == "throttled":
+                self.requests.drain()
+            if permit.used_tokens is not None:
+                self.tokens.credit(permit.reserved_tokens - permit.used_tokens)
+
+    def snapshot(self) -> dict:
+        return {
+            "waiting": self.waiting,
+            "requests_per_minute": self.requests.snapshot(),
+            "tokens_per_minute": self.tokens.snapshot(),
+            "concurrency": self.controller.snapshot(),
+        }
+
+
+class UpstreamLimiter:
+    """
+    Shared limiter in front of the model API, one ModelLimiter per model.
+    `model_quotas` maps a model name to its (requests/min, tokens/min);
+    models without a quota only get the adaptive concurrency limit.
+    """
+
+    def __init__(
+        self,
+        model_quotas: Optional[Dict[str, Tuple[float, float]]] = None,
+        initial_concurrency: int = 4,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        latency_spike_factor: float = 2.0,
+        image_tokens: int = IMAGE_TOKEN_ESTIMATE,
+    ):
+        self.model_quotas = model_quotas or {}
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_spike_factor = latency_spike_factor
+        self.image_tokens = image_tokens
+        self._models: Dict[str, ModelLimiter] = {}
+
+    def for_model(self, model: str) -> ModelLimiter:
+        if model not in self._models:
+            requests_per_minute, tokens_per_minute = self.model_quotas.get(model, (0, 0))
+            self._models[model] = ModelLimiter(
+                model,
+                requests_per_minute,
+                tokens_per_minute,
+                AIMDController(
+                    initial_limit=self.initial_concurrency,
+                    min_limit=self.min_concurrency,
+                    max_limit=self.max_concurrency,
+                    latency_spike_factor=self.latency_spike_factor,
+                ),
+            )
+        return self._models[model]
+
+    def slot(self, payload: dict):
+        return self.for_model(payload.get("model", "")).slot(
+            estimate_tokens(payload, self.image_tokens)
+        )
+
+    def metrics(self) -> dict:
+        return {model: limiter.snapshot() for model, limiter in self._models.items()}
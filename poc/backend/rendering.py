@@ -0,0 +1,355 @@
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import AbstractSet, AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from dpi import DpiPolicy
+from encoding import (
+    PNG,
+    EncodingOptions,
+    encode_page_image,
+    encode_pixmap,
+    fit_scale,
+    pixmap_to_image,
+)
+from pagecheck import (
+    THUMBNAIL_WIDTH,
+    PageCheckPolicy,
+    check_pixmap,
+    image_gray,
+    ink_coverage,
+    pixmap_gray,
+)
+from preprocess import PreprocessOptions, preprocess_pixmap
+from textlayer import TextLayerPolicy, page_to_markdown
+from tiling import TilingPolicy
+
+RENDER_SCALE = 2
+
+_DONE = object()
+
+
+@dataclass
+class RenderedPage:
+    """
+    A single rendered page: 0-based page index, its encoded image and
+    per-page details reported back in the page result.
+    Pages taken from the PDF text layer carry `text` and no image; blank
+    pages carry empty text. `pixel_digest` identifies the rendered pixels
+    for duplicate detection. Oversized pages carry their strips in `tiles`
+    instead of a single image. `ink_area` (square points of ink) measures
+    how much text the VLM has to write.
+    """
+
+    index: int
+    image: bytes
+    mime: str = "image/png"
+    meta: dict = field(default_factory=dict)
+    text: Optional[str] = None
+    pixel_digest: Optional[str] = field(default=None, repr=False)
+    tiles: List["RenderedPage"] = field(default_factory=list, repr=False)
+    ink_area: float = 0.0
+
+    @property
+    def data_uri(self) -> str:
+        img_base64 = base64.b64encode(self.image).decode("utf-8")
+        return f"data:{self.mime};base64,{img_base64}"
+
+
+@dataclass(frozen=True)
+class RenderOptions:
+    """
+    How pages are rendered: a fixed `scale`, or a per-page scale chosen by
+    `dpi` when set, then encoded with `encoding`. With `text_layer` set,
+    pages with a reliable text layer are converted to markdown directly and
+    not rasterized at all. With `page_check` set, blank pages are detected
+    on the pixmap and not encoded. With `preprocess` set, the pixmap is
+    deskewed/cropped/binarized before encoding. With `tiling` set,
+    oversized pages are split into overlapping strips.
+    """
+
+    scale: float = RENDER_SCALE
+    encoding: EncodingOptions = PNG
+    dpi: Optional[DpiPolicy] = None
+    text_layer: Optional[TextLayerPolicy] = None
+    page_check: Optional[PageCheckPolicy] = None
+    preprocess: Optional[PreprocessOptions] = None
+    tiling: Optional[TilingPolicy] = None
+
+    @property
+    def label(self) -> str:
+        parts = [self.dpi.label if self.dpi else f"x{self.scale}", self.encoding.label]
+        if self.text_layer:
+            parts.append(self.text_layer.label)
+        if self.page_check:
+            parts.append(self.page_check.label)
+        if self.preprocess:
+            parts.append(self.preprocess.label)
+        if self.tiling:
+            parts.append(self.tiling.label)
+        return "-".join(parts)
+
+
+DEFAULT_RENDER_OPTIONS = RenderOptions()
+
+
+class RenderError(Exception):
+    """
+    Raised when a document cannot be rendered. `reason` is one of
+    too_many_pages, timeout, cpu_limit, memory_limit, crash or error.
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def check_page_count(page_count: int, max_pages: int):
+    """
+    Raises: RenderError when the document has more than `max_pages` pages (0 = no limit)
+    """
+    if max_pages and page_count > max_pages:
+        raise RenderError(
+            "too_many_pages", f"Document has {page_count} pages, the limit is {max_pages}"
+        )
+
+
+def images_to_pdf(source: Union[str, bytes], filetype: str) -> bytes:
+    """
+    PDF with one page per image of an image file (multi-page TIFF, JPEG,
+    PNG), at the physical size given by the image resolution
+    """
+    if isinstance(source, (bytes, bytearray)):
+        images = fitz.open(stream=source, filetype=filetype)
+    else:
+        images = fitz.open(source, filetype=filetype)
+    try:
+        return images.convert_to_pdf()
+    finally:
+        images.close()
+
+
+def open_document(source: Union[str, bytes]) -> fitz.Document:
+    """
+    Open a PDF from a file path or from in-memory bytes
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def render_page(
+    page: fitz.Page, options: Optional[RenderOptions] = None
+) -> RenderedPage:
+    """
+    Render one PDF page and encode it (2x PNG unless `options` say otherwise)
+    """
+    options = options or DEFAULT_RENDER_OPTIONS
+    if options.text_layer:
+        reliable, metrics = options.text_layer.classify(page)
+        if reliable:
+            return RenderedPage(
+                index=page.number,
+                image=b"",
+                meta={"source": "text_layer", "text_layer": metrics},
+                text=page_to_markdown(page),
+            )
+
+    scale = options.dpi.choose_scale(page) if options.dpi else options.scale
+    # Tiled pages are bounded by the tile budget, not by a single image
+    max_pixels = options.tiling.max_page_pixels if options.tiling else options.encoding.max_pixels
+    scale = fit_scale(page.rect, scale, max_pixels)
+    if options.tiling:
+        # Long narrow pages (receipts) are bounded by the strip count
+        scale = min(scale, options.tiling.max_page_height / max(1.0, page.rect.height))
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+
+    report, digest = None, None
+    if options.page_check:
+        report, digest = check_pixmap(pix, options.page_check)
+        if report["decision"] == "blank":
+            return RenderedPage(
+                index=page.number,
+                image=b"",
+                meta={"source": "blank", "page_check": report},
+                text="",
+            )
+
+    processed, preprocessed = None, None
+    if options.preprocess:
+        processed, preprocessed = preprocess_pixmap(pix, options.preprocess)
+
+    tiles = []
+    if options.tiling:
+        size = processed.size if processed is not None else (pix.width, pix.height)
+        boxes = options.tiling.plan(*size)
+        if len(boxes) > 1:
+            source = processed if processed is not None else pixmap_to_image(pix)
+            tiles = encode_tiles(page.number, source, boxes, options.encoding, scale)
+
+    if tiles:
+        image, mime = b"", tiles[0].mime
+        image_bytes = sum(len(tile.image) for tile in tiles)
+        encoding_label = ",".join(sorted({tile.meta["encoding"] for tile in tiles}))
+    else:
+        if processed is not None:
+            image, mime, used = encode_page_image(processed, options.encoding)
+        else:
+            image, mime, used = encode_pixmap(pix, options.encoding)
+        image_bytes, encoding_label = len(image), used.label
+    if preprocessed is not None and options.preprocess.report_savings:
+        baseline, _, _ = encode_pixmap(pix, options.encoding)
+        preprocessed["bytes_saved"] = len(baseline) - image_bytes
+
+    meta = {
+        "source": "vlm",
+        "scale": round(scale, 3),
+        "encoding": encoding_label,
+        "image_bytes": image_bytes,
+    }
+    if tiles:
+        meta["tiles"] = len(tiles)
+    if report is not None:
+        meta["page_check"] = report
+    if preprocessed is not None:
+        meta["preprocess"] = preprocessed
+    if report is not None:
+        coverage = report["ink_coverage"]
+    else:
+        coverage = ink_coverage(pixmap_gray(pix, THUMBNAIL_WIDTH))
+    return RenderedPage(
+        index=page.number,
+        image=image,
+        mime=mime,
+        meta=meta,
+        pixel_digest=digest,
+        tiles=tiles,
+        ink_area=coverage * abs(page.rect),
+    )
+
+
+def encode_tiles(
+    index: int,
+    image: Image.Image,
+    boxes: List[Tuple[int, int, int, int]],
+    encoding: EncodingOptions,
+    scale: float,
+) -> List[RenderedPage]:
+    """
+    Encode each strip of an oversized page (rendered at `scale`) as its own image
+    """
+    tiles = []
+    for number, box in enumerate(boxes, start=1):
+        strip = image.crop(box)
+        data, mime, used = encode_page_image(strip, encoding)
+        area = (box[2] - box[0]) * (box[3] - box[1]) / (scale * scale)
+        tiles.append(
+            RenderedPage(
+                index=index,
+                image=data,
+                mime=mime,
+                meta={"tile": number, "box": list(box), "encoding": used.label},
+                ink_area=ink_coverage(image_gray(strip, THUMBNAIL_WIDTH)) * area,
+            )
+        )
+    return tiles
+
+
+def count_document_pages(source: Union[str, bytes], max_pages: int = 0) -> int:
+    """
+    Number of pages of a PDF (path or bytes), without rendering any
+    Raises: RenderError when the document has more than `max_pages` pages
+    """
+    pdf_document = open_document(source)
+    try:
+        check_page_count(pdf_document.page_count, max_pages)
+        return pdf_document.page_count
+    finally:
+        pdf_document.close()
+
+
+def iter_rendered_pages(
+    source: Union[str, bytes],
+    options: Optional[RenderOptions] = None,
+    max_pages: int = 0,
+    skip: AbstractSet[int] = frozenset(),
+) -> Iterator[RenderedPage]:
+    """
+    Lazily render PDF pages (from a path or bytes), one page at a time,
+    leaving out the 0-based page indexes in `skip`
+    Raises: RenderError when the document has more than `max_pages` pages
+    """
+    pdf_document = open_document(source)
+    try:
+        check_page_count(pdf_document.page_count, max_pages)
+        for page in pdf_document:
+            if page.number not in skip:
+                yield render_page(page, options)
+    finally:
+        pdf_document.close()
+
+
+def iter_page_images(
+    source: Union[str, bytes], options: Optional[RenderOptions] = None, max_pages: int = 0
+) -> Iterator[str]:
+    """
+    Lazily render PDF pages to base64 data URIs, one image per page
+    """
+    # Callers expect a single image per page, so oversized pages are not tiled
+    options = replace(options or DEFAULT_RENDER_OPTIONS, tiling=None)
+    for rendered in iter_rendered_pages(source, options, max_pages):
+        yield rendered.data_uri
+
+
+async def aiter_rendered_pages(
+    source: Union[str, bytes],
+    prefetch: int = 2,
+    options: Optional[RenderOptions] = None,
+    max_pages: int = 0,
+    memory=None,
+    skip: AbstractSet[int] = frozenset(),
+) -> AsyncIterator[RenderedPage]:
+    """
+    Async variant of iter_rendered_pages.
+
+    Pages are rendered off the event loop in a dedicated thread and at most
+    `prefetch` pages are rendered ahead of the consumer, so memory stays flat
+    regardless of page count. With `memory` (admission.PageMemory), every
+    page is reserved against the memory budget before its rendering starts;
+    pages are only prefetched into room that is free right now.
+    """
+    loop = asyncio.get_running_loop()
+    # One thread per document: fitz documents must not be shared across threads
+    # and the generator is advanced strictly in order
+    render_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+    pages = iter_rendered_pages(source, options, max_pages, skip)
+    pending = deque()
+
+    async def schedule(may_wait: bool):
+        while len(pending) < max(1, prefetch):
+            # Only wait for the budget with no rendered page held back
+            if memory is not None and not await memory.reserve(1, may_wait and not pending):
+                return
+            pending.append(loop.run_in_executor(render_thread, next, pages, _DONE))
+
+    try:
+        while True:
+            await schedule(may_wait=True)
+            rendered = await pending.popleft()
+            if rendered is _DONE:
+                if memory is not None:
+                    memory.unreserve(1 + len(pending))
+                break
+            await schedule(may_wait=False)
+            yield rendered
+    finally:
+        for future in pending:
+            future.cancel()
+        # Runs after any in-flight render, in the thread owning the document
+        render_thread.submit(pages.close)
+        render_thread.shutdown(wait=False)
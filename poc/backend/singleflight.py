@@ -0,0 +1,88 @@
+import asyncio
+import inspect
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Future] = None
+        self.waiters = 0
+        self.events: List[Any] = []
+        self.subscribers: List[Callable] = []
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one computation.
+
+    The first caller starts `start(emit)`; callers arriving while it runs
+    attach to it and get the same result (or exception). Waiters are
+    reference counted: a waiter that is cancelled just detaches, and the
+    computation itself is cancelled only when its last waiter is gone.
+
+    `emit(event)` forwards progress events (e.g. finished pages) to every
+    waiter's `on_event`; late joiners first receive the events they missed.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.counters = {"started": 0, "joined": 0, "cancelled": 0}
+
+    async def do(
+        self,
+        key: str,
+        start: Callable[[Callable], Awaitable[Any]],
+        on_event: Optional[Callable[[Any], Any]] = None,
+    ) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+
+            async def emit(event):
+                flight.events.append(event)
+                for subscriber in list(flight.subscribers):
+                    await _deliver(subscriber, event)
+
+            flight.task = asyncio.ensure_future(start(emit))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.counters["started"] += 1
+        else:
+            self.counters["joined"] += 1
+            if on_event is not None:
+                for event in list(flight.events):
+                    await _deliver(on_event, event)
+
+        flight.waiters += 1
+        if on_event is not None:
+            flight.subscribers.append(on_event)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if on_event is not None:
+                flight.subscribers.remove(on_event)
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody is left to receive the result
+                flight.task.cancel()
+                self.counters["cancelled"] += 1
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(flight.waiters for flight in self._flights.values()),
+            **self.counters,
+        }
+
+
+async def _deliver(callback: Callable, event: Any):
+    try:
+        result = callback(event)
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        # One waiter's callback must not fail the shared computation
+        print(f"⚠️ Progress callback failed: {str(e)}")
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+_DONE = object()
+
+
+def encode_event(event: str, data: dict, fmt: str) -> str:
+    """
+    One stream event: an NDJSON line with an "event" field, or an SSE message
+    """
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+async def stream_pipeline(
+    run: Callable[[Callable], Awaitable[dict]], fmt: str
+) -> AsyncIterator[str]:
+    """
+    Run a document pipeline and stream its page results as they complete.
+
+    `run(on_page)` must call `on_page(result)` for every finished page and
+    return the final response dict. Emits one "page" event per page, then a
+    "summary" event with total_pages and timings (or an "error" event).
+    """
+    started = time.perf_counter()
+    queue: "asyncio.Queue" = asyncio.Queue()
+    emitted = set()
+    first_result = None
+
+    async def on_page(result: dict):
+        await queue.put(result)
+
+    async def runner():
+        try:
+            return await run(on_page)
+        finally:
+            await queue.put(_DONE)
+
+    task = asyncio.create_task(runner())
+    try:
+        while True:
+            result = await queue.get()
+            if result is _DONE:
+                break
+            if first_result is None:
+                first_result = time.perf_counter() - started
+            emitted.add(result["page"])
+            yield encode_event("page", result, fmt)
+
+        try:
+            response = await task
+        except Exception as e:
+            yield encode_event("error", {"detail": f"Error processing PDF: {str(e)}"}, fmt)
+            return
+
+        # Results that never went through on_page (e.g. a cached document)
+        for result in response["results"]:
+            if result["page"] not in emitted:
+                if first_result is None:
+                    first_result = time.perf_counter() - started
+                yield encode_event("page", result, fmt)
+
+        total = time.perf_counter() - started
+        summary = {"success": response["success"], "total_pages": response["total_pages"]}
+        if "invoices" in response:
+            summary["invoices"] = [
+                {"invoice": invoice["invoice"], "pages": invoice["pages"]}
+                for invoice in response["invoices"]
+            ]
+        summary["timings"] = {
+            "first_result_seconds": round(first_result or total, 3),
+            "total_seconds": round(total, 3),
+        }
+        yield encode_event("summary", summary, fmt)
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,110 @@
+import asyncio
+
+import fitz
+import pytest
+
+from admission import AdmissionController, MemoryBudget, Overloaded, PageMemory
+from rasterizer import RasterPool
+from rendering import aiter_rendered_pages
+
+
+def pdf_bytes(pages: int) -> bytes:
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f"Page {number + 1}")
+    return document.tobytes()
+
+
+async def consume(memory: PageMemory, pages) -> list:
+    """Run every page through a no-op VLM stage, noting the pages held in memory"""
+
+    async def vlm_stage(page):
+        held.append(len(memory._charges) + len(memory._reserved))
+
+    held = []
+    stage = memory.stage(vlm_stage)
+    async for page in memory.watch(pages):
+        await stage(page)
+    return held
+
+
+def test_reserve_without_wait_only_takes_free_room():
+    async def scenario():
+        budget = MemoryBudget(max_bytes=budget_bytes)
+        memory = PageMemory(budget)
+        assert await memory.reserve(1)
+        assert not await memory.reserve(1, wait=False)
+        memory.unreserve(1)
+        assert budget.used == 0
+        assert await memory.reserve(1, wait=False)
+        memory.close()
+        assert budget.used == 0
+
+    budget_bytes = MemoryBudget(0).page_estimate
+    asyncio.run(scenario())
+
+
+def test_prefetched_pages_are_charged():
+    async def scenario(max_bytes: int) -> list:
+        budget = MemoryBudget(max_bytes=max_bytes)
+        memory = PageMemory(budget)
+        pages = aiter_rendered_pages(pdf_bytes(5), prefetch=3, memory=memory)
+        held = await consume(memory, pages)
+        memory.close()
+        assert budget.used == 0
+        return held
+
+    # Room for one page: nothing is rendered ahead of the page being consumed
+    assert max(asyncio.run(scenario(1))) == 1
+    # Without a limit the prefetch window is charged along with the page
+    assert max(asyncio.run(scenario(0))) > 1
+
+
+def test_worker_ranges_are_charged():
+    async def scenario(pool: RasterPool, max_bytes: int) -> list:
+        budget = MemoryBudget(max_bytes=max_bytes)
+        memory = PageMemory(budget)
+        held = await consume(memory, pool.aiter_pages(pdf_bytes(6), memory=memory))
+        memory.close()
+        assert budget.used == 0
+        return held
+
+    pool = RasterPool(max_workers=2, chunk_pages=2)
+    try:
+        # Room for one page: one range at a time, charged while in the worker
+        assert max(asyncio.run(scenario(pool, 1))) == 2
+        # Without a limit: the range being consumed plus one range per worker
+        assert max(asyncio.run(scenario(pool, 0))) == 6
+    finally:
+        pool.shutdown()
+
+
+def test_queued_work_waits_for_a_slot_ahead_of_new_documents():
+    async def scenario():
+        admission = AdmissionController(MemoryBudget(0), max_documents=2)
+        first, second = admission.admit(), admission.admit()
+        with pytest.raises(Overloaded):
+            admission.admit()
+
+        job = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        assert not job.done() and admission.snapshot()["waiting"] == 1
+        first()
+        first()  # Releasing twice frees one slot
+        release_job = await job
+        assert admission.documents == 2
+        # The waiting job took the freed slot; new uploads are still turned away
+        with pytest.raises(Overloaded):
+            admission.admit()
+
+        # A cancelled waiter gives up its place without taking a slot
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        second()
+        release_job()
+        assert admission.documents == 0 and admission.snapshot()["waiting"] == 0
+        admission.admit()
+
+    asyncio.run(scenario())
@@ -0,0 +1,135 @@
+import asyncio
+import io
+import zipfile
+
+import fitz
+import pytest
+
+import batch
+from admission import MemoryBudget, PageMemory, page_cost
+from batch import BatchFile, prepare_batch, run_batch
+from pipeline import PageExecutor
+from rasterizer import RasterPool
+from rendering import RenderOptions, iter_rendered_pages
+from uploads import UploadSpool
+
+
+def spool(directory, filename: str, data: bytes) -> UploadSpool:
+    # memory_limit=0: every spool lives in a temp file, so leaks stay on disk
+    upload = UploadSpool(filename, 0, str(directory))
+    upload.write(data)
+    upload.finish()
+    return upload
+
+
+def png_bytes() -> bytes:
+    return fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 8, 8), False).tobytes("png")
+
+
+def zip_bytes(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def prepare(uploads, directory, convert_images):
+    return prepare_batch(
+        uploads,
+        convert_images=convert_images,
+        memory_limit=0,
+        spool_dir=str(directory),
+        max_files=10,
+        max_file_bytes=1024 * 1024,
+        max_total_bytes=1024 * 1024,
+    )
+
+
+def test_failed_conversion_closes_every_spool(tmp_path):
+    uploads = [
+        spool(tmp_path, "a.pdf", b"%PDF-1.7 a"),
+        spool(tmp_path, "b.zip", zip_bytes({"c.png": png_bytes(), "d.pdf": b"%PDF-1.7 d"})),
+        spool(tmp_path, "e.png", png_bytes()),
+    ]
+
+    async def convert_images(source, file_type):
+        raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(prepare(uploads, tmp_path, convert_images))
+    assert all(upload.closed for upload in uploads)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_extraction_closes_every_spool(tmp_path, monkeypatch):
+    uploads = [
+        spool(tmp_path, "a.zip", zip_bytes({"b.pdf": b"%PDF-1.7 b", "c.pdf": b"%PDF-1.7 c"})),
+        spool(tmp_path, "d.pdf", b"%PDF-1.7 d"),
+    ]
+    create = batch._SpoolFactory.create
+
+    def create_once(self, filename, data=None):
+        # The second member cannot be spooled (e.g. the disk is full)
+        if self.created:
+            raise OSError("No space left on device")
+        return create(self, filename, data)
+
+    async def convert_images(source, file_type):
+        return b"%PDF-1.7"
+
+    monkeypatch.setattr(batch._SpoolFactory, "create", create_once)
+    with pytest.raises(OSError):
+        asyncio.run(prepare(uploads, tmp_path, convert_images))
+    assert all(upload.closed for upload in uploads)
+    assert list(tmp_path.iterdir()) == []
+
+
+def pdf_bytes(pages: int) -> bytes:
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f"Page {number + 1}")
+    return document.tobytes()
+
+
+def test_many_files_share_few_slots_and_a_small_budget(tmp_path):
+    # Workers render ranges of 4 pages, reserved before they are rendered
+    pool = RasterPool(max_workers=2, chunk_pages=4)
+    options = RenderOptions(scale=0.5)
+    budget = MemoryBudget(0)
+
+    async def process(upload, slots):
+        # The page pipeline of run_document, with a stub VLM stage
+        memory = PageMemory(budget)
+
+        async def vlm_stage(page):
+            await asyncio.sleep(0.001)
+            return ""
+
+        pages = memory.watch(pool.aiter_pages(upload.source, options, memory=memory))
+        executor = PageExecutor(memory.stage(vlm_stage), None, slots=slots)
+        try:
+            results = await executor.run(pages)
+        finally:
+            memory.close()
+        return {"success": True, "total_pages": len(results), "results": results}
+
+    async def scenario():
+        # Room for one range: rendered ranges of a few files fill the budget
+        budget.page_estimate = page_cost(next(iter_rendered_pages(pdf_bytes(1), options)))
+        budget.max_bytes = 4 * budget.page_estimate
+        files = [
+            BatchFile(f"{n}.pdf", spool(tmp_path, f"{n}.pdf", pdf_bytes(8))) for n in range(6)
+        ]
+        try:
+            return await asyncio.wait_for(run_batch(files, process, max_inflight_pages=2), 30)
+        finally:
+            for batch_file in files:
+                batch_file.close()
+
+    try:
+        response = asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+    assert response["success"] and response["total_pages"] == 48
+    assert budget.used == 0
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import fitz
+
+import main
+from batch_ocr import BatchRunner, Checkpoint, Progress
+from pipeline import ParsedPage
+
+
+def write_pdf(path, pages: int) -> str:
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f"Page {number + 1}")
+    document.save(str(path))
+    return str(path)
+
+
+def run_batch(monkeypatch, tmp_path, document: str, failing: set):
+    """One batch run over `document`; pages in `failing` get a VLM error"""
+    seen = []
+
+    async def extract_page_markdown(page):
+        seen.append(page.index + 1)
+        if page.index + 1 in failing:
+            return "Error: upstream timed out"
+        return f"# Page {page.index + 1}"
+
+    async def parse_markdown(markdown: str) -> ParsedPage:
+        return ParsedPage({"title": markdown}, {"extraction": {"method": "rules"}})
+
+    async def scenario(progress: Progress):
+        checkpoint = Checkpoint(str(tmp_path / "out.jsonl.checkpoint"))
+        runner = BatchRunner(
+            str(tmp_path / "out.jsonl"), str(tmp_path / "errors.jsonl"), checkpoint, progress
+        )
+        try:
+            await runner.process_document(document)
+        finally:
+            runner.close()
+            checkpoint.close()
+
+    monkeypatch.setattr(main, "raster_pool", None)
+    monkeypatch.setattr(main, "extract_page_markdown", extract_page_markdown)
+    monkeypatch.setattr(main, "parse_markdown", parse_markdown)
+    progress = Progress(1)
+    asyncio.run(scenario(progress))
+    return seen, progress.counters
+
+
+def read_lines(path) -> list:
+    with open(path, encoding="utf-8") as lines:
+        return [json.loads(line) for line in lines]
+
+
+def test_failed_pages_are_retried_on_the_next_run(monkeypatch, tmp_path):
+    document = write_pdf(tmp_path / "a.pdf", 3)
+
+    seen, counters = run_batch(monkeypatch, tmp_path, document, failing={2})
+    assert sorted(seen) == [1, 2, 3]
+    assert counters["pages_done"] == 2 and counters["pages_failed"] == 1
+    assert counters["documents_failed"] == 1
+    output = read_lines(tmp_path / "out.jsonl")
+    assert sorted(line["page"] for line in output) == [1, 3]
+    # Page results carry the pipeline's per-page details
+    assert output[0]["parsed_json"] == {"title": f"# Page {output[0]['page']}"}
+    assert output[0]["extraction"] == {"method": "rules"} and output[0]["total_pages"] == 3
+    errors = read_lines(tmp_path / "errors.jsonl")
+    assert [(error["page"], error["error"]) for error in errors] == [
+        (2, "Error: upstream timed out")
+    ]
+
+    # Only the failed page is rendered again
+    seen, counters = run_batch(monkeypatch, tmp_path, document, failing=set())
+    assert seen == [2]
+    assert counters["pages_skipped"] == 2 and counters["documents_done"] == 1
+
+    seen, counters = run_batch(monkeypatch, tmp_path, document, failing=set())
+    assert seen == [] and counters["documents_skipped"] == 1
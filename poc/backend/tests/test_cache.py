@@ -0,0 +1,102 @@
+import asyncio
+import sqlite3
+
+import cache
+from cache import ResultCache, make_key, normalize_markdown
+
+
+def accessed_at(path, key):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT accessed_at FROM cache WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_make_key_separates_parts():
+    assert make_key("ab", "c") != make_key("a", "bc")
+    assert make_key(b"x", "y") == make_key("x", b"y")
+
+
+def test_normalize_markdown():
+    assert normalize_markdown("  a   b \n\n c\t d ") == "a b\nc d"
+
+
+def test_memory_and_disk_hits(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = ResultCache(path)
+    first.set("vlm", "k", {"text": "value"})
+    assert first.get("vlm", "k") == {"text": "value"}
+    first.close()
+
+    second = ResultCache(path)
+    assert second.get("vlm", "k") == {"text": "value"}
+    assert second.get("vlm", "k") == {"text": "value"}
+    assert second.get("vlm", "missing") is None
+    assert second.stats()["namespaces"]["vlm"] == {"memory_hits": 1, "disk_hits": 1, "misses": 1}
+    second.close()
+
+
+def test_access_times_are_written_in_batches(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    writer = ResultCache(path, memory_entries=0)
+    for key in "abc":
+        writer.set("vlm", key, key.upper())
+    written = accessed_at(path, "a")
+
+    monkeypatch.setattr(cache, "TOUCH_FLUSH_ENTRIES", 3)
+    assert writer.get("vlm", "a") == "A"
+    assert writer.get("vlm", "b") == "B"
+    assert accessed_at(path, "a") == written
+    assert writer.get("vlm", "c") == "C"
+    assert accessed_at(path, "a") > written
+    writer.close()
+
+
+def test_eviction_uses_pending_access_times(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    store = ResultCache(path, memory_entries=0, max_disk_bytes=10)
+    store.set("vlm", "old", "xxx")
+    store.set("vlm", "new", "yyy")
+    # Only recorded in memory, but must count when the next set evicts
+    assert store.get("vlm", "old") == "xxx"
+    store.set("vlm", "third", "zzz")
+    assert store.get("vlm", "old") == "xxx"
+    assert store.get("vlm", "new") is None
+    store.close()
+
+
+def test_async_access(tmp_path):
+    async def scenario():
+        store = ResultCache(str(tmp_path / "cache.sqlite3"))
+        await store.aset("llm", "k", [1, 2])
+        assert await store.aget("llm", "k") == [1, 2]
+        assert await store.aget("llm", "other") is None
+        store.close()
+
+    asyncio.run(scenario())
+
+
+def test_memory_hits_do_not_wait_for_sqlite(tmp_path):
+    store = ResultCache(str(tmp_path / "cache.sqlite3"))
+    store.set("vlm", "k", "value")
+    # As if a set were writing to SQLite in a worker thread
+    with store._lock:
+        assert asyncio.run(store.aget("vlm", "k")) == "value"
+    store.close()
+
+
+def test_disk_size_is_a_running_total(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+
+    def summed():
+        with sqlite3.connect(path) as db:
+            return db.execute("SELECT SUM(size) FROM cache").fetchone()[0]
+
+    store = ResultCache(path, memory_entries=0, max_disk_bytes=20)
+    store.set("vlm", "a", "xxxx")
+    store.set("vlm", "a", "xxxxxxxx")
+    store.set("vlm", "b", "yyyy")
+    assert store.stats()["disk_bytes"] == summed() == 16
+    store.set("vlm", "c", "zzzz")
+    assert store.stats()["disk_bytes"] == summed() <= 20
+    assert store.get("vlm", "a") is None
+    store.close()
+    assert ResultCache(path).stats()["disk_bytes"] == summed()
@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import httpx
+
+from continuation import append_continuation, is_truncated
+from rendering import RenderedPage
+
+
+def test_is_truncated():
+    assert is_truncated("complete text", "length")
+    assert not is_truncated("complete text", "stop")
+    assert is_truncated("| 1 | Item | 10", "stop")
+    assert not is_truncated("| 1 | Item | 10 |\n", "stop")
+    assert is_truncated("```json\n{", "stop")
+    assert not is_truncated("```json\n{}\n```", None)
+    assert not is_truncated("", None)
+
+
+def test_append_continuation_after_empty_answer():
+    assert append_continuation("", "abc\ndef") == "abc\ndef"
+    assert append_continuation(" \n", "abc") == "abc"
+    assert append_continuation("abc", "  ") == "abc"
+
+
+def test_append_continuation_restarted_line():
+    previous = "| STT | Tên |\n|---|---|\n| 1 | Dịch vụ m"
+    continuation = "| 1 | Dịch vụ mẫu |\n| 2 | Phí |"
+    assert append_continuation(previous, continuation) == (
+        "| STT | Tên |\n|---|---|\n| 1 | Dịch vụ mẫu |\n| 2 | Phí |"
+    )
+
+
+def test_append_continuation_repeated_lines():
+    previous = "first line\nsecond line\nthird line\n"
+    continuation = "second line\nthird line\nfourth line"
+    assert append_continuation(previous, continuation) == (
+        "first line\nsecond line\nthird line\nfourth line"
+    )
+
+
+def test_append_continuation_mid_line():
+    assert append_continuation("Tổng cộng tiền thanh", " toán: 110.000") == (
+        "Tổng cộng tiền thanh toán: 110.000"
+    )
+
+
+def vlm_main(monkeypatch, tmp_path, answers):
+    """main with a mock VLM giving `answers` in turn, a fresh budget and cache"""
+    import main
+    from cache import ResultCache
+    from continuation import TokenBudget
+    from upstream import UpstreamClient
+
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        content, finish_reason, tokens = answers[len(requests) - 1]
+        return httpx.Response(
+            200,
+            json={
+                "choices": [{"message": {"content": content}, "finish_reason": finish_reason}],
+                "usage": {"completion_tokens": tokens},
+            },
+        )
+
+    client = UpstreamClient("http://upstream/v1/chat/completions", "key")
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "upstream_client", client)
+    monkeypatch.setattr(main, "vlm_budget", TokenBudget(min_tokens=100, max_tokens=1000))
+    monkeypatch.setattr(main, "result_cache", ResultCache(str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(main.settings, "VLM_MAX_CONTINUATIONS", 1)
+    return main, requests
+
+
+def cache_key(main, page: RenderedPage) -> str:
+    return main.make_key(page.image, main.VLM_MODEL, main.VLM_PROMPT, main.VLM_SYSTEM_PROMPT)
+
+
+def test_truncated_answer_is_continued_without_refining_the_budget(monkeypatch, tmp_path):
+    answers = [("| 1 | Dịch vụ m", "length", 100), ("| 1 | Dịch vụ mẫu |", "stop", 30)]
+    main, requests = vlm_main(monkeypatch, tmp_path, answers)
+    ratio = main.vlm_budget.tokens_per_ink_area
+
+    page = RenderedPage(index=0, image=b"page", ink_area=10_000.0)
+    assert asyncio.run(main.extract_page_markdown(page)) == "| 1 | Dịch vụ mẫu |"
+    # The continuation sends the partial answer after the page image
+    assert [message["role"] for message in requests[1]["messages"]] == [
+        "user",
+        "assistant",
+        "user",
+    ]
+    assert main.vlm_budget.tokens_per_ink_area == ratio
+    assert "truncated" not in page.meta
+    assert main.result_cache.get("vlm", cache_key(main, page)) == "| 1 | Dịch vụ mẫu |"
+    main.result_cache.close()
+
+
+def test_complete_first_answer_refines_the_budget(monkeypatch, tmp_path):
+    main, _ = vlm_main(monkeypatch, tmp_path, [("Tổng cộng: 110.000", "stop", 2000)])
+    ratio = main.vlm_budget.tokens_per_ink_area
+
+    page = RenderedPage(index=0, image=b"page", ink_area=10_000.0)
+    asyncio.run(main.extract_page_markdown(page))
+    assert main.vlm_budget.tokens_per_ink_area == 0.9 * ratio + 0.1 * 2000 / 10_000
+    main.result_cache.close()
+
+
+def test_answer_still_truncated_is_not_cached(monkeypatch, tmp_path):
+    answers = [("| 1 | Dịch", "length", 100), (" vụ", "length", 50)]
+    main, requests = vlm_main(monkeypatch, tmp_path, answers)
+
+    page = RenderedPage(index=0, image=b"page", ink_area=10_000.0)
+    assert asyncio.run(main.extract_page_markdown(page)) == "| 1 | Dịch vụ"
+    assert len(requests) == 2
+    assert page.meta["truncated"] is True
+    assert main.result_cache.get("vlm", cache_key(main, page)) is None
+    assert not main.is_complete([{"content": "| 1 | Dịch vụ", "parsed_json": {}, **page.meta}])
+    main.result_cache.close()
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from starlette.requests import ClientDisconnect, Request
+
+from disconnect import cancel_on_disconnect
+
+
+def request_until(disconnected: asyncio.Event) -> Request:
+    """Request whose body is already read; the client leaves once the event is set"""
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    return Request({"type": "http", "method": "POST", "headers": []}, receive)
+
+
+def test_result_is_returned_while_the_client_stays():
+    async def work():
+        await asyncio.sleep(0.01)
+        return {"success": True}
+
+    async def scenario():
+        return await cancel_on_disconnect(request_until(asyncio.Event()), work())
+
+    assert asyncio.run(scenario()) == {"success": True}
+
+
+def test_errors_from_the_work_propagate():
+    async def work():
+        raise ValueError("broken PDF")
+
+    async def scenario():
+        await cancel_on_disconnect(request_until(asyncio.Event()), work())
+
+    with pytest.raises(ValueError, match="broken PDF"):
+        asyncio.run(scenario())
+
+
+def test_disconnect_cancels_the_work_and_lets_it_unwind():
+    events = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # Cleanup that itself awaits still runs before the caller resumes
+            await asyncio.sleep(0.01)
+            events.append("unwound")
+            raise
+
+    async def scenario():
+        disconnected = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.01, disconnected.set)
+        with pytest.raises(ClientDisconnect):
+            await cancel_on_disconnect(request_until(disconnected), work())
+        events.append("raised")
+
+    asyncio.run(scenario())
+    assert events == ["unwound", "raised"]
+
+
+def test_cancelling_the_caller_cancels_the_work():
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        call = asyncio.ensure_future(cancel_on_disconnect(request_until(asyncio.Event()), work()))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert cancelled == [True]
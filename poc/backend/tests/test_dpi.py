@@ -0,0 +1,26 @@
+import fitz
+from PIL import Image
+
+from dpi import DpiPolicy, scan_native_scale
+
+
+def scanned_page(dpi: int) -> fitz.Page:
+    """A4 page covered by a blank scan at `dpi`"""
+    document = fitz.open()
+    page = document.new_page(width=595, height=842)
+    width, height = round(595 / 72 * dpi), round(842 / 72 * dpi)
+    image = Image.new("L", (width, height), 255)
+    page.insert_image(page.rect, pixmap=fitz.Pixmap(fitz.csGRAY, width, height, image.tobytes(), 0))
+    return page
+
+
+def test_scan_native_scale():
+    assert abs(scan_native_scale(scanned_page(300)) - 300 / 72) < 0.01
+    assert scan_native_scale(fitz.open().new_page()) == 0.0
+
+
+def test_scans_never_render_above_the_target_scale():
+    policy = DpiPolicy(min_scale=1.0, max_scale=3.0, default_scale=2.0)
+    assert policy.choose_scale(scanned_page(300)) == 2.0
+    # Low resolution scans are not upsampled beyond their native resolution
+    assert abs(policy.choose_scale(scanned_page(100)) - 100 / 72) < 0.01
@@ -0,0 +1,63 @@
+import io
+
+import fitz
+from PIL import Image, ImageDraw
+
+from encoding import (
+    PNG,
+    EncodingOptions,
+    encode_image,
+    encode_page_image,
+    encode_pixmap,
+    fit_scale,
+    luminance_psnr,
+)
+
+
+def text_image() -> Image.Image:
+    image = Image.new("RGB", (600, 400), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(12):
+        draw.text((20, 20 + row * 30), f"Invoice line {row}: 1.250.000 VND", fill="black")
+    return image
+
+
+def test_fit_scale_caps_pixels():
+    rect = fitz.Rect(0, 0, 600, 800)
+    assert fit_scale(rect, 2.0, 0) == 2.0
+    assert fit_scale(rect, 1.0, 10_000_000) == 1.0
+    scale = fit_scale(rect, 2.0, 480_000)
+    assert abs(600 * 800 * scale * scale - 480_000) < 1
+
+
+def test_luminance_psnr():
+    image = text_image()
+    lossless, _ = encode_image(image, PNG)
+    lossy, _ = encode_image(image, EncodingOptions(format="jpeg", quality=10))
+    assert luminance_psnr(image, lossless) == float("inf")
+    assert 0 < luminance_psnr(image, lossy) < 40
+
+
+def test_auto_picks_the_smallest_candidate_meeting_the_target():
+    image = text_image()
+    target = 30.0
+    auto = EncodingOptions(format="auto", fidelity_psnr=target)
+    data, mime, used = encode_page_image(image, auto)
+    assert used.format != "auto" and mime.startswith("image/")
+    assert luminance_psnr(image, data) >= target
+    # Never larger than the lossless greyscale fallback candidate
+    gray_png, _ = encode_image(image, EncodingOptions(format="png", grayscale=True))
+    assert len(data) <= len(gray_png)
+
+    # A stricter target can only keep or grow the output
+    strict, _, _ = encode_page_image(image, EncodingOptions(format="auto", fidelity_psnr=60.0))
+    assert len(strict) >= len(data)
+
+
+def test_plain_png_comes_straight_from_fitz():
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 16), False)
+    pix.clear_with(255)
+    data, mime, used = encode_pixmap(pix)
+    assert (mime, used) == ("image/png", PNG)
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    assert Image.open(io.BytesIO(data)).size == (32, 16)
@@ -0,0 +1,76 @@
+import asyncio
+
+from grouping import (
+    InvoiceGrouper,
+    PageMarkers,
+    merge_invoice_pages,
+    page_markers,
+    starts_new_invoice,
+)
+from mock_upstream import MOCK_MARKDOWN
+
+
+def markers(title=False, key=None, page_of=None, continuation=False):
+    return PageMarkers(title=title, key=key, page_of=page_of, continuation=continuation)
+
+
+def test_page_markers():
+    found = page_markers(MOCK_MARKDOWN + "\nTrang 1/2")
+    assert found.title
+    assert found.key == ("1C24TAA", "0000123")
+    assert found.page_of == (1, 2)
+    assert not found.continuation
+
+    found = page_markers("| 2 | Hàng hóa | Cái | 1 | 10 | 10 |\n(tiếp theo)")
+    assert not found.title
+    assert found.key is None
+    assert found.continuation
+
+
+def test_starts_new_invoice():
+    first = markers(title=True, key=("1C24TAA", "1"))
+    assert starts_new_invoice(first, [])
+    # Page numbering wins over everything else
+    assert starts_new_invoice(markers(page_of=(1, 2), continuation=True), [first])
+    assert not starts_new_invoice(markers(title=True, page_of=(2, 2)), [first])
+    assert not starts_new_invoice(markers(continuation=True), [first])
+    # A repeated header continues the invoice, another key starts a new one
+    assert not starts_new_invoice(markers(title=True, key=("1C24TAA", "1")), [first])
+    assert starts_new_invoice(markers(title=True, key=("1C24TAA", "2")), [first])
+    # Without keys, a second title page is a second invoice
+    assert starts_new_invoice(markers(title=True), [markers(title=True)])
+    assert not starts_new_invoice(markers(), [markers(title=True)])
+
+
+def test_merge_invoice_pages_joins_item_tables():
+    header = "| STT | Tên hàng hóa | Số lượng | Đơn giá | Thành tiền |\n|---|---|---|---|---|"
+    page1 = f"HÓA ĐƠN\n\n{header}\n| 1 | A | 1 | 10 | 10 |"
+    page2 = f"(tiếp theo)\n\n{header}\n| 2 | B | 2 | 10 | 20 |\n\nCộng tiền hàng: 30"
+    merged = merge_invoice_pages([page1, page2])
+    assert merged.count("Thành tiền") == 1
+    assert "| 1 | A | 1 | 10 | 10 |\n| 2 | B | 2 | 10 | 20 |" in merged
+    assert merged.endswith("Cộng tiền hàng: 30")
+
+
+def test_grouper_lists_duplicate_pages_with_their_invoice():
+    async def structure(markdown_text):
+        return {"length": len(markdown_text)}
+
+    async def scenario():
+        emitted = []
+        grouper = InvoiceGrouper(structure, on_result=emitted.append)
+        second = MOCK_MARKDOWN.replace("0000123", "0000124")
+        await grouper.add({"page": 2, "content": second})
+        await grouper.add({"page": 1, "content": MOCK_MARKDOWN})
+        await grouper.add(
+            {"page": 3, "content": "", "page_check": {"decision": "duplicate", "duplicate_of": 1}}
+        )
+        await grouper.add({"page": 4, "content": "", "page_check": {"decision": "blank"}})
+        invoices = await grouper.finish()
+        return invoices, {page["page"]: page for page in emitted}
+
+    invoices, pages = asyncio.run(scenario())
+    assert [invoice["pages"] for invoice in invoices] == [[1, 3], [2]]
+    assert pages[3]["invoice"] == 1
+    assert pages[3]["parsed_json"] == pages[1]["parsed_json"]
+    assert pages[4]["invoice"] is None
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from hedging import Hedger, LatencyTracker
+
+
+def warmed_up(latency: float = 0.01, credit: float = 1.0, **kwargs) -> Hedger:
+    """Hedger that already measured enough calls of model "m" to hedge"""
+    hedger = Hedger(min_samples=20, **kwargs)
+    state = hedger._state("m")
+    state.latency.samples.extend([latency] * 20)
+    state.credit = credit
+    return hedger
+
+
+def calls_taking(*durations: float, results=None):
+    """A call whose n-th invocation takes durations[n]; records cancellations"""
+    started, cancelled = [], []
+
+    async def call():
+        attempt = len(started)
+        started.append(attempt)
+        try:
+            await asyncio.sleep(durations[attempt])
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        result = results[attempt] if results else attempt
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return call, started, cancelled
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile(0.95) is None
+    for latency in range(1, 101):
+        tracker.record(latency / 100)
+    assert tracker.percentile(0.5) == 0.51
+    assert tracker.percentile(0.95) == 0.96
+    # Only the most recent window counts
+    tracker.record(5.0)
+    assert tracker.percentile(1.0) == 5.0 and len(tracker.samples) == 100
+
+
+def test_no_hedge_before_enough_samples():
+    hedger = Hedger(min_samples=20)
+    call, started, _ = calls_taking(0.05)
+    assert asyncio.run(hedger.run("m", call)) == 0
+    assert started == [0] and hedger.hedge_delay("m") is None
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled():
+    hedger = warmed_up()
+    call, started, cancelled = calls_taking(1.0, 0.01)
+    assert asyncio.run(hedger.run("m", call)) == 1
+    assert started == [0, 1] and cancelled == [0]
+    counters = hedger.metrics()["m"]
+    assert counters["hedged"] == 1 and counters["hedge_wins"] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = warmed_up(latency=0.5)
+    call, started, _ = calls_taking(0.01)
+    assert asyncio.run(hedger.run("m", call)) == 0
+    assert started == [0] and hedger.metrics()["m"]["hedged"] == 0
+
+
+def test_hedges_are_limited_by_credit_and_capacity():
+    hedger = warmed_up(credit=0.0)
+    call, started, _ = calls_taking(0.05)
+    assert asyncio.run(hedger.run("m", call)) == 0
+    assert started == [0] and hedger.metrics()["m"]["skipped_budget"] == 1
+
+    hedger = warmed_up()
+    call, started, _ = calls_taking(0.05)
+    assert asyncio.run(hedger.run("m", call, is_busy=lambda: True)) == 0
+    assert started == [0] and hedger.metrics()["m"]["skipped_busy"] == 1
+
+
+def test_failed_hedge_falls_back_to_the_primary():
+    hedger = warmed_up()
+    call, _, _ = calls_taking(0.1, 0.01, results=["primary", ValueError("hedge failed")])
+    assert asyncio.run(hedger.run("m", call)) == "primary"
+    assert hedger.metrics()["m"]["hedge_wins"] == 0
+
+
+def test_both_failing_raises_the_last_error():
+    hedger = warmed_up()
+    call, _, _ = calls_taking(
+        0.1, 0.01, results=[ValueError("primary failed"), ValueError("hedge failed")]
+    )
+    with pytest.raises(ValueError, match="primary failed"):
+        asyncio.run(hedger.run("m", call))
+
+
+def test_cancelling_the_caller_cancels_both_calls():
+    hedger = warmed_up()
+    call, started, cancelled = calls_taking(10.0, 10.0)
+
+    async def scenario():
+        run = asyncio.ensure_future(hedger.run("m", call))
+        while len(started) < 2:
+            await asyncio.sleep(0.01)
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert sorted(cancelled) == [0, 1]
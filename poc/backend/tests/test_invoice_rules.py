@@ -0,0 +1,73 @@
+from invoice_rules import (
+    RuleExtractorPolicy,
+    extract_invoice,
+    normalize_date,
+    parse_number,
+    reconcile_totals,
+)
+from mock_upstream import MOCK_MARKDOWN
+
+
+def test_parse_number():
+    assert parse_number("256.050") == "256050"
+    assert parse_number("1.234.567 đ") == "1234567"
+    assert parse_number("1,5") == "1.5"
+    assert parse_number("1.234,50") == "1234.5"
+    assert parse_number("1,234.50") == "1234.5"
+    assert parse_number("-10.000") == "-10000"
+    assert parse_number("12.34.5") is None
+    assert parse_number("abc") is None
+    assert parse_number("") is None
+
+
+def test_normalize_date():
+    assert normalize_date("Ngày 5 tháng 3 năm 2024") == "05/03/2024"
+    assert normalize_date("05-03-2024") == "05/03/2024"
+    assert normalize_date("32/01/2024") is None
+    assert normalize_date("no date") is None
+
+
+def test_extract_standard_invoice():
+    extraction = extract_invoice(MOCK_MARKDOWN)
+    data = extraction.data
+    assert data["invoice"]["serial"] == "1C24TAA"
+    assert data["invoice"]["number"] == "0000123"
+    assert data["invoice"]["date"] == "05/03/2024"
+    assert data["seller"]["tax_code"] == "0101234567"
+    assert data["buyer"]["tax_code"] == "0309876543"
+    assert data["items"] == [
+        {
+            "stt": "1",
+            "name": "Dịch vụ mẫu",
+            "unit": "Gói",
+            "quantity": "1",
+            "unit_price": "100000",
+            "amount": "100000",
+        }
+    ]
+    assert data["totals"]["total"] == "110000"
+    assert data["totals"]["vat_rate"] == "10%"
+    assert extraction.reconciled
+    assert extraction.confidence["items"] >= 0.9
+
+
+def test_malformed_values_get_low_confidence():
+    extraction = extract_invoice("Mã số thuế: không rõ\nKý hiệu: ???")
+    assert extraction.confidence["seller.tax_code"] < 0.5
+    assert extraction.confidence["invoice.serial"] < 0.5
+
+
+def test_reconcile_totals_detects_mismatch():
+    data = extract_invoice(MOCK_MARKDOWN).data
+    assert reconcile_totals(data)
+    data["totals"]["total"] = "120000"
+    assert not reconcile_totals(data)
+
+
+def test_policy_asks_for_llm_when_fields_are_missing():
+    policy = RuleExtractorPolicy()
+    _, reasons = policy.evaluate(MOCK_MARKDOWN)
+    assert reasons == []
+    without_total = MOCK_MARKDOWN.replace("Tổng cộng tiền thanh toán: 110.000\n", "")
+    _, reasons = policy.evaluate(without_total)
+    assert "missing totals.total" in reasons
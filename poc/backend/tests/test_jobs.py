@@ -0,0 +1,170 @@
+import asyncio
+import threading
+
+import pytest
+
+from job_store import InMemoryJobStore, create_job_store, new_job
+from jobs import JobManager
+from uploads import UploadSpool
+
+
+@pytest.fixture(params=["memory", "sql"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryJobStore()
+    pytest.importorskip("sqlalchemy")
+    return create_job_store(f"sqlite:///{tmp_path / 'jobs.sqlite3'}")
+
+
+def upload_for(tmp_path) -> UploadSpool:
+    upload = UploadSpool("a.pdf", 1024, str(tmp_path))
+    upload.write(b"%PDF-1.7\n")
+    upload.finish()
+    return upload
+
+
+async def wait_for(manager: JobManager, job_id: str, *statuses: str) -> dict:
+    for _ in range(500):
+        job = await manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job stayed {job['status']}")
+
+
+def test_update_job_only_in_the_expected_status(store):
+    store.create_job(new_job("j1", "a.pdf"))
+    assert store.update_job("j1", {"status": "cancelled"}, ("queued",))["status"] == "cancelled"
+    # The worker lost the race: the job must not become running
+    assert store.update_job("j1", {"status": "running"}, ("queued",)) is None
+    assert store.get_job("j1")["status"] == "cancelled"
+    assert store.update_job("missing", {"status": "running"}) is None
+
+
+def test_job_runs_and_stores_pages_and_invoices(store, tmp_path):
+    async def process(upload, on_page):
+        await on_page({"page": 1, "success": True, "content": "# Page 1"})
+        return {
+            "total_pages": 1,
+            "results": [],
+            "total_invoices": 1,
+            "invoices": [{"pages": [1], "fields": {"invoice_number": "0001234"}}],
+        }
+
+    async def scenario():
+        manager = JobManager(store, process, workers=1)
+        manager.start()
+        try:
+            job = await manager.submit(upload_for(tmp_path))
+            return await wait_for(manager, job["job_id"], "succeeded", "failed")
+        finally:
+            await manager.stop()
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "succeeded" and job["total_pages"] == 1
+    assert job["completed_pages"] == 1 and job["results"][0]["content"] == "# Page 1"
+    assert job["total_invoices"] == 1
+    assert job["invoices"][0]["fields"]["invoice_number"] == "0001234"
+    assert list(tmp_path.glob("*.pdf")) == []
+
+
+def test_failed_job_records_the_error(store, tmp_path):
+    async def process(upload, on_page):
+        raise ValueError("broken PDF")
+
+    async def scenario():
+        manager = JobManager(store, process, workers=1)
+        manager.start()
+        try:
+            job = await manager.submit(upload_for(tmp_path))
+            return await wait_for(manager, job["job_id"], "succeeded", "failed")
+        finally:
+            await manager.stop()
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "failed" and job["error"] == "broken PDF"
+
+
+def test_cancelled_while_queued_never_runs(store, tmp_path):
+    ran = []
+
+    async def process(upload, on_page):
+        ran.append(upload.filename)
+        return {"total_pages": 0, "results": []}
+
+    async def scenario():
+        manager = JobManager(store, process, workers=1)
+        job = await manager.submit(upload_for(tmp_path))
+        cancelled = await manager.cancel(job["job_id"])
+        # Picked up only after the cancellation
+        manager.start()
+        await manager._queue.join()
+        await manager.stop()
+        return cancelled, await manager.get(job["job_id"])
+
+    cancelled, job = asyncio.run(scenario())
+    assert cancelled["status"] == "cancelled" and job["status"] == "cancelled"
+    assert ran == []
+
+
+class GatedStore(InMemoryJobStore):
+    """Holds the worker's switch to running until a cancellation has landed"""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = threading.Event()
+
+    def update_job(self, job_id, data, statuses=None):
+        if data["status"] == "running":
+            self.cancelled.wait(5)
+        job = super().update_job(job_id, data, statuses)
+        if data["status"] == "cancelled":
+            self.cancelled.set()
+        return job
+
+
+def test_cancel_races_the_worker_picking_the_job_up(tmp_path):
+    ran = []
+
+    async def process(upload, on_page):
+        ran.append(upload.filename)
+        return {"total_pages": 0, "results": []}
+
+    async def scenario():
+        manager = JobManager(GatedStore(), process, workers=1)
+        manager.start()
+        job = await manager.submit(upload_for(tmp_path))
+        # The worker has dequeued the job and is switching it to running
+        while not manager._running:
+            await asyncio.sleep(0.001)
+        cancelled = await manager.cancel(job["job_id"])
+        await manager._queue.join()
+        await manager.stop()
+        return cancelled, await manager.get(job["job_id"])
+
+    cancelled, job = asyncio.run(scenario())
+    assert cancelled["status"] == "cancelled" and job["status"] == "cancelled"
+    assert ran == []
+
+
+def test_cancel_running_job(store, tmp_path):
+    async def process(upload, on_page):
+        await on_page({"page": 1, "success": True, "content": "# Page 1"})
+        await asyncio.sleep(10)
+
+    async def scenario():
+        manager = JobManager(store, process, workers=1)
+        manager.start()
+        try:
+            job = await manager.submit(upload_for(tmp_path))
+            await wait_for(manager, job["job_id"], "running")
+            while not (await manager.get(job["job_id"]))["completed_pages"]:
+                await asyncio.sleep(0.01)
+            cancelling = await manager.cancel(job["job_id"])
+            return cancelling, await wait_for(manager, job["job_id"], "cancelled")
+        finally:
+            await manager.stop()
+
+    cancelling, job = asyncio.run(scenario())
+    assert cancelling["status"] == "cancelling"
+    assert job["finished_at"] is not None and job["completed_pages"] == 1
@@ -0,0 +1,62 @@
+from dataclasses import replace
+
+import fitz
+
+from pagecheck import DuplicateTracker, PageCheckPolicy
+from rendering import DEFAULT_RENDER_OPTIONS, render_page
+
+OPTIONS = replace(
+    DEFAULT_RENDER_OPTIONS,
+    dpi=None,
+    text_layer=None,
+    page_check=PageCheckPolicy(duplicates=True),
+    preprocess=None,
+    tiling=None,
+)
+
+
+def invoice_document(numbers):
+    """One page per invoice number, all on the same template"""
+    document = fitz.open()
+    for number in numbers:
+        page = document.new_page(width=595, height=842)
+        page.insert_text((60, 80), "HOA DON GIA TRI GIA TANG", fontsize=16)
+        page.insert_text((60, 110), f"So: {number}", fontsize=10)
+        for row in range(20):
+            line = f"{row + 1}  Dich vu mau  1  100.000"
+            page.insert_text((60, 160 + row * 20), line, fontsize=10)
+        page.insert_text((60, 600), f"Tong cong: {number}0.000", fontsize=10)
+    return document
+
+
+def classify(document):
+    tracker = DuplicateTracker(OPTIONS.page_check)
+    pages = [render_page(page, OPTIONS) for page in document]
+    for page in pages:
+        tracker.classify(page)
+    return [page.meta["page_check"] for page in pages]
+
+
+def test_same_template_invoices_are_not_duplicates():
+    checks = classify(invoice_document(["0000123", "0000124", "0000128"]))
+    assert [check["decision"] for check in checks] == ["process"] * 3
+
+
+def test_identical_pages_are_duplicates():
+    checks = classify(invoice_document(["0000123", "0000124", "0000123"]))
+    assert [check["decision"] for check in checks] == ["process", "process", "duplicate"]
+    assert checks[2]["duplicate_of"] == 1
+
+
+def test_duplicates_are_off_by_default():
+    page = render_page(invoice_document(["1"])[0], replace(OPTIONS, page_check=PageCheckPolicy()))
+    assert page.pixel_digest is None
+    assert page.meta["page_check"]["decision"] == "process"
+
+
+def test_blank_pages():
+    document = fitz.open()
+    document.new_page()
+    page = render_page(document[0], OPTIONS)
+    assert page.meta["source"] == "blank"
+    assert page.image == b""
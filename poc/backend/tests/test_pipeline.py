@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from pipeline import PageExecutor, ParsedPage
+
+
+def test_results_are_in_page_order_and_failures_stay_local():
+    async def vlm_stage(page):
+        # Later pages finish first
+        await asyncio.sleep(0.01 * (5 - page))
+        if page == 2:
+            raise RuntimeError("upstream down")
+        return f"page {page}"
+
+    async def llm_stage(content):
+        return ParsedPage({"text": content}, {"extraction": "rules"})
+
+    executor = PageExecutor(vlm_stage, llm_stage, max_inflight_pages=5)
+    results = asyncio.run(executor.run(range(5)))
+
+    assert [result["page"] for result in results] == [1, 2, 3, 4, 5]
+    assert results[0] == {
+        "page": 1,
+        "content": "page 0",
+        "parsed_json": {"text": "page 0"},
+        "extraction": "rules",
+    }
+    assert results[2]["error"] == "upstream down" and results[2]["parsed_json"] is None
+    assert "error" not in results[3]
+
+
+def test_pages_are_pulled_only_when_a_slot_is_free():
+    async def scenario():
+        pulled, done = [], []
+
+        async def pages():
+            for page in range(6):
+                pulled.append(page)
+                # The source never runs ahead of the in-flight limit
+                assert len(pulled) - len(done) <= 2
+                yield page
+
+        async def vlm_stage(page):
+            await asyncio.sleep(0.01)
+            done.append(page)
+            return ""
+
+        await PageExecutor(vlm_stage, None, max_inflight_pages=2).run(pages())
+        return pulled
+
+    assert asyncio.run(scenario()) == list(range(6))
+
+
+def test_shared_slots_bound_several_documents():
+    async def scenario():
+        slots = asyncio.Semaphore(3)
+        inflight, peak = [0], [0]
+
+        async def vlm_stage(page):
+            inflight[0] += 1
+            peak[0] = max(peak[0], inflight[0])
+            await asyncio.sleep(0.01)
+            inflight[0] -= 1
+            return ""
+
+        executors = [PageExecutor(vlm_stage, None, slots=slots) for _ in range(4)]
+        await asyncio.gather(*(executor.run(range(4)) for executor in executors))
+        return peak[0]
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_cancelling_the_run_cancels_pages_in_flight():
+    async def scenario():
+        started = asyncio.Event()
+
+        async def vlm_stage(page):
+            started.set()
+            await asyncio.sleep(10)
+            return ""
+
+        executor = PageExecutor(vlm_stage, None, max_inflight_pages=3)
+        run = asyncio.ensure_future(executor.run(range(5)))
+        await started.wait()
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+        return executor.cancelled_pages
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_on_result_sees_pages_as_they_complete():
+    seen = []
+
+    async def vlm_stage(page):
+        await asyncio.sleep(0.01 * (3 - page))
+        return str(page)
+
+    async def on_result(result):
+        seen.append(result["page"])
+
+    asyncio.run(PageExecutor(vlm_stage, None, max_inflight_pages=3).run(range(3), on_result))
+    assert seen == [3, 2, 1]
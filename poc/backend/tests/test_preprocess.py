@@ -0,0 +1,63 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from encoding import image_to_pixmap
+from preprocess import PreprocessOptions, estimate_skew, otsu_threshold, preprocess_pixmap
+
+
+def text_lines(size=(1200, 1600), box=(200, 300, 1000, 1100)) -> Image.Image:
+    """Page with text-like lines (dashes of ink) inside `box`, white elsewhere"""
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    x0, y0, x1, y1 = box
+    for y in range(y0, y1, 40):
+        for x in range(x0, x1, 60):
+            draw.rectangle((x, y, x + 45, y + 12), fill=20)
+    return image
+
+
+def test_estimate_skew_finds_the_rotation():
+    # Rotated clockwise: lines run down to the right
+    skewed = text_lines().rotate(-2.0, resample=Image.BILINEAR, fillcolor=255)
+    assert abs(estimate_skew(np.asarray(skewed), 5.0) - 2.0) < 0.3
+    assert abs(estimate_skew(np.asarray(text_lines()), 5.0)) < 0.2
+    assert estimate_skew(np.full((100, 100), 255, np.uint8), 5.0) == 0.0
+
+
+def test_margins_are_cropped_to_the_content():
+    # Ink spans x 200-1025 and y 300-1072
+    pix = image_to_pixmap(text_lines())
+    image, report = preprocess_pixmap(pix, PreprocessOptions(deskew=False, margin_px=10))
+    x0, y0, x1, y1 = report["crop"]
+    assert 185 <= x0 <= 195 and 285 <= y0 <= 295
+    assert 1030 <= x1 <= 1040 and 1078 <= y1 <= 1088
+    assert image.size == (x1 - x0, y1 - y0)
+    assert report["pixel_ratio"] < 0.5
+
+
+def test_full_page_content_is_not_cropped():
+    full = text_lines(size=(800, 800), box=(0, 0, 800, 800))
+    pix = image_to_pixmap(full)
+    image, report = preprocess_pixmap(pix, PreprocessOptions(deskew=False))
+    assert report["crop"] is None and image.size == (800, 800)
+    # Uncropped, the image still wraps the pixmap samples: drop it first
+    del image
+
+
+def test_deskewed_page_comes_out_straight():
+    skewed = text_lines().rotate(-2.0, resample=Image.BILINEAR, fillcolor=255)
+    pix = image_to_pixmap(skewed)
+    image, report = preprocess_pixmap(pix, PreprocessOptions())
+    assert abs(report["skew_degrees"] - 2.0) < 0.3
+    assert abs(estimate_skew(np.asarray(image.convert("L")), 5.0)) < 0.3
+
+
+def test_binarize_uses_the_otsu_threshold():
+    gray = np.array([30] * 500 + [220] * 1500, np.uint8)
+    assert 30 <= otsu_threshold(gray) < 220
+
+    options = PreprocessOptions(deskew=False, crop_margins=False, binarize=True)
+    pix = image_to_pixmap(text_lines())
+    image, report = preprocess_pixmap(pix, options)
+    assert image.mode == "L" and set(np.unique(np.asarray(image))) <= {0, 255}
+    assert 20 <= report["threshold"] < 255
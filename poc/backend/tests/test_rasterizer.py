@@ -0,0 +1,98 @@
+import asyncio
+
+import fitz
+import pytest
+
+from rasterizer import RasterPool, count_pages, render_page_range
+from rendering import RenderError, iter_rendered_pages
+
+
+def pdf_bytes(pages: int) -> bytes:
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f"Page {number + 1}")
+    return document.tobytes()
+
+
+@pytest.fixture
+def pool():
+    pool = RasterPool(max_workers=1, chunk_pages=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_failed_open_does_not_break_the_previous_document(pool):
+    good, bad = pdf_bytes(5), b"%PDF-1.7 not really a pdf"
+    # One worker: the bad document opens between two tasks of the good one
+    assert pool.submit(count_pages, "good", good).result() == 5
+    with pytest.raises(RenderError):
+        pool.submit(count_pages, "bad", bad).result()
+    pages = pool.submit(render_page_range, "good", good, 0, 5).result()
+    assert [page.index for page in pages] == [0, 1, 2, 3, 4]
+
+
+def test_render_document_between_broken_documents(pool):
+    good = pdf_bytes(3)
+    for _ in range(2):
+        assert len(pool.render_document(good)) == 3
+        with pytest.raises(RenderError) as error:
+            pool.render_document(b"garbage")
+        assert error.value.reason == "error"
+    metrics = pool.metrics()
+    assert metrics["failed_documents"] == 2
+    assert metrics["workers_started"] == 1
+
+
+def test_sources_are_sent_once_per_worker(pool):
+    first, second = pdf_bytes(4), pdf_bytes(3)
+    # Interleaved documents stay open in the worker: later tasks carry no source
+    assert pool.submit(count_pages, "first", first).result() == 4
+    assert pool.submit(count_pages, "second", second).result() == 3
+    assert len(pool.submit(render_page_range, "first", None, 0, 4).result()) == 4
+    assert len(pool.submit(render_page_range, "second", None, 0, 3).result()) == 3
+    assert pool.metrics()["workers_started"] == 1
+
+    # A document the worker never received is an error, not a crash
+    with pytest.raises(RenderError) as error:
+        pool.submit(count_pages, "unknown", None).result()
+    assert "was not sent" in str(error.value)
+
+
+def test_skipped_pages_are_not_rendered(pool):
+    source, skip = pdf_bytes(7), {0, 3, 4}
+
+    async def render() -> list:
+        return [page.index async for page in pool.aiter_pages(source, skip=skip)]
+
+    assert list(pool._page_ranges(7, skip)) == [(1, 3), (5, 7)]
+    assert asyncio.run(render()) == [1, 2, 5, 6]
+    assert [page.index for page in iter_rendered_pages(source, skip=skip)] == [1, 2, 5, 6]
+    assert asyncio.run(pool.page_count(source)) == 7
+
+
+def open_documents(cached) -> list:
+    """Worker task: ids of the documents the worker holds, besides the probe"""
+    import rasterizer
+
+    return [doc_id for doc_id in rasterizer._worker_documents if doc_id != "probe"]
+
+
+def test_finished_documents_are_closed_in_the_workers(pool):
+    source = pdf_bytes(6)
+
+    def held() -> list:
+        return pool.submit(open_documents, "probe", b"%PDF-1.7").result()
+
+    async def first_page_only():
+        pages = pool.aiter_pages(source)
+        await pages.__anext__()
+        # Cancelled with ranges rendered and in flight
+        await pages.aclose()
+
+    assert len(pool.render_document(source)) == 6
+    assert asyncio.run(pool.page_count(source)) == 6
+    asyncio.run(first_page_only())
+    # The forget messages are handled after the task running when they arrive
+    assert held() == []
+    assert held() == []
+    assert all(list(worker.loaded) == ["probe"] for worker in pool._workers)
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+from ratelimit import AIMDController, ModelLimiter, TokenBucket, estimate_tokens
+
+
+def test_estimate_tokens():
+    payload = {
+        "max_tokens": 100,
+        "messages": [
+            {"role": "system", "content": "x" * 30},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "y" * 30},
+                    {"type": "image_url", "image_url": {"url": "data:..."}},
+                ],
+            },
+        ],
+    }
+    assert estimate_tokens(payload, image_tokens=500) == 60 // 3 + 500 + 100
+
+
+def test_token_bucket_waits_for_refill():
+    async def scenario():
+        bucket = TokenBucket(per_minute=600)  # 10 tokens per second
+        started = time.monotonic()
+        await bucket.acquire(600)
+        assert time.monotonic() - started < 0.05
+        await bucket.acquire(2)
+        return time.monotonic() - started
+
+    assert 0.15 <= asyncio.run(scenario()) < 1.0
+
+
+def test_token_bucket_credit_and_drain():
+    bucket = TokenBucket(per_minute=60)
+    asyncio.run(bucket.acquire(50))
+    bucket.credit(20)
+    assert 29 < bucket.tokens <= 31
+    bucket.drain()
+    assert bucket.tokens < 1
+    assert TokenBucket(per_minute=0).snapshot()["per_minute"] is None
+
+
+def test_aimd_increase_and_decrease():
+    async def scenario():
+        controller = AIMDController(initial_limit=4, max_limit=8, decrease_factor=0.5)
+        for _ in range(4):
+            await controller.acquire()
+            controller.release("ok", 0.01)
+        assert controller.limit > 4.5
+        raised = controller.limit
+        await controller.acquire()
+        await controller.acquire()
+        controller.release("throttled", 0.01)
+        # A burst of failures only decreases the limit once per round trip
+        controller.release("error", 0.01)
+        assert controller.limit == raised * 0.5
+        assert controller.counters["decreases"] == 1
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_aimd_queues_beyond_limit():
+    async def scenario():
+        controller = AIMDController(initial_limit=1, max_limit=1)
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.queued == 1 and not waiter.done()
+        controller.release("cancelled", 0.0)
+        await waiter
+        assert controller.in_flight == 1
+
+        # A cancelled waiter leaves the queue without taking a slot
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.queued == 0 and controller.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_slot_gives_back_the_quota():
+    async def scenario():
+        controller = AIMDController(initial_limit=1, max_limit=1)
+        limiter = ModelLimiter("m", 600, 6000, controller)
+        async with limiter.slot(1000):
+            # Queued behind the running call, after both buckets were charged
+            waiter = asyncio.ensure_future(limiter.slot(1000).__aenter__())
+            await asyncio.sleep(0.01)
+            assert controller.queued == 1 and limiter.tokens.tokens < 4100
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert limiter.waiting == 0 and controller.queued == 0
+            return limiter.requests.tokens, limiter.tokens.tokens
+
+    requests, tokens = asyncio.run(scenario())
+    # Only the call that was sent keeps its quota
+    assert 599 <= requests < 600 and 5000 <= tokens < 5100
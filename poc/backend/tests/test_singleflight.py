@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def start(emit):
+            calls.append(1)
+            await emit("page 1")
+            await asyncio.sleep(0.01)
+            await emit("page 2")
+            return "result"
+
+        first_events, second_events = [], []
+        first = asyncio.ensure_future(flight.do("doc", start, first_events.append))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("doc", start, second_events.append))
+        results = await asyncio.gather(first, second)
+
+        assert results == ["result", "result"]
+        assert len(calls) == 1
+        # The late joiner first gets the events it missed
+        assert first_events == second_events == ["page 1", "page 2"]
+        assert flight.counters["started"] == 1 and flight.counters["joined"] == 1
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_exception_reaches_every_waiter():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def start(emit):
+            await asyncio.sleep(0.01)
+            raise ValueError("broken")
+
+        results = await asyncio.gather(
+            flight.do("doc", start), flight.do("doc", start), return_exceptions=True
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_detaches_and_last_one_cancels():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def start(emit):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.ensure_future(flight.do("doc", start))
+        second = asyncio.ensure_future(flight.do("doc", start))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.counters["cancelled"] == 1
+
+    asyncio.run(scenario())
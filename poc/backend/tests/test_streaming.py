@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from streaming import encode_event, stream_pipeline
+
+
+def collect(run, fmt: str = "ndjson") -> list:
+    async def scenario():
+        return [event async for event in stream_pipeline(run, fmt)]
+
+    return asyncio.run(scenario())
+
+
+def test_encode_event_framing():
+    data = {"page": 1, "content": "Hóa đơn"}
+    line = encode_event("page", data, "ndjson")
+    assert line.endswith("\n") and line.count("\n") == 1
+    assert json.loads(line) == {"event": "page", **data}
+    # Non-ASCII text is kept as is
+    assert "Hóa đơn" in line
+
+    message = encode_event("page", data, "sse")
+    assert message == f"event: page\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def test_pages_stream_as_they_complete_then_a_summary():
+    async def run(on_page):
+        await on_page({"page": 2, "success": True})
+        await on_page({"page": 1, "success": True})
+        return {
+            "success": True,
+            "total_pages": 2,
+            "results": [{"page": 1, "success": True}, {"page": 2, "success": True}],
+            "invoices": [{"invoice": 1, "pages": [1, 2], "fields": {}}],
+        }
+
+    events = [json.loads(line) for line in collect(run)]
+    # Completion order, and pages already sent are not repeated
+    assert [(event["event"], event.get("page")) for event in events] == [
+        ("page", 2),
+        ("page", 1),
+        ("summary", None),
+    ]
+    summary = events[-1]
+    assert summary["success"] and summary["total_pages"] == 2
+    assert summary["invoices"] == [{"invoice": 1, "pages": [1, 2]}]
+    assert set(summary["timings"]) == {"first_result_seconds", "total_seconds"}
+
+
+def test_cached_results_are_emitted_from_the_response():
+    async def run(on_page):
+        return {"success": True, "total_pages": 1, "results": [{"page": 1, "success": True}]}
+
+    messages = collect(run, "sse")
+    assert [message.split("\n", 1)[0] for message in messages] == [
+        "event: page",
+        "event: summary",
+    ]
+    assert all(message.endswith("\n\n") for message in messages)
+
+
+def test_failure_ends_the_stream_with_an_error_event():
+    async def run(on_page):
+        await on_page({"page": 1, "success": True})
+        raise ValueError("broken PDF")
+
+    events = [json.loads(line) for line in collect(run)]
+    assert [event["event"] for event in events] == ["page", "error"]
+    assert events[-1]["detail"] == "Error processing PDF: broken PDF"
+
+
+def test_closing_the_stream_cancels_the_pipeline():
+    cancelled = []
+
+    async def run(on_page):
+        await on_page({"page": 1, "success": True})
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        stream = stream_pipeline(run, "ndjson")
+        first = await stream.__anext__()
+        # The client went away after the first page
+        await stream.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert json.loads(asyncio.run(scenario()))["page"] == 1
+    assert cancelled == [True]
@@ -0,0 +1,55 @@
+import fitz
+
+from textlayer import TextLayerPolicy, page_to_markdown
+
+LINES = [f"Item {number}: consulting services, amount {number * 1000} VND" for number in range(20)]
+
+
+def text_page(document: fitz.Document) -> fitz.Page:
+    page = document.new_page()
+    page.insert_text((72, 72), "INVOICE No. 0001234", fontsize=14)
+    page.insert_text((72, 120), "\n".join(LINES), fontsize=10)
+    return page
+
+
+def scanned_page(document: fitz.Document) -> fitz.Page:
+    page = document.new_page()
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 200, 280), False)
+    pix.clear_with(200)
+    page.insert_image(page.rect, pixmap=pix)
+    return page
+
+
+def test_born_digital_page_is_reliable():
+    document = fitz.open()
+    reliable, metrics = TextLayerPolicy().classify(text_page(document))
+    assert reliable
+    assert metrics["glyphs"] >= 100 and metrics["image_ratio"] == 0
+
+
+def test_scanned_and_sparse_pages_go_to_the_vlm():
+    document = fitz.open()
+    reliable, metrics = TextLayerPolicy().classify(scanned_page(document))
+    assert not reliable and metrics["image_ratio"] > 0.9
+
+    page = document.new_page()
+    page.insert_text((72, 72), "Page 2")
+    assert not TextLayerPolicy().classify(page)[0]
+    # The thresholds are the policy's
+    assert TextLayerPolicy(min_glyphs=5, min_text_coverage=0.0).classify(page)[0]
+
+
+def test_page_to_markdown_keeps_reading_order():
+    document = fitz.open()
+    page = document.new_page()
+    page.insert_text((72, 300), "Total: 20.000 VND")
+    page.insert_text((72, 72), "INVOICE No. 0001234")
+    markdown = page_to_markdown(page)
+    assert markdown.split("\n###\n") == ["INVOICE No. 0001234", "Total: 20.000 VND"]
+
+
+def test_page_to_markdown_keeps_every_line():
+    document = fitz.open()
+    markdown = page_to_markdown(text_page(document))
+    assert "INVOICE No. 0001234" in markdown
+    assert all(line in markdown for line in LINES)
@@ -0,0 +1,57 @@
+from tiling import TilingPolicy, seam_overlap, stitch_markdown
+
+
+def test_plan_leaves_small_pages_whole():
+    assert TilingPolicy().plan(1200, 1600) == [(0, 0, 1200, 1600)]
+
+
+def test_plan_strips_overlap_and_cover_the_page():
+    policy = TilingPolicy(max_tile_height=1000, max_tile_pixels=10_000_000, overlap_px=50)
+    boxes = policy.plan(800, 2500)
+    assert len(boxes) == 3
+    assert boxes[0][1] == 0 and boxes[-1][3] == 2500
+    for upper, lower in zip(boxes, boxes[1:]):
+        assert upper[3] - lower[1] >= 50
+    assert all(box[3] - box[1] <= 1000 for box in boxes)
+
+
+def test_seam_overlap():
+    upper = ["Title", "line one", "line two", "li"]
+    lower = ["line two", "line three", "line four"]
+    # "li" is cut by the seam and read whole on the lower strip
+    assert seam_overlap(upper, lower) == (1, 1)
+    assert seam_overlap(["a b c"], ["x y z"]) == (0, 0)
+
+
+def test_seam_overlap_requires_exact_numbers():
+    upper = ["| 1 | Item | 10 |"]
+    lower = ["| 1 | Item | 11 |"]
+    assert seam_overlap(upper, lower) == (0, 0)
+
+
+def test_stitch_markdown_drops_repeated_lines():
+    parts = ["Header\nfirst line\nsecond line", "second line\nthird line"]
+    assert stitch_markdown(parts) == "Header\nfirst line\nsecond line\n\nthird line"
+
+
+def test_stitch_markdown_continues_tables_without_repeated_header():
+    upper = "| STT | Tên | Tiền |\n|---|---|---|\n| 1 | A | 10 |"
+    lower = "| STT | Tên | Tiền |\n|---|---|---|\n| 2 | B | 20 |"
+    assert stitch_markdown([upper, lower]) == upper + "\n| 2 | B | 20 |"
+
+
+def test_plan_never_exceeds_max_tiles():
+    policy = TilingPolicy()
+    for width, height in ((600, 20000), (640, 12000), (2000, 40000), (300, 100000)):
+        boxes = policy.plan(width, height)
+        assert len(boxes) <= policy.max_tiles
+        assert boxes[0][1] == 0 and boxes[-1][3] == height
+        for upper, lower in zip(boxes, boxes[1:]):
+            assert upper[3] - lower[1] >= policy.overlap_px
+
+
+def test_max_page_height_fits_in_max_tiles():
+    policy = TilingPolicy()
+    boxes = policy.plan(600, policy.max_page_height)
+    assert len(boxes) == policy.max_tiles
+    assert all(box[3] - box[1] <= policy.max_tile_height for box in boxes)
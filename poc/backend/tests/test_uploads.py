@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from uploads import (
+    UploadSpool,
+    detect_file_type,
+    receive_batch_upload,
+    receive_pdf_upload,
+)
+
+BOUNDARY = "test-boundary"
+PDF = b"%PDF-1.7\n" + b"x" * 5000
+
+
+def multipart(field: str, files: list) -> bytes:
+    body = b""
+    for filename, data in files:
+        body += (
+            f"--{BOUNDARY}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def request_for(body: bytes, chunk: int = 1024) -> Request:
+    chunks = [body[start : start + chunk] for start in range(0, len(body), chunk)]
+
+    async def receive():
+        data = chunks.pop(0) if chunks else b""
+        return {"type": "http.request", "body": data, "more_body": bool(chunks)}
+
+    headers = [
+        (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    return Request({"type": "http", "method": "POST", "headers": headers}, receive)
+
+
+def receive_pdf(body: bytes, directory, max_bytes=1024 * 1024, memory_limit=1024 * 1024):
+    return asyncio.run(
+        receive_pdf_upload(request_for(body), max_bytes, memory_limit, str(directory))
+    )
+
+
+def test_small_upload_stays_in_memory(tmp_path):
+    upload = receive_pdf(multipart("file", [("a.pdf", PDF)]), tmp_path)
+    assert upload.in_memory and upload.source == PDF
+    # The bytes are not copied per access
+    assert upload.source is upload.source
+    assert upload.sha256 == hashlib.sha256(PDF).hexdigest()
+    assert list(tmp_path.iterdir()) == []
+    upload.close()
+
+
+def test_large_upload_spills_to_a_temp_file(tmp_path):
+    upload = receive_pdf(multipart("file", [("a.pdf", PDF)]), tmp_path, memory_limit=1000)
+    assert not upload.in_memory
+    with open(upload.source, "rb") as spooled:
+        assert spooled.read() == PDF
+    # Shared by a second holder: the file outlives the first close
+    upload.retain()
+    upload.close()
+    assert os.path.exists(upload.path)
+    upload.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "files, max_bytes, status",
+    [
+        ([("a.txt", PDF)], 1024 * 1024, 400),
+        ([("a.pdf", b"not a pdf" * 200)], 1024 * 1024, 400),
+        ([("a.pdf", PDF), ("b.pdf", PDF)], 1024 * 1024, 400),
+        ([("a.pdf", PDF)], 2000, 413),
+    ],
+)
+def test_bad_uploads_are_rejected_and_cleaned_up(tmp_path, files, max_bytes, status):
+    with pytest.raises(HTTPException) as error:
+        receive_pdf(multipart("file", files), tmp_path, max_bytes=max_bytes, memory_limit=100)
+    assert error.value.status_code == status
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_batch_upload_limits(tmp_path):
+    files = [("a.pdf", PDF), ("big.pdf", PDF * 3), ("c.png", b"\x89PNG\r\n\x1a\n" + b"p" * 100)]
+
+    async def scenario(max_files: int, memory_limit: int):
+        request = request_for(multipart("files", files))
+        return await receive_batch_upload(
+            request, 100_000, 10_000, max_files, memory_limit, str(tmp_path)
+        )
+
+    spools = asyncio.run(scenario(max_files=5, memory_limit=len(PDF) + 50))
+    assert [spool.filename for spool in spools] == ["a.pdf", "big.pdf", "c.png"]
+    # The oversized file is dropped on its own; the memory limit is shared
+    assert spools[1].error == "File is too large" and spools[1].source is None
+    assert spools[0].in_memory and spools[0].source == PDF
+    assert not spools[2].in_memory and spools[2].size == 108
+    for spool in spools:
+        spool.close()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(scenario(max_files=2, memory_limit=0))
+    assert error.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_detect_file_type():
+    assert detect_file_type(b"%PDF-1.4") == "pdf"
+    assert detect_file_type(b"\n\n%PDF-1.4") == "pdf"
+    assert detect_file_type(b"\xff\xd8\xff\xe0") == "jpeg"
+    assert detect_file_type(b"II*\x00") == "tiff"
+    assert detect_file_type(b"PK\x03\x04") == "zip"
+    assert detect_file_type(b"hello") is None
+
+
+def test_discard_keeps_the_error_and_drops_the_content(tmp_path):
+    spool = UploadSpool("a.pdf", 10, str(tmp_path))
+    spool.write(PDF)
+    spool.discard("File is too large")
+    spool.write(b"more")
+    spool.finish()
+    assert spool.error == "File is too large" and spool.source is None
+    assert spool.size == len(PDF) + 4
+    assert list(tmp_path.iterdir()) == []
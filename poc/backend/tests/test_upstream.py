@@ -0,0 +1,94 @@
+import asyncio
+
+import httpx
+import pytest
+
+from upstream import UpstreamClient, UpstreamError
+
+COMPLETION = {"choices": [{"message": {"content": "ok"}}], "usage": {"total_tokens": 7}}
+
+
+def client_with(handler, **kwargs) -> UpstreamClient:
+    client = UpstreamClient("http://upstream/v1/chat/completions", "key", **kwargs)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def run(client: UpstreamClient, payload: dict) -> dict:
+    async def scenario():
+        try:
+            return await client.chat_completion(payload)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(scenario())
+
+
+def test_transient_failures_are_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("connection refused")
+        if len(calls) == 2:
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        return httpx.Response(200, json=COMPLETION)
+
+    client = client_with(handler, backoff_base=0.001)
+    assert run(client, {"model": "m"}) == COMPLETION
+    assert len(calls) == 3
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(400, json={"error": "bad request"})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        run(client_with(handler), {"model": "m"})
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429, headers={"Retry-After": "0"})
+
+    with pytest.raises(UpstreamError, match="after 3 attempts"):
+        run(client_with(handler, max_retries=2), {"model": "m"})
+    assert len(calls) == 3
+
+
+def test_backoff_honours_retry_after_within_the_cap():
+    client = UpstreamClient("http://upstream", "key", backoff_base=0.5, backoff_max=8.0)
+    assert client.backoff_delay(0, "3") == 3.0
+    assert client.backoff_delay(0, "120") == 8.0
+    # Not a number (e.g. an HTTP date): jittered exponential backoff
+    for attempt in range(6):
+        delay = client.backoff_delay(attempt, "Wed, 21 Oct 2026 07:28:00 GMT")
+        assert 0 <= delay <= min(8.0, 0.5 * 2**attempt)
+
+
+def test_cancelled_calls_are_counted():
+    async def scenario():
+        sent = asyncio.Event()
+
+        async def handler(request):
+            sent.set()
+            await asyncio.sleep(10)
+
+        client = client_with(handler)
+        call = asyncio.ensure_future(client.chat_completion({"model": "m"}))
+        await sent.wait()
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await client.aclose()
+        return client.cancelled
+
+    assert asyncio.run(scenario()) == {"queued": 0, "in_flight": 1}
@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+import fitz  # PyMuPDF
+
+
+@dataclass(frozen=True)
+class TextLayerPolicy:
+    """
+    When a page's own text layer is trusted instead of sending it to the VLM.
+
+    A page qualifies when it has at least `min_glyphs` visible characters,
+    text blocks cover at least `min_text_coverage` of the page, images cover
+    at most `max_image_ratio` of it, and at most `max_unmapped_ratio` of the
+    characters are U+FFFD (fonts without a usable unicode mapping).
+    """
+
+    min_glyphs: int = 100
+    min_text_coverage: float = 0.02
+    max_image_ratio: float = 0.3
+    max_unmapped_ratio: float = 0.01
+
+    @property
+    def label(self) -> str:
+        return (
+            f"text{self.min_glyphs}-{self.min_text_coverage}"
+            f"-{self.max_image_ratio}-{self.max_unmapped_ratio}"
+        )
+
+    def classify(self, page: fitz.Page) -> Tuple[bool, dict]:
+        """
+        Returns: (True if the text layer is reliable, measured metrics)
+        """
+        metrics = text_layer_metrics(page)
+        reliable = (
+            metrics["glyphs"] >= self.min_glyphs
+            and metrics["text_coverage"] >= self.min_text_coverage
+            and metrics["image_ratio"] <= self.max_image_ratio
+            and metrics["unmapped_ratio"] <= self.max_unmapped_ratio
+        )
+        return reliable, metrics
+
+
+def text_layer_metrics(page: fitz.Page) -> dict:
+    page_area = abs(page.rect) or 1.0
+
+    text = page.get_text("text")
+    glyphs = sum(1 for char in text if not char.isspace())
+    unmapped = text.count("\ufffd")
+
+    text_area = 0.0
+    for block in page.get_text("blocks"):
+        # (x0, y0, x1, y1, text, block_no, block_type); type 0 is text
+        if block[6] == 0 and block[4].strip():
+            text_area += abs(fitz.Rect(block[:4]) & page.rect)
+
+    image_area = sum(
+        abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info()
+    )
+
+    return {
+        "glyphs": glyphs,
+        "text_coverage": round(min(1.0, text_area / page_area), 4),
+        "image_ratio": round(min(1.0, image_area / page_area), 4),
+        "unmapped_ratio": round(unmapped / glyphs, 4) if glyphs else 0.0,
+    }
+
+
+def page_to_markdown(page: fitz.Page) -> str:
+    """
+    Markdown from the page's text layer: tables as markdown tables, other text
+    blocks as paragraphs separated by '###', in reading order
+    """
+    parts = []
+    table_rects = []
+    try:
+        tables = page.find_tables().tables
+    except Exception:
+        # Table detection is best effort; fall back to plain text blocks
+        tables = []
+    for table in tables:
+        rect = fitz.Rect(table.bbox)
+        table_rects.append(rect)
+        parts.append((rect.y0, rect.x0, table.to_markdown(clean=False).strip()))
+
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks", sort=True):
+        if block_type != 0 or not text.strip():
+            continue
+        rect = fitz.Rect(x0, y0, x1, y1)
+        if any(rect.intersects(table) for table in table_rects):
+            continue
+        lines = [" ".join(line.split()) for line in text.splitlines()]
+        parts.append((y0, x0, "\n".join(line for line in lines if line)))
+
+    parts.sort(key=lambda part: (round(part[0]), part[1]))
+    return "\n###\n".join(part[2] for part in parts)
@@ -0,0 +1,163 @@
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import List, Tuple
+
+from invoice_rules import is_separator_row, split_table_row
+
+# Lines compared at each seam when looking for the overlap
+SEAM_LINES = 8
+# Similarity above which two lines read from the overlap are the same line
+SEAM_MATCH_RATIO = 0.85
+
+
+@dataclass(frozen=True)
+class TilingPolicy:
+    """
+    Oversized pages are cut into horizontal strips sent to the VLM
+    concurrently. Full-width strips keep text lines and table rows whole.
+
+    max_tile_height: tallest strip in pixels (most VLMs downsample beyond this)
+    max_tile_pixels: largest strip area in pixels
+    overlap_px: rows shared by consecutive strips, so no line is lost at a cut
+    max_tiles: most strips per page; pages that would need more are rendered
+        smaller, and strips are made taller when the page is still too long
+    """
+
+    max_tile_height: int = 2048
+    max_tile_pixels: int = 2_500_000
+    overlap_px: int = 96
+    max_tiles: int = 8
+
+    @property
+    def label(self) -> str:
+        return (
+            f"tile{self.max_tile_height}-{self.max_tile_pixels}"
+            f"-{self.overlap_px}-{self.max_tiles}"
+        )
+
+    @property
+    def max_page_pixels(self) -> int:
+        return self.max_tile_pixels * self.max_tiles
+
+    @property
+    def max_page_height(self) -> int:
+        """
+        Tallest page that fits in `max_tiles` strips of `max_tile_height`
+        """
+        return self.max_tiles * (self.max_tile_height - self.overlap_px) + self.overlap_px
+
+    def plan(self, width: int, height: int) -> List[Tuple[int, int, int, int]]:
+        """
+        Strip boxes (x0, y0, x1, y1) in reading order
+        Returns: a single box when the page does not need tiling
+        """
+        tile_height = min(self.max_tile_height, self.max_tile_pixels // max(1, width))
+        if height <= tile_height:
+            return [(0, 0, width, height)]
+        # At least a few lines of new content per strip
+        tile_height = max(tile_height, 4 * self.overlap_px)
+        stride = tile_height - self.overlap_px
+        count = -(-(height - self.overlap_px) // stride)
+        if self.max_tiles > 0:
+            # Taller strips rather than more of them
+            count = min(count, self.max_tiles)
+        # Spread the strips evenly instead of leaving a sliver at the bottom
+        tile_height = -(-(height + (count - 1) * self.overlap_px) // count)
+        boxes = []
+        for i in range(count):
+            top = min(i * (tile_height - self.overlap_px), height - tile_height)
+            boxes.append((0, top, width, top + tile_height))
+        return boxes
+
+
+def _normalize_line(line: str) -> str:
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def _same_line(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if re.search(r"\d", a + b):
+        # Item rows often differ only by a number; those must match exactly
+        return False
+    return SequenceMatcher(None, a, b).ratio() >= SEAM_MATCH_RATIO
+
+
+def seam_overlap(upper: List[str], lower: List[str]) -> Tuple[int, int]:
+    """
+    Where the last lines of `upper` repeat at the start of `lower`. The line
+    cut by the seam may be read partially on either side: one trailing line
+    of `upper` or one leading line of `lower` may be left out of the match.
+    Returns: (lines to drop from the end of `upper`, lines to skip in `lower`)
+    """
+    upper_index = [i for i, line in enumerate(upper) if line.strip()][-SEAM_LINES:]
+    lower_index = [i for i, line in enumerate(lower) if line.strip()][: SEAM_LINES + 1]
+    tail = [_normalize_line(upper[i]) for i in upper_index]
+    head = [_normalize_line(lower[i]) for i in lower_index]
+    best = None
+    for cut_upper in (0, 1):
+        for cut_lower in (0, 1):
+            candidate_tail = tail[: len(tail) - cut_upper]
+            candidate_head = head[cut_lower:]
+            for size in range(min(len(candidate_tail), len(candidate_head)), 0, -1):
+                if all(
+                    _same_line(a, b)
+                    for a, b in zip(candidate_tail[-size:], candidate_head[:size])
+                ):
+                    if best is None or size > best[0]:
+                        drop = len(upper) - upper_index[-1] if cut_upper else 0
+                        best = (size, drop, lower_index[cut_lower + size - 1] + 1)
+                    break
+    return (best[1], best[2]) if best else (0, 0)
+
+
+def _is_table_row(line: str) -> bool:
+    return line.strip().startswith("|")
+
+
+def _continues_table(upper: List[str], lower: List[str]) -> bool:
+    """
+    True when `lower` opens with a header row + separator for the table
+    `upper` ends with
+    """
+    return (
+        len(lower) >= 2
+        and _is_table_row(upper[-1])
+        and _is_table_row(lower[0])
+        and is_separator_row(split_table_row(lower[1]))
+        and len(split_table_row(lower[0])) == len(split_table_row(upper[-1]))
+    )
+
+
+def stitch_markdown(parts: List[str]) -> str:
+    """
+    Markdown of a tiled page from the markdown of its strips, top to bottom.
+    Lines read twice from the overlap are dropped, and a table cut by a
+    seam continues without the header the VLM repeats on the next strip.
+    """
+    lines: List[str] = []
+    for part in parts:
+        part_lines = part.strip().splitlines()
+        if not part_lines:
+            continue
+        if not lines:
+            lines = part_lines
+            continue
+
+        if _continues_table(lines, part_lines):
+            # Repeated (or invented) header of the table continued from above
+            part_lines = part_lines[2:]
+        drop, skip = seam_overlap(lines, part_lines)
+        if drop:
+            # The line cut by the seam is read whole on the lower strip
+            lines = lines[:-drop]
+        part_lines = part_lines[skip:]
+        while part_lines and not part_lines[0].strip():
+            part_lines = part_lines[1:]
+        if not part_lines:
+            continue
+        if not (_is_table_row(lines[-1]) and _is_table_row(part_lines[0])):
+            lines.append("")
+        lines.extend(part_lines)
+    return "\n".join(lines)
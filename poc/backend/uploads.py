@@ -0,0 +1,368 @@
+import hashlib
+import io
+import os
+import tempfile
+from typing import Callable, List, Optional, Union
+
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+PDF_MAGIC = b"%PDF-"
+# Leading bytes of the other file types accepted by batch uploads
+FILE_MAGICS = [
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"PK\x03\x04", "zip"),
+]
+# The PDF header must appear within the first 1024 bytes of the file
+PDF_HEADER_WINDOW = 1024
+# Allowance for multipart boundaries and part headers in Content-Length
+MULTIPART_OVERHEAD = 16 * 1024
+
+# Request body schema for endpoints that parse the upload stream themselves
+PDF_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+BATCH_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["files"],
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                        }
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+class UploadSpool:
+    """
+    Body of an uploaded file, received chunk by chunk.
+
+    Kept in memory up to `memory_limit` bytes, then spilled to a uniquely
+    named temp file in `spool_dir`, so concurrent uploads never collide.
+    The sha256 of the content is computed while streaming. Work that may
+    outlive the request holds its own reference with `retain`; the content
+    is released when the last holder calls `close`, which also runs the
+    callbacks registered with `on_close`.
+    """
+
+    def __init__(self, filename: str, memory_limit: int, spool_dir: str, suffix: str = ".pdf"):
+        self.filename = filename
+        self.memory_limit = memory_limit
+        self.spool_dir = spool_dir
+        self.suffix = suffix
+        # Set when the content was dropped (e.g. a file too large in a batch)
+        self.error: Optional[str] = None
+        self.size = 0
+        self.head = b""
+        self.path: Optional[str] = None
+        self._digest = hashlib.sha256()
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        # In-memory content once the upload is finished
+        self._content: Optional[bytes] = None
+        self._file = None
+        self._refs = 1
+        self._on_close: List[Callable[[], None]] = []
+
+    @property
+    def in_memory(self) -> bool:
+        return self._buffer is not None or self._content is not None
+
+    @property
+    def closed(self) -> bool:
+        return self._refs <= 0
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """
+        What fitz should open: the bytes for small files, the temp path otherwise.
+        Every reader gets the same bytes object; nothing is copied per access.
+        """
+        if self._content is not None:
+            return self._content
+        if self._buffer is not None:
+            # Not finished yet: a snapshot of what has been received
+            return self._buffer.getvalue()
+        return self.path
+
+    def write(self, data: bytes):
+        if self.error is not None:
+            self.size += len(data)
+            return
+        self._digest.update(data)
+        self.size += len(data)
+        if len(self.head) < PDF_HEADER_WINDOW:
+            self.head += data[: PDF_HEADER_WINDOW - len(self.head)]
+
+        if self._buffer is not None and self.size > self.memory_limit:
+            fd, self.path = tempfile.mkstemp(suffix=self.suffix, dir=self.spool_dir)
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(self._buffer.getvalue())
+            self._buffer = None
+        (self._file or self._buffer).write(data)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+        if self._buffer is not None:
+            # The buffer is handed over to an immutable bytes object once
+            self._content = self._buffer.getvalue()
+            self._buffer = None
+
+    def discard(self, error: str):
+        """
+        Drop the content received so far and ignore the rest, keeping `error`
+        """
+        self.error = error
+        self.finish()
+        self._content = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def on_close(self, callback: Callable[[], None]):
+        self._on_close.append(callback)
+
+    def retain(self) -> "UploadSpool":
+        self._refs += 1
+        return self
+
+    def close(self):
+        """
+        Drop one reference; the last one releases the buffer and removes
+        the temp file, if any
+        """
+        self._refs -= 1
+        if self._refs > 0:
+            return
+        self.finish()
+        self._content = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        callbacks, self._on_close = self._on_close, []
+        for callback in callbacks:
+            callback()
+
+
+async def _receive_parts(
+    request: Request,
+    max_body_bytes: int,
+    field_name: str,
+    open_part: Callable[[str], UploadSpool],
+    on_data: Callable[[UploadSpool, bool], None],
+    on_end: Callable[[UploadSpool], None],
+) -> List[UploadSpool]:
+    """
+    Stream the `field_name` file parts of a multipart body into UploadSpools.
+
+    `open_part(filename)` creates the spool of a part (or raises to reject
+    the request), `on_data(spool, header_was_complete)` runs after every
+    chunk and `on_end(spool)` when the part is complete. Spools received so
+    far are closed when the request fails.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > max_body_bytes:
+            raise HTTPException(status_code=413, detail="Uploaded file is too large")
+
+    state = {"header_field": b"", "headers": {}, "current": None}
+    spools: List[UploadSpool] = []
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["current"] = None
+
+    def on_header_field(data: bytes, start: int, end: int):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        field = state["header_field"].lower()
+        state["headers"][field] = state["headers"].get(field, b"") + data[start:end]
+
+    def on_header_end():
+        state["header_field"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(
+            state["headers"].get(b"content-disposition", b"")
+        )
+        if disposition.get(b"name", b"").decode() != field_name:
+            return
+        filename = disposition.get(b"filename", b"").decode("utf-8", "replace")
+        state["current"] = open_part(filename)
+        spools.append(state["current"])
+
+    def on_part_data(data: bytes, start: int, end: int):
+        spool = state["current"]
+        if spool is None:
+            return
+        checked = len(spool.head) >= PDF_HEADER_WINDOW
+        spool.write(data[start:end])
+        on_data(spool, checked)
+
+    def on_part_end():
+        if state["current"] is not None:
+            on_end(state["current"])
+            state["current"].finish()
+            state["current"] = None
+
+    parser = MultipartParser(
+        params[b"boundary"],
+        {
+            "on_part_begin": on_part_begin,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+        },
+    )
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        for spool in spools:
+            spool.close()
+        raise
+    return spools
+
+
+async def receive_pdf_upload(
+    request: Request,
+    max_bytes: int,
+    memory_limit: int,
+    spool_dir: str,
+    field_name: str = "file",
+) -> UploadSpool:
+    """
+    Stream a multipart PDF upload into an UploadSpool.
+
+    The filename and the PDF header are checked as soon as they arrive and
+    the size limit is enforced per chunk, so bad uploads are rejected before
+    the rest of the body is read.
+    """
+
+    def open_part(filename: str) -> UploadSpool:
+        if not filename.endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+        if state["received"]:
+            raise HTTPException(status_code=400, detail="Only one file per request")
+        state["received"] = True
+        return UploadSpool(filename, memory_limit, spool_dir)
+
+    def on_data(spool: UploadSpool, checked: bool):
+        if spool.size > max_bytes:
+            raise HTTPException(status_code=413, detail="Uploaded file is too large")
+        if not checked and len(spool.head) >= PDF_HEADER_WINDOW:
+            check_pdf_header(spool)
+
+    state = {"received": False}
+    spools = await _receive_parts(
+        request, max_bytes + MULTIPART_OVERHEAD, field_name, open_part, on_data, check_pdf_header
+    )
+    if not spools:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    return spools[0]
+
+
+async def receive_batch_upload(
+    request: Request,
+    max_bytes: int,
+    max_file_bytes: int,
+    max_files: int,
+    memory_limit: int,
+    spool_dir: str,
+    field_name: str = "files",
+) -> List[UploadSpool]:
+    """
+    Stream a multipart upload of several files into UploadSpools, in order.
+
+    At most `memory_limit` bytes of the whole batch stay in memory, later
+    files spill to disk. A file over `max_file_bytes` is not kept: its
+    spool is discarded with an error, reported for that file only. Too many
+    files or more than `max_bytes` in total reject the whole request.
+    """
+    received: List[UploadSpool] = []
+    state = {"finished_bytes": 0}
+
+    def open_part(filename: str) -> UploadSpool:
+        if len(received) >= max_files:
+            raise HTTPException(status_code=413, detail=f"At most {max_files} files per batch")
+        in_memory = sum(spool.size for spool in received if spool.in_memory)
+        suffix = os.path.splitext(filename)[1].lower()
+        spool = UploadSpool(filename, max(0, memory_limit - in_memory), spool_dir, suffix)
+        received.append(spool)
+        return spool
+
+    def on_data(spool: UploadSpool, checked: bool):
+        if state["finished_bytes"] + spool.size > max_bytes:
+            raise HTTPException(status_code=413, detail="Uploaded files are too large")
+        if spool.error is None and spool.size > max_file_bytes:
+            spool.discard("File is too large")
+
+    def on_end(spool: UploadSpool):
+        state["finished_bytes"] += spool.size
+
+    spools = await _receive_parts(
+        request, max_bytes + MULTIPART_OVERHEAD * max_files, field_name, open_part, on_data, on_end
+    )
+    if not spools:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    return spools
+
+
+def check_pdf_header(spool: UploadSpool):
+    if PDF_MAGIC not in spool.head:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
+
+
+def detect_file_type(head: bytes) -> Optional[str]:
+    """
+    Type of an uploaded file from its first bytes: pdf, tiff, jpeg, png or
+    zip (None when unsupported)
+    """
+    for magic, file_type in FILE_MAGICS:
+        if head.startswith(magic):
+            return file_type
+    if PDF_MAGIC in head[:PDF_HEADER_WINDOW]:
+        return "pdf"
+    return None
@@ -0,0 +1,177 @@
+import asyncio
+import random
+from typing import Optional
+
+import httpx
+
+from hedging import Hedger
+from ratelimit import UpstreamLimiter
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """Raised when the model API keeps failing after all retries"""
+
+
+class UpstreamClient:
+    """
+    Shared async client for the chat completions API.
+
+    Keeps a pool of keep-alive connections to API_URL so the VLM and LLM stages
+    stop paying a TLS handshake per call, and retries transient failures
+    (transport errors, 429, 5xx) with jittered exponential backoff.
+    With a `limiter`, every attempt first waits for the model's quota and
+    a concurrency slot, and reports back how it went. With a `hedger`, a
+    call that is slower than usual is duplicated and the first answer wins.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        limiter: Optional[UpstreamLimiter] = None,
+        hedger: Optional[Hedger] = None,
+    ):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = limiter
+        self.hedger = hedger
+        # Calls abandoned by their caller, before or after the request was sent
+        self.cancelled = {"queued": 0, "in_flight": 0}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool is bound to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}",
+                },
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Full-jitter exponential backoff, honouring a numeric Retry-After header
+        """
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        ceiling = min(self.backoff_max, self.backoff_base * (2**attempt))
+        return random.uniform(0, ceiling)
+
+    async def chat_completion(self, payload: dict) -> dict:
+        """
+        POST a chat completion payload and return the decoded JSON response
+        """
+        if self.hedger is None:
+            return await self._chat_completion(payload)
+        model = payload.get("model", "")
+        return await self.hedger.run(
+            model, lambda: self._chat_completion(payload), is_busy=lambda: self._busy(model)
+        )
+
+    def _busy(self, model: str) -> bool:
+        # Requests already waiting for the model: a hedge would only queue
+        return self.limiter is not None and self.limiter.for_model(model).waiting > 0
+
+    async def _chat_completion(self, payload: dict) -> dict:
+        state = {"sent": False}
+        try:
+            return await self._send_with_retries(payload, state)
+        except asyncio.CancelledError:
+            self.cancelled["in_flight" if state["sent"] else "queued"] += 1
+            raise
+
+    async def _post(self, payload: dict, state: dict) -> httpx.Response:
+        # `sent` stays set only if the caller is cancelled mid-request
+        state["sent"] = True
+        try:
+            response = await self.client.post(self.api_url, json=payload)
+        except Exception:
+            state["sent"] = False
+            raise
+        state["sent"] = False
+        return response
+
+    async def _send_with_retries(self, payload: dict, state: dict) -> dict:
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                if self.limiter is None:
+                    response = await self._post(payload, state)
+                else:
+                    async with self.limiter.slot(payload) as permit:
+                        try:
+                            response = await self._post(payload, state)
+                        except httpx.TransportError:
+                            permit.outcome = "error"
+                            raise
+                        permit.outcome = _outcome(response.status_code)
+                        if permit.outcome == "ok":
+                            permit.used_tokens = _used_tokens(response)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = response.headers.get("Retry-After")
+                last_error = UpstreamError(
+                    f"Upstream returned HTTP {response.status_code}"
+                )
+            except httpx.TransportError as e:
+                last_error = e
+
+            if attempt < self.max_retries:
+                delay = self.backoff_delay(attempt, retry_after)
+                print(
+                    f"⚠️ Upstream call failed ({last_error}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+
+        raise UpstreamError(
+            f"Upstream call failed after {self.max_retries + 1} attempts: {last_error}"
+        )
+
+
+def _outcome(status_code: int) -> str:
+    if status_code == 429:
+        return "throttled"
+    if status_code >= 500:
+        return "error"
+    return "ok"
+
+
+def _used_tokens(response: httpx.Response) -> Optional[int]:
+    try:
+        return int(response.json()["usage"]["total_tokens"])
+    except (ValueError, KeyError, TypeError):
+        return None
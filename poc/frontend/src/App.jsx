@@ -1,7 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Layout, Row, Col, Upload, Button, message, Spin, Typography, Card, Pagination } from 'antd';
 import { InboxOutlined, ThunderboltOutlined, CheckCircleOutlined, DeleteOutlined, ZoomInOutlined, ZoomOutOutlined } from '@ant-design/icons';
-import axios from 'axios';
 import InvoiceJsonForm from './InvoiceJsonForm';
 import { Document, Page, pdfjs } from 'react-pdf';
 import 'react-pdf/dist/Page/AnnotationLayer.css';
@@ -109,36 +108,67 @@ function App() {
     setLoading(true);
     setResults([]);
     setEditedResults([]);
+    setTotalPages(0);
+    setCurrentJsonPage(1);
 
     const formData = new FormData();
     formData.append('file', file);
 
+    // Each page result is streamed as soon as it is ready (one JSON object per line)
+    const handleEvent = (event) => {
+      if (event.event === 'page') {
+        const index = event.page - 1;
+        setResults(prev => {
+          const next = [...prev];
+          next[index] = event;
+          return next;
+        });
+        setEditedResults(prev => {
+          const next = [...prev];
+          next[index] = event.parsed_json;
+          return next;
+        });
+        setTotalPages(prev => Math.max(prev, event.page));
+      } else if (event.event === 'summary') {
+        setTotalPages(event.total_pages);
+        if (event.success) {
+          message.success(`Successfully extracted ${event.total_pages} page(s) in ${event.timings.total_seconds}s!`);
+        } else {
+          message.warning('Some pages could not be extracted');
+        }
+      } else if (event.event === 'error') {
+        message.error(event.detail);
+      }
+    };
+
     try {
-      const response = await axios.post('http://localhost:8000/api/convert', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
-        timeout: 120000, // 2 minutes timeout
+      const response = await fetch('http://localhost:8000/api/convert/stream?format=ndjson', {
+        method: 'POST',
+        body: formData,
       });
 
-      if (response.data.success) {
-        // Store results array
-        setResults(response.data.results);
-        // Initialize edited results with parsed JSON data
-        setEditedResults(response.data.results.map(r => r.parsed_json));
-        setTotalPages(response.data.total_pages);
-        setCurrentJsonPage(1);
-        message.success(`Successfully extracted ${response.data.total_pages} page(s)!`);
-      } else {
-        message.error('Conversion failed!');
+      if (!response.ok) {
+        message.error(`Backend error: ${response.status}`);
+        return;
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+      }
+      if (buffer.trim()) {
+        handleEvent(JSON.parse(buffer));
       }
     } catch (error) {
       console.error('Error:', error);
-      if (error.code === 'ECONNABORTED') {
-        message.error('Request timeout! Please try again.');
-      } else if (error.response) {
-        message.error(`Backend error: ${error.response.status}`);
-      } else if (error.request) {
+      if (error instanceof TypeError) {
         message.error('Cannot connect to backend. Make sure it is running at http://localhost:8000');
       } else {
         message.error(`Error: ${error.message}`);
@@ -343,7 +373,7 @@ function App() {
                 padding: 0
               }}
             >
-              {loading ? (
+              {loading && editedResults.length === 0 ? (
                 <div style={{ textAlign: 'center', paddingTop: '100px' }}>
                   <Spin size="large" />
                   <p style={{ marginTop: 20, color: '#666' }}>